@@ -0,0 +1,272 @@
+#!/usr/bin/python3
+
+"""Throughput benchmarks for Pog's encrypt and restore paths.
+
+Each case runs in a fresh interpreter, so peak RSS numbers are per-case.
+Results are saved per git commit, so runs can be compared between commits.
+Run it from a checkout, as `python -m benchmarks.run` -- it isn't installed with the package.
+
+Usage:
+  benchmarks.run [--quick] [--datasets=<names>] [--backends=<names>] [--chunk-sizes=<sizes>]
+                 [--compresslevels=<levels>] [--concurrency=<threads>] [--results=<filename>] [--compare=<commit>]
+  benchmarks.run compare <COMMIT_A> <COMMIT_B> [--results=<filename>]
+  benchmarks.run (-h | --help)
+
+Examples:
+  python -m benchmarks.run --quick
+  python -m benchmarks.run --backends=local,s3 --datasets=huge-random --concurrency=1,4,16
+  python -m benchmarks.run --compare=8ef210e
+  python -m benchmarks.run compare 8ef210e b7e4fbe
+
+Options:
+  -h --help                  Show this help.
+  --backends=<names>         Comma-separated. `s3` is a local stand-in, and requires `moto`. [default: local]
+  --chunk-sizes=<sizes>      Comma-separated list of chunk sizes to try. [default: 100MB,10MB]
+  --compare=<commit>         After running, compare the results against a previous commit's.
+  --compresslevels=<levels>  Comma-separated list of zstd levels (or adaptive ranges, like 1-19) to try. [default: 3,9]
+  --concurrency=<threads>    Comma-separated list of thread counts to try. [default: 1,8]
+  --datasets=<names>         Comma-separated. [default: small-text,small-random,huge-text,huge-random]
+  --quick                    Smaller datasets, and only the first chunk size, level and concurrency.
+  --results=<filename>       Where results are saved, keyed by commit. [default: benchmarks/results.json]
+"""
+import resource
+import sys
+from contextlib import contextmanager, redirect_stdout
+from datetime import datetime
+from json import dump, load
+from multiprocessing import get_context
+from os import chdir, devnull, environ, makedirs, path, urandom
+from subprocess import CalledProcessError, check_output
+from tempfile import TemporaryDirectory
+from time import monotonic
+
+from docopt import docopt
+from humanfriendly import format_size, parse_size
+
+from pog.fs.pogfs import get_cloud_fs
+from pog.lib.adaptive import parse_compresslevel
+from pog.lib.blob_store import BlobStore
+from pog.pog import Decryptor, Encryptor
+
+
+SECRET = b'0123456789abcdef0123456789abcdef'
+S3_BUCKET = 'pog-benchmark'
+
+# (number of files, size per file) -- full size, then --quick
+DATASETS = {
+    'small-text': ((2000, 4096), (200, 4096)),
+    'small-random': ((2000, 4096), (200, 4096)),
+    'huge-text': ((2, 200000000), (2, 20000000)),
+    'huge-random': ((2, 200000000), (2, 20000000)),
+}
+
+SAMPLE_TEXT = b'''069:15:22 Lovell (onboard): Hey, I don't see a thing. Where are we?
+069:15:24 Anders (onboard): It looks like a big - looks like a big beach down there.
+'''
+
+
+def _peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':  # bytes, not KB
+        rss = rss // 1024
+    return rss / 1024
+
+
+def _git_commit():
+    try:
+        commit = check_output(['git', 'rev-parse', '--short', 'HEAD']).decode('utf-8').strip()
+        dirty = check_output(['git', 'status', '--porcelain', '--untracked-files=no']).strip()
+    except (CalledProcessError, OSError):
+        return 'unknown'
+    return '{}-dirty'.format(commit) if dirty else commit
+
+
+def make_dataset(dirname, name, quick=False):
+    num_files, file_size = DATASETS[name][1 if quick else 0]
+    makedirs(dirname, exist_ok=True)
+    for i in range(num_files):
+        with open(path.join(dirname, '{}-{:05}.bin'.format(name, i)), 'wb') as f:
+            remaining = file_size
+            while remaining > 0:
+                n = min(remaining, 1000000)
+                if name.endswith('random'):
+                    chunk = urandom(n)
+                else:
+                    chunk = (SAMPLE_TEXT * (n // len(SAMPLE_TEXT) + 1))[:n]
+                f.write(chunk)
+                remaining -= n
+    return num_files, num_files * file_size
+
+
+@contextmanager
+def _backend(name):
+    '''
+    yields (save_to, mfn prefix) for the backend.
+    The s3 backend is an in-process fake, courtesy of moto.
+    '''
+    if name == 'local':
+        yield 'local', 'local:///'
+        return
+
+    if name == 's3':
+        from moto import mock_aws
+        import boto3
+        for var in ('AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY', 'AWS_SESSION_TOKEN'):
+            environ[var] = 'benchmark'
+        environ['AWS_DEFAULT_REGION'] = 'us-east-1'
+        with mock_aws():
+            boto3.client('s3').create_bucket(Bucket=S3_BUCKET)
+            yield 's3://{}'.format(S3_BUCKET), 's3://{}/'.format(S3_BUCKET)
+        return
+
+    raise ValueError('unknown backend: {}'.format(name))
+
+
+def _available_backends(names):
+    '''
+    without moto there's no s3 stand-in, so s3 is skipped -- with a warning, rather than failing the whole run.
+    '''
+    if 's3' not in names:
+        return names
+    try:
+        import moto  # noqa: F401
+    except ImportError:
+        print('*** skipping the s3 backend: it needs `pip install moto`', file=sys.stderr)
+        return [n for n in names if n != 's3']
+    return names
+
+
+def run_case(case):
+    '''
+    runs in a child process. Encrypts the dataset to the backend, then restores it.
+    '''
+    with TemporaryDirectory() as workdir, open(devnull, 'w') as quiet, redirect_stdout(quiet):
+        chdir(workdir)
+        with _backend(case['backend']) as (save_to, mfn_prefix):
+            compresslevel, adaptive_level = parse_compresslevel(case['compresslevel'])
+            en = Encryptor(
+                SECRET, chunk_size=case['chunk_size'], compresslevel=compresslevel,
+                concurrency=case['concurrency'], blob_store=BlobStore(save_to), adaptive_level=adaptive_level,
+            )
+            start = monotonic()
+            mfn = en.encrypt(case['input'])
+            encrypt_seconds = monotonic() - start
+            encrypt_rss = _peak_rss_mb()
+
+            target, bucket = BlobStore(save_to).save_to[0]
+            blobs = [f for f in get_cloud_fs(target)(bucket).list_files('data/', recursive=True) if not f.endswith('/')]
+
+            start = monotonic()
+            Decryptor(SECRET).decrypt(mfn_prefix + mfn)
+            restore_seconds = monotonic() - start
+
+    return {
+        'encrypt_seconds': encrypt_seconds,
+        'restore_seconds': restore_seconds,
+        'blobs': len(blobs),
+        'encrypt_peak_rss_mb': encrypt_rss,
+        'peak_rss_mb': _peak_rss_mb(),
+    }
+
+
+def _summarize(case, timings):
+    res = dict(case)
+    res.pop('input')
+    res.update(timings)
+    for stage in ('encrypt', 'restore'):
+        seconds = max(timings['{}_seconds'.format(stage)], 0.000001)
+        res['{}_mb_s'.format(stage)] = case['bytes'] / seconds / 1000000
+        res['{}_files_s'.format(stage)] = case['files'] / seconds
+        res['{}_blobs_s'.format(stage)] = timings['blobs'] / seconds
+    return res
+
+
+def _case_id(case):
+    return '{dataset}/{backend}/chunk={chunk}/level={compresslevel}/threads={concurrency}'.format(
+        chunk=format_size(case['chunk_size']), **case
+    )
+
+
+def _print_result(case_id, res):
+    print('{:<60} enc {:>8.2f} MB/s {:>9.1f} files/s | dec {:>8.2f} MB/s {:>9.1f} files/s | {:>7.1f} MB rss'.format(
+        case_id, res['encrypt_mb_s'], res['encrypt_files_s'], res['restore_mb_s'], res['restore_files_s'],
+        res['peak_rss_mb'],
+    ))
+
+
+def load_results(filename):
+    if not path.exists(filename):
+        return {}
+    with open(filename) as f:
+        return load(f)
+
+
+def save_results(filename, commit, results):
+    all_results = load_results(filename)
+    previous = all_results.get(commit, {}).get('results', {})
+    all_results[commit] = {'date': datetime.now().isoformat(), 'results': {**previous, **results}}
+    with open(filename, 'w') as f:
+        dump(all_results, f, indent=2, sort_keys=True)
+
+
+def compare(old, new):
+    metrics = ('encrypt_mb_s', 'restore_mb_s', 'encrypt_files_s', 'restore_files_s', 'peak_rss_mb')
+    for case_id in sorted(set(old) & set(new)):
+        changes = []
+        for m in metrics:
+            before, after = old[case_id][m], new[case_id][m]
+            pct = (after - before) / before * 100 if before else 0
+            changes.append('{} {:+.1f}%'.format(m, pct))
+        print('{:<60} {}'.format(case_id, ', '.join(changes)))
+
+
+def main():
+    args = docopt(__doc__)
+    results_file = args['--results']
+
+    if args['compare']:
+        all_results = load_results(results_file)
+        compare(all_results[args['<COMMIT_A>']]['results'], all_results[args['<COMMIT_B>']]['results'])
+        return
+
+    quick = args['--quick']
+    options = {}
+    for opt in ('--datasets', '--backends', '--chunk-sizes', '--compresslevels', '--concurrency'):
+        values = [v.strip() for v in args[opt].split(',')]
+        reducible = opt not in ('--datasets', '--backends')
+        options[opt] = values[:1] if quick and reducible else values
+    options['--backends'] = _available_backends(options['--backends'])
+    if not options['--backends']:
+        sys.exit('no backends to benchmark')
+
+    results = {}
+    ctx = get_context('spawn')
+    with TemporaryDirectory() as datadir:
+        for dataset in options['--datasets']:
+            inputs = path.join(datadir, dataset)
+            num_files, num_bytes = make_dataset(inputs, dataset, quick)
+            for backend in options['--backends']:
+                for chunk_size in options['--chunk-sizes']:
+                    for level in options['--compresslevels']:
+                        for concurrency in options['--concurrency']:
+                            case = {
+                                'dataset': dataset, 'backend': backend, 'input': inputs,
+                                'files': num_files, 'bytes': num_bytes, 'chunk_size': parse_size(chunk_size),
+                                'compresslevel': level, 'concurrency': int(concurrency),
+                            }
+                            with ctx.Pool(1) as pool:
+                                timings = pool.apply(run_case, (case,))
+                            case_id = _case_id(case)
+                            results[case_id] = _summarize(case, timings)
+                            _print_result(case_id, results[case_id])
+
+    commit = _git_commit()
+    save_results(results_file, commit, results)
+    print('*** saved results for {} to {}'.format(commit, results_file))
+
+    if args['--compare']:
+        compare(load_results(results_file)[args['--compare']]['results'], results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,281 @@
+#!/usr/bin/python3
+
+"""Pog agent -- holds derived keys in locked memory, so pog doesn't have to derive them over and over.
+
+pog (and PogCli) will ask the agent for keys when POG_AGENT_SOCK is set.
+Only processes running as the agent's user are answered.
+A password key is only used without prompting if it's asked for by name, with POG_AGENT_KEY=<name>.
+Otherwise pog prompts as usual, and the agent just saves it from deriving the key again.
+
+Usage:
+  pog-agent [--socket=<path>] [--ttl=<seconds>]
+  pog-agent add [--socket=<path>] [--ttl=<seconds>] [--keyfile=<filename> | --name=<name>]
+  pog-agent list [--socket=<path>]
+  pog-agent clear [--socket=<path>]
+  pog-agent (-h | --help)
+
+Examples:
+  pog-agent --ttl=28800 &
+  export POG_AGENT_SOCK=$XDG_RUNTIME_DIR/pog-agent.sock
+  pog-agent add --name=backups
+  POG_AGENT_KEY=backups pog /home/user/docs --save-to=s3://mybucket
+
+Options:
+  -h --help             Show this help.
+  --keyfile=<filename>  Add this keyfile's secret, instead of prompting for a password.
+  --name=<name>         Name the password's key, so POG_AGENT_KEY=<name> can use it without prompting.
+  --socket=<path>       Where the agent listens. Defaults to $POG_AGENT_SOCK, or pog-agent.sock in $XDG_RUNTIME_DIR.
+  --ttl=<seconds>       How long keys are kept. The agent defaults to an hour, and `add` to the agent's setting.
+"""
+import ctypes
+import ctypes.util
+import sys
+from base64 import b64decode, b64encode
+from hashlib import blake2b
+from os import environ, getuid, path, stat, urandom
+from threading import Event, Lock, Thread
+from time import monotonic
+
+from docopt import docopt
+
+from pog.lib.unix_socket import JsonLineServer, _peer_uid, default_socket_path, request
+
+
+def agent_socket_path():
+    return environ.get('POG_AGENT_SOCK')
+
+
+def agent_key_name():
+    return environ.get('POG_AGENT_KEY')
+
+
+_libc = []
+
+
+def _get_libc():
+    # find_library() can be slow, and most processes that import us never need it
+    if not _libc:
+        try:
+            _libc.append(ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True))
+        except OSError:
+            _libc.append(None)
+    return _libc[0]
+
+
+class _LockedSecret():
+    '''
+    a secret in memory that (if the OS lets us) won't be swapped out, and is zeroed when we're done with it.
+    '''
+    def __init__(self, secret):
+        self.libc = _get_libc()
+        self.buf = bytearray(secret)
+        self.cbuf = (ctypes.c_char * len(self.buf)).from_buffer(self.buf)
+        self.locked = bool(self.libc) and self.libc.mlock(self.cbuf, ctypes.c_size_t(len(self.buf))) == 0
+
+    def get(self):
+        return bytes(self.buf)
+
+    def wipe(self):
+        ctypes.memset(self.cbuf, 0, len(self.buf))
+        if self.locked:
+            self.libc.munlock(self.cbuf, ctypes.c_size_t(len(self.buf)))
+            self.locked = False
+
+
+def _keyfile_ident(keyfile):
+    # a keyfile that has been replaced or edited is a different key
+    st = stat(keyfile)
+    return ('keyfile', path.realpath(keyfile), st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+class KeyAgent():
+    def __init__(self, ttl=3600):
+        self.ttl = ttl
+        self.lock = Lock()
+        self.keys = {}  # ident -> (_LockedSecret, expiry)
+        self.names = {}  # name -> ident, for password keys
+        self._salt = urandom(32)
+        self._stopped = Event()
+
+    def _get(self, ident):
+        with self.lock:
+            entry = self.keys.get(ident)
+            if entry and entry[1] > monotonic():
+                return entry[0].get()
+
+    def _put(self, ident, secret, ttl=None):
+        with self.lock:
+            old = self.keys.pop(ident, None)
+            if old:
+                old[0].wipe()
+            self.keys[ident] = (_LockedSecret(secret), monotonic() + (self.ttl if ttl is None else ttl))
+        return secret
+
+    def expire(self):
+        now = monotonic()
+        with self.lock:
+            for ident, (secret, expiry) in list(self.keys.items()):
+                if expiry <= now:
+                    secret.wipe()
+                    del self.keys[ident]
+
+    def clear(self):
+        with self.lock:
+            for secret, _ in self.keys.values():
+                secret.wipe()
+            self.keys.clear()
+            self.names.clear()
+
+    def start_reaper(self, interval=1.0):
+        def reap():
+            while not self._stopped.wait(interval):
+                self.expire()
+        Thread(target=reap, daemon=True).start()
+
+    def stop(self):
+        self._stopped.set()
+        self.clear()
+
+    def _password_secret(self, password, ttl=None, name=None):
+        # we keep a keyed hash of the password to find its key again, never the password itself
+        ident = ('password', blake2b(password.encode('utf-8'), key=self._salt).digest())
+        secret = self._get(ident)
+        if not secret:
+            from pog.lib.secret import pass_to_hash
+            secret = self._put(ident, pass_to_hash(password), ttl)
+        if name:
+            with self.lock:
+                self.names[name] = ident
+        return secret
+
+    def _named_secret(self, name):
+        with self.lock:
+            ident = self.names.get(name)
+        return self._get(ident) if ident else None
+
+    def _name_of(self, ident):
+        return next((name for name, i in self.names.items() if i == ident), '(password)')
+
+    def _keyfile_secret(self, keyfile, ttl=None):
+        from pog.lib.secret import hash_keyfile
+
+        ident = _keyfile_ident(keyfile)
+        return self._get(ident) or self._put(ident, hash_keyfile(keyfile), ttl)
+
+    def handle(self, msg, conn, sock=None):
+        uid = _peer_uid(sock) if sock else None
+        if uid is not None and uid != getuid():
+            conn.send({'error': 'permission denied'})
+            return
+
+        ttl = msg.get('ttl')
+        try:
+            if msg.get('keyfile'):
+                secret = self._keyfile_secret(msg['keyfile'], ttl)
+            elif msg.get('password'):
+                secret = self._password_secret(msg['password'], ttl, msg.get('name'))
+            elif msg.get('name'):
+                secret = self._named_secret(msg['name'])
+            elif msg.get('list'):
+                now = monotonic()
+                with self.lock:
+                    keys = [
+                        {'type': ident[0], 'name': ident[1] if ident[0] == 'keyfile' else self._name_of(ident),
+                         'expires_in': int(expiry - now), 'locked': secret.locked}
+                        for ident, (secret, expiry) in self.keys.items() if expiry > now
+                    ]
+                conn.send({'keys': keys})
+                return
+            elif msg.get('clear'):
+                self.clear()
+                conn.send({})
+                return
+            else:
+                conn.send({'error': 'bad request'})
+                return
+        except OSError as e:
+            conn.send({'error': str(e)})
+            return
+
+        conn.send({'secret': b64encode(secret).decode('utf-8')} if secret else {})
+
+
+def _ask(msg, socket_path=None):
+    socket_path = socket_path or agent_socket_path()
+    try:
+        for res in request(socket_path, msg):
+            return res
+    except (ConnectionRefusedError, FileNotFoundError):
+        return None
+    except PermissionError as e:  # someone else's socket: we don't talk to it, and carry on without it
+        print('pog-agent: {}'.format(e), file=sys.stderr)
+        return None
+
+
+def fetch_secret(keyfile=None, password=None, socket_path=None, ttl=None, name=None):
+    '''
+    returns None if there's no agent, or if it doesn't have (and can't make) the key.
+    A password's key can be given a `name`. Without a keyfile or a password, we get the key by that name.
+    '''
+    if keyfile:
+        msg = {'keyfile': path.abspath(keyfile)}
+    elif password:
+        msg = {'password': password, **({'name': name} if name else {})}
+    elif name:
+        msg = {'name': name}
+    else:
+        return None
+    if ttl is not None:
+        msg['ttl'] = ttl
+
+    res = _ask(msg, socket_path) or {}
+    if res.get('error'):
+        print('pog-agent: {}'.format(res['error']), file=sys.stderr)
+    return b64decode(res['secret']) if res.get('secret') else None
+
+
+def serve(socket_path, ttl):
+    import resource
+    resource.setrlimit(resource.RLIMIT_CORE, (0, 0))  # no keys in core dumps
+
+    agent = KeyAgent(ttl)
+    agent.start_reaper()
+    with JsonLineServer(socket_path, agent.handle) as server:
+        print('*** pog-agent listening. export POG_AGENT_SOCK={}'.format(socket_path), file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            agent.stop()
+
+
+def main():
+    args = docopt(__doc__)
+    socket_path = args['--socket'] or agent_socket_path() or default_socket_path('pog-agent')
+
+    if args['add']:
+        ttl = int(args['--ttl']) if args['--ttl'] else None
+        if args['--keyfile']:
+            secret = fetch_secret(args['--keyfile'], socket_path=socket_path, ttl=ttl)
+        else:
+            from pog.lib.secret import prompt_password
+            secret = fetch_secret(password=prompt_password(), socket_path=socket_path, ttl=ttl, name=args['--name'])
+        if not secret:
+            print('pog-agent is not running at {}'.format(socket_path), file=sys.stderr)
+        sys.exit(0 if secret else 1)
+
+    if args['list'] or args['clear']:
+        res = _ask({'list': True} if args['list'] else {'clear': True}, socket_path)
+        if res is None:
+            print('pog-agent is not running at {}'.format(socket_path), file=sys.stderr)
+            sys.exit(1)
+        for key in res.get('keys', []):
+            print('{type} {name}: expires in {expires_in}s{}'.format('' if key['locked'] else ' (not mlocked)', **key))
+        return
+
+    serve(socket_path, int(args['--ttl'] or 3600))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,19 +1,34 @@
 from collections import defaultdict
+from json import loads
 from os import environ, path
-from subprocess import PIPE, Popen
+from queue import Queue
+from subprocess import PIPE, STDOUT, Popen
+from threading import Event, Thread
+
+from pog.lib.progress import Cancelled, QueueProgress
 
 POG_ROOT = path.abspath(path.join(path.dirname(path.realpath(__file__)), '..'))
 
 
 class PogCli():
-    def __init__(self, config=None, kwargs=None, pog_cmd=None):
+    '''
+    By default, every command is a `python -m pog.pog` subprocess.
+    With `in_process`, encrypt/decrypt/dumpManifest/dumpManifestIndex call the Encryptor and Decryptor directly
+    (in a worker thread, where relevant), and keys are only derived once per PogCli.
+    In-process mode can't prompt for a password -- it needs keyfiles.
+    '''
+    def __init__(self, config=None, kwargs=None, pog_cmd=None, in_process=False):
         self.cmd = pog_cmd or ['python', '-u', '-m', 'pog.pog']
         self.config = config or {}
         self.kwargs = kwargs or {}
+        self.in_process = in_process
         self._abort = False
+        self._cancelled = Event()
+        self._keys = {}
 
     def abort(self):
         self._abort = True
+        self._cancelled.set()
 
     def set_keyfiles(self, *keyfiles):
         for k in ('keyfile', 'decryption-keyfile', 'encryption-keyfile'):
@@ -59,6 +74,62 @@ class PogCli():
     def run_command(self, *args, **kwargs):
         return list(self.run(*args, **kwargs))
 
+    def _get_keys(self, args):
+        from pog.pog import get_keys
+
+        cache_key = tuple(args.get('--{}'.format(k)) for k in ('keyfile', 'decryption-keyfile', 'encryption-keyfile'))
+        if not any(cache_key):
+            # pog-agent may have a password-derived key for us. It decides how long that lasts, so we don't cache it
+            return get_keys(args, prompt=False)
+        if cache_key not in self._keys:
+            self._keys[cache_key] = get_keys(args)
+        return self._keys[cache_key]
+
+    def _decryptor(self, restrict_config, **kwargs):
+        from pog.pog import Decryptor
+
+        args = {'--{}'.format(k): v for k, v in self.config.items() if k not in restrict_config}
+        secret, crypto_box = self._get_keys(args)
+        kwargs = {**self.kwargs, **kwargs}
+        return Decryptor(secret, crypto_box, working_dir=kwargs.get('cwd'))
+
+    def _run_in_process(self, *args, **kwargs):
+        from pog import pog
+
+        restrict_config = kwargs.pop('restrict_config', ['encryption-keyfile'])
+        kwargs = {**self.kwargs, **kwargs}
+        pog_args = pog.parse_args(list(args) + self._flatten_config(restrict_config))
+        if kwargs.get('cwd'):  # as a subprocess would see them
+            pog.resolve_paths(pog_args, kwargs['cwd'])
+        secret, crypto_box = self._get_keys(pog_args)
+
+        self._cancelled = cancelled = Event()
+        events = Queue()
+        progress = QueueProgress(events, cancelled)
+
+        def work():
+            try:
+                pog.run(pog_args, secret, crypto_box, progress, kwargs.get('cwd'))
+            except BaseException as e:
+                events.put(e)
+            finally:
+                events.put(None)
+
+        worker = Thread(target=work, daemon=True)
+        worker.start()
+        try:
+            while True:
+                event = events.get()
+                if event is None or isinstance(event, Cancelled) or cancelled.is_set():
+                    return
+                if isinstance(event, BaseException):
+                    raise event
+                yield event
+        finally:
+            # if our caller has lost interest, the worker should stop too. It will notice at its next event.
+            cancelled.set()
+            worker.join()
+
     def _flatten_config(self, restrict_config=None):
         restrict_config = restrict_config or []
         config = self.config.copy()
@@ -67,6 +138,12 @@ class PogCli():
         return ['--{}={}'.format(k, v) for k, v in config.items()]
 
     def dumpManifest(self, mfn):
+        if self.in_process:
+            d = self._decryptor(['encryption-keyfile'])
+            for filename in d._download_list([mfn]):
+                info = {og_filename: i['blobs'] for og_filename, i in d.load_manifest(filename).items()}
+            return info
+
         info = defaultdict(list)
         current_file = ''
         for line in self.run_command('--dump-manifest', mfn):
@@ -82,8 +159,37 @@ class PogCli():
         kwargs = {}
         if 'decryption-keyfile' not in self.config and 'encryption-keyfile' in self.config:
             kwargs['restrict_config'] = []
+
+        if self.in_process:
+            d = self._decryptor(kwargs.get('restrict_config', ['encryption-keyfile']))
+            for filename in d._download_list([mfn]):
+                yield from d.manifest_index(filename)
+            return
+
         yield from self.run('--dump-manifest-index', mfn, **kwargs)
 
+    def manifestParent(self, mfn):
+        '''
+        the manifest `mfn` is a delta against, or None.
+        '''
+        if self.in_process:
+            d = self._decryptor(['encryption-keyfile'])
+            for filename in d._download_list([mfn]):
+                return d.manifest_parent(filename)
+
+        for line in self.run('--dump-manifest', mfn, stderr=STDOUT):
+            if line.startswith('*** parent: '):
+                return line[len('*** parent: '):]
+        return None
+
+    def _event_from_line(self, line):
+        if not line.startswith('{'):
+            return None
+        try:
+            return loads(line)
+        except ValueError:
+            return None
+
     def _progress_from_line(self, line):
         if not line.startswith('*** '):
             return None
@@ -91,16 +197,28 @@ class PogCli():
         current, total = progress.split('/')
         return {'current': int(current), 'total': int(total), 'filename': filename.strip()}
 
+    def run_events(self, *args, **kwargs):
+        '''
+        every progress event pog emits, as dicts. See `pog.lib.progress`.
+        '''
+        if self.in_process:
+            yield from self._run_in_process(*args, **kwargs)
+            return
+
+        for line in self.run('--progress=json', *args, **kwargs):
+            event = self._event_from_line(line)
+            if event:
+                yield event
+
+    def _progress(self, events, progress_events):
+        for event in events:
+            if event.get('event') in progress_events:
+                yield {k: v for k, v in event.items() if k not in ('event', 'action', 'time')}
+
     def decrypt(self, mfn, **kwargs):
-        for line in self.run('--decrypt', mfn, **kwargs):
-            progress = self._progress_from_line(line)
-            if progress:
-                yield progress
+        yield from self._progress(self.run_events('--decrypt', mfn, **kwargs), ('file_end',))
 
     def encrypt(self, inputs, destinations, **kwargs):
         kwargs['restrict_config'] = ['decryption-keyfile']
         save_to = '--save-to=' + ','.join(destinations)
-        for line in self.run(save_to, *inputs, **kwargs):
-            progress = self._progress_from_line(line)
-            if progress:
-                yield progress
+        yield from self._progress(self.run_events(save_to, *inputs, **kwargs), ('file_start', 'manifest'))
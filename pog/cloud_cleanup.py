@@ -7,11 +7,17 @@ In beta. Use at your own peril.
 Usage:
   pog-cleanup [--keyfile=<filename> | --decryption-keyfile=<filename> | --encryption-keyfile=<filename>]
               [--backup=<b2|s3|..>] [--reckless-abandon]
+  pog-cleanup [--keyfile=<filename> | --decryption-keyfile=<filename> | --encryption-keyfile=<filename>]
+              [--backup=<b2|s3|..>] [--ledger-cache=<dir>] [--reckless-abandon] --retire=<manifest>...
+  pog-cleanup [--keyfile=<filename> | --decryption-keyfile=<filename> | --encryption-keyfile=<filename>]
+              [--backup=<b2|s3|..>] [--ledger-cache=<dir>] --rebuild-ledger
   pog-cleanup (-h | --help)
 
 Examples:
   python -m pog.cloud_cleanup --encryption-keyfile=pki.encrypt --backup=s3
 
+  python -m pog.cloud_cleanup --keyfile=secret.key --backup=s3 --retire=2020-01-01T00:00:00.000000.mfn
+
 Options:
   -h --help                        Show this help.
   --version                        Show version.
@@ -19,23 +25,118 @@ Options:
   --encryption-keyfile=<filename>  Use asymmetric encryption -- <filename> contains the (binary) public key.
   --keyfile=<filename>             Instead of prompting for a password, use file contents as the secret.
   --backup=<b2|s3|filename|...>    Cloud service (s3, b2) to scrutinize.
+  --ledger-cache=<dir>             Where to keep local copies of ledgers. [default: ~/.cache/pog]
+  --rebuild-ledger                 Count the blobs of every manifest into a new ledger. For backups made without
+                                   `pog --ledger`, or if the ledger is suspect.
   --reckless-abandon               Delete files.
+  --retire=<manifest>              Remove a manifest, and the blobs the ledger says nothing else uses.
+                                   Only needs to read the retired manifests, not the whole backup history.
 """
 
+import sys
 from collections import defaultdict
 from itertools import combinations
 from os.path import basename, join as path_join
 from tempfile import TemporaryDirectory
 
 from docopt import docopt
+from nacl.secret import SecretBox
 
 from pog.cli import PogCli
 from pog.fs.pogfs import get_cloud_fs
+from pog.lib.blob_store import _data_path
+from pog.lib.ledger import Ledger
+from pog.pog import SESSION_SUFFIX, _ledger_cache, get_keys
+
+
+def get_blobs(local_mfn, cli):
+    return set(cli.dumpManifestIndex(local_mfn))
+
+
+def get_counted_blobs(local_mfn, cli):
+    '''
+    the blobs the ledger counts. Session key files aren't among them: a deduplicated blob may be sealed under
+    any earlier run's session, which its manifest doesn't know about -- only the blob's header does.
+    '''
+    return set(blob for blob in get_blobs(local_mfn, cli) if not blob.endswith(SESSION_SUFFIX))
+
+
+def get_parent(local_mfn, cli, config):
+    # only symmetric keys make delta manifests -- and an encryption keyfile can't read them anyway
+    if 'encryption-keyfile' in config or 'decryption-keyfile' in config:
+        return None
+    return cli.manifestParent(local_mfn)
+
+
+def get_ledger(config, fs, backup, cache_dir=None):
+    secret, _ = get_keys({'--{}'.format(k): v for k, v in config.items()})
+    return Ledger(fs, SecretBox(secret), backup or '', cache_dir)
+
+
+def _download_chain(fs, tempdir, mfn, ledger):
+    '''
+    a delta manifest's blobs are only known with its parents alongside it.
+    '''
+    while mfn:
+        fs.download_file(path_join(tempdir, mfn), mfn)
+        mfn = ledger.manifests.get(mfn, {}).get('parent')
 
 
-def get_blobs(local_mfn, config):
-    cl = PogCli(config)
-    return set(cl.dumpManifestIndex(local_mfn))
+def _unknown_manifests(fs, ledger):
+    mfns = (basename(f) for f in fs.list_files(recursive=False) if f.endswith('.mfn'))
+    return sorted(mfn for mfn in mfns if mfn not in ledger.manifests)
+
+
+def retire(config, fs, ledger, manifests, reckless_abandon=False):
+    '''
+    newest first, so a delta manifest goes before its parent.
+    The refcounts are only trustworthy if every manifest at the destination is in the ledger:
+    a backup made without `--ledger` would have its blobs deleted out from under it.
+    '''
+    ledger.load()
+    unknown = _unknown_manifests(fs, ledger)
+    if unknown:
+        raise ValueError('{} manifest(s) are not in the ledger, so their blobs could be removed: {}. '
+                         'Run pog-cleanup --rebuild-ledger first'.format(len(unknown), ', '.join(unknown)))
+    cli = PogCli(config, in_process=bool(config))
+    unused = []
+    with TemporaryDirectory() as tempdir:
+        for mfn in sorted(manifests, reverse=True):
+            _download_chain(fs, tempdir, mfn, ledger)
+            blobs = get_counted_blobs(path_join(tempdir, mfn), cli)
+            unused += ledger.retire_manifest(mfn, blobs)
+
+    for mfn in sorted(manifests):
+        print('would remove {}'.format(mfn))
+    for blob in unused:
+        print('would remove {}'.format(_data_path(blob)))
+    if not reckless_abandon:
+        return
+
+    # the ledger goes first: if we're interrupted, blobs are leaked (for the full cleanup to find), not lost
+    ledger.save()
+    for mfn in manifests:
+        fs.remove_file(mfn)
+    for blob in unused:
+        fs.remove_file(_data_path(blob))
+
+
+def rebuild_ledger(config, fs, ledger):
+    cli = PogCli(config, in_process=bool(config))
+    with TemporaryDirectory() as tempdir:
+        mfns = sorted([f for f in fs.list_files(recursive=False) if f.endswith('.mfn')])
+        for mfn in mfns:
+            fs.download_file(path_join(tempdir, mfn), mfn)
+
+        ledger.manifests = {}
+        ledger.refs = {}
+        for mfn in mfns:
+            local_path = path_join(tempdir, mfn)
+            ledger.add_manifest(mfn, get_counted_blobs(local_path, cli), get_parent(local_path, cli, config))
+    ledger.save()
+    print('ledger generation {}: {} manifests, {} blobs'.format(
+        ledger.generation, len(ledger.manifests), len(ledger.refs)
+    ))
 
 
 def doit(config, fs, reckless_abandon=False):
@@ -45,10 +146,11 @@ def doit(config, fs, reckless_abandon=False):
             fs.download_file(path_join(tempdir, mfn), mfn)
 
         # construct chains
+        cli = PogCli(config, in_process=bool(config))  # in-process mode needs a keyfile
         blobs = {}
         for mfn in mfns:
             local_path = path_join(tempdir, mfn)
-            blobs[mfn] = get_blobs(local_path, config)
+            blobs[mfn] = get_blobs(local_path, cli)
 
         obsoleted_by = defaultdict(set)
         for a, b in combinations(mfns, 2):
@@ -67,6 +169,14 @@ def doit(config, fs, reckless_abandon=False):
         print(obsoleted_by)
 
         final_mfns = set(mfn for mfn in mfns if not obsoleted_by[mfn])
+
+        # delta manifests are useless without their parents
+        keep = list(final_mfns)
+        while keep:
+            parent = get_parent(path_join(tempdir, keep.pop()), cli, config)
+            if parent in blobs and parent not in final_mfns:
+                final_mfns.add(parent)
+                keep.append(parent)
         print('***')
         print('final list:')
         print(final_mfns)
@@ -84,8 +194,8 @@ def doit(config, fs, reckless_abandon=False):
 
         print(len(blobs_to_keep))
 
-        for blob in fs.list_files('data/', recursive=True):
-            if basename(blob) in blobs_to_keep:
+        for blob in fs.list_data():
+            if basename(blob) in blobs_to_keep or blob.endswith(SESSION_SUFFIX):  # see get_counted_blobs()
                 continue
             print('would remove {}'.format(blob))
             if reckless_abandon:
@@ -105,6 +215,17 @@ def main():
 
     reckless_abandon = args['--reckless-abandon']
 
+    if args.get('--retire') or args.get('--rebuild-ledger'):
+        ledger = get_ledger(config, fs, args.get('--backup'), _ledger_cache(args))
+        if args.get('--rebuild-ledger'):
+            rebuild_ledger(config, fs, ledger)
+            return
+        try:
+            retire(config, fs, ledger, args['--retire'], reckless_abandon)
+        except ValueError as e:
+            sys.exit('pog-cleanup: {}'.format(e))
+        return
+
     doit(config, fs, reckless_abandon)
 
 
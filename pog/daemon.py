@@ -0,0 +1,360 @@
+#!/usr/bin/python3
+
+"""Pog daemon -- keeps imports, keys and backend clients warm between pog runs.
+
+Jobs are pog command lines, submitted over a unix socket that only the daemon's user can use.
+`pog-daemon submit` is a thin client: it sends the job, and relays the job's output and exit code.
+
+Usage:
+  pog-daemon [--socket=<path>] [--max-jobs=<n>] [--max-queued=<n>] [--bwlimit=<rates>] [--bwlimit-file=<filename>]
+             [--key-ttl=<seconds>]
+  pog-daemon submit [--socket=<path>] [--] <ARGS>...
+  pog-daemon status [--socket=<path>]
+  pog-daemon clear-keys [--socket=<path>]
+  pog-daemon (-h | --help)
+
+Examples:
+  pog-daemon --max-jobs=2 &
+  pog-daemon submit -- --keyfile=secret.key /opt/data --save-to=s3://mybucket
+  pog-daemon submit -- --keyfile=secret.key --verify s3://mybucket/2019-10-31T12:34:56.012345.mfn
+  pog-daemon status
+  pog-daemon clear-keys
+
+Options:
+  -h --help                  Show this help.
+  --bwlimit=<rates>          Bandwidth limits shared by every job (see `pog -h`). Jobs with limits of their own use those.
+  --bwlimit-file=<filename>  A schedule file for --bwlimit. Re-read when it changes.
+  --key-ttl=<seconds>        How long derived keys are kept after they were last derived. [default: 3600]
+  --max-jobs=<n>             How many jobs to run at once. [default: 2]
+  --max-queued=<n>           How many jobs can wait for a free slot. Past that, new jobs are turned away. [default: 100]
+  --socket=<path>            Where the daemon listens. Defaults to $POG_DAEMON_SOCK, or pog.sock in $XDG_RUNTIME_DIR.
+"""
+import sys
+from contextlib import contextmanager
+from hashlib import blake2b
+from itertools import count
+from os import environ, getcwd, stat, urandom
+from threading import BoundedSemaphore, Event, Lock, Thread, local
+from time import monotonic
+
+from docopt import docopt
+
+from pog.lib.unix_socket import JsonLineServer, default_socket_path, request
+
+
+KEYFILE_OPTS = ('--keyfile', '--decryption-keyfile', '--encryption-keyfile')
+
+
+def _socket_path(args):
+    return args.get('--socket') or environ.get('POG_DAEMON_SOCK') or default_socket_path('pog')
+
+
+class _Stream():
+    '''
+    file-like. Forwards writes to the client as {name: text} messages.
+    '''
+    def __init__(self, conn, name):
+        self.conn = conn
+        self.name = name
+
+    def write(self, text):
+        if text:
+            self.conn.send({self.name: text})
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+class _ThreadRouter():
+    '''
+    stands in for sys.stdout/sys.stderr, so that whatever a job prints goes to its client.
+    Threads inherit the route of the thread that made them (see _inherit_routes()), so a job's worker threads
+    -- uploads, backends -- print to its client too.
+    '''
+    def __init__(self, default):
+        self.default = default
+        self.local = local()
+
+    def route(self, stream):
+        self.local.stream = stream
+
+    def current(self):
+        return getattr(self.local, 'stream', None)
+
+    def _stream(self):
+        return self.current() or self.default
+
+    def write(self, text):
+        return self._stream().write(text)
+
+    def flush(self):
+        return self._stream().flush()
+
+    def __getattr__(self, name):
+        return getattr(self.default, name)
+
+
+def _routers():
+    return [r for r in (sys.stdout, sys.stderr) if isinstance(r, _ThreadRouter)]
+
+
+def _inherit_routes():
+    '''
+    a new thread takes on the routes of the thread that created it -- which, for a thread pool, is the thread
+    that submitted the work. Every pool a job uses is its own, so its threads never outlive the job.
+    '''
+    init, run = Thread.__init__, Thread.run
+
+    def routed_init(self, *args, **kwargs):
+        init(self, *args, **kwargs)
+        self._pog_routes = [(router, router.current()) for router in _routers()]
+
+    def routed_run(self):
+        for router, stream in getattr(self, '_pog_routes', []):
+            router.route(stream)
+        run(self)
+
+    Thread.__init__, Thread.run = routed_init, routed_run
+
+
+def route_output():
+    if not isinstance(sys.stdout, _ThreadRouter):
+        sys.stdout = _ThreadRouter(sys.stdout)
+        sys.stderr = _ThreadRouter(sys.stderr)
+        _inherit_routes()
+
+
+@contextmanager
+def _routed(out, err):
+    routers = [(r, s) for r, s in ((sys.stdout, out), (sys.stderr, err)) if isinstance(r, _ThreadRouter)]
+    for router, stream in routers:
+        router.route(stream)
+    try:
+        yield
+    finally:
+        for router, _ in routers:
+            router.route(None)
+
+
+class PogDaemon():
+    def __init__(self, max_jobs=2, max_queued=100, throttle=None, key_ttl=3600):
+        from pog import pog
+        from pog.fs.pogfs import keep_fs_warm
+
+        self.pog = pog
+        keep_fs_warm()
+        self.throttle = throttle
+
+        self.slots = BoundedSemaphore(max_jobs)
+        self.max_queued = max_queued
+        self.lock = Lock()
+        self.job_ids = count(1)
+        self.jobs = {}
+        self.key_ttl = key_ttl
+        self.keys = {}  # ident -> (keys, expiry)
+        self._salt = urandom(32)
+        self._stopped = Event()
+
+    def expire_keys(self):
+        now = monotonic()
+        with self.lock:
+            for ident, (_, expiry) in list(self.keys.items()):
+                if expiry <= now:
+                    del self.keys[ident]
+
+    def clear_keys(self):
+        with self.lock:
+            cleared = len(self.keys)
+            self.keys.clear()
+        return cleared
+
+    def start_reaper(self, interval=1.0):
+        def reap():
+            while not self._stopped.wait(interval):
+                self.expire_keys()
+        Thread(target=reap, daemon=True).start()
+
+    def stop(self):
+        self._stopped.set()
+        self.clear_keys()
+
+    def _get_keys(self, args, password=None):
+        '''
+        keyfiles are identified by path and stat(), so a replaced keyfile gets read again.
+        Passwords are identified by a keyed hash -- we don't hold on to the password itself.
+        '''
+        keyfiles = [opt for opt in KEYFILE_OPTS if args.get(opt)]
+        if keyfiles:
+            ident = tuple(
+                (opt, args[opt], stat(args[opt]).st_mtime_ns, stat(args[opt]).st_size) for opt in keyfiles
+            )
+        elif password:
+            ident = ('password', blake2b(password.encode('utf-8'), key=self._salt).digest())
+        else:
+            raise ValueError('pog-daemon needs a keyfile or a password')
+
+        with self.lock:
+            entry = self.keys.get(ident)
+        if entry and entry[1] > monotonic():
+            return entry[0]
+
+        if keyfiles:
+            keys = self.pog.get_keys(args)
+        else:
+            from pog.lib.secret import pass_to_hash
+            keys = (pass_to_hash(password), None)
+        with self.lock:
+            self.keys[ident] = (keys, monotonic() + self.key_ttl)
+        return keys
+
+    def handle(self, msg, conn, sock=None):
+        if msg.get('status'):
+            with self.lock:
+                conn.send({'jobs': sorted(self.jobs.values(), key=lambda j: j['id'])})
+            return
+        if msg.get('clear_keys'):
+            conn.send({'cleared': self.clear_keys()})
+            return
+
+        with self.lock:
+            waiting = sum(1 for j in self.jobs.values() if j['state'] == 'queued')
+            if waiting >= self.max_queued:
+                conn.send({'stderr': 'pog-daemon: too many queued jobs, try again later\n'})
+                conn.send({'exit': 1})
+                return
+            job_id = next(self.job_ids)
+            job = self.jobs[job_id] = {'id': job_id, 'argv': msg['argv'], 'cwd': msg.get('cwd'), 'state': 'queued'}
+
+        try:
+            with self.slots:
+                with self.lock:  # status is reading the jobs under it
+                    job['state'] = 'running'
+                code = self.run_job(msg, conn)
+        finally:
+            with self.lock:
+                del self.jobs[job_id]
+        conn.send({'exit': code})
+
+    def run_job(self, msg, conn):
+        from pog.lib.progress import get_progress
+
+        out, err = _Stream(conn, 'stdout'), _Stream(conn, 'stderr')
+        with _routed(out, err):
+            try:
+                args = self.pog.parse_args(msg['argv'])
+            except SystemExit as e:  # usage errors, --help
+                if isinstance(e.code, str):
+                    err.write(e.code + '\n')
+                    return 1
+                return e.code or 0
+
+            cwd = msg.get('cwd') or getcwd()
+            self.pog.resolve_paths(args, cwd)
+
+            restore = not (args['--verify'] or args['--dump-manifest'] or args['--dump-manifest-index']) and (
+                args['--decrypt'] or args['--decryption-keyfile']
+            )
+            if restore and not all('.mfn' in i for i in args['<INPUTS>']):
+                err.write('pog-daemon: only manifests can be restored. Decrypt single blobs with pog itself.\n')
+                return 1
+            if '-' in (args['<INPUTS>'] or []):
+                err.write('pog-daemon: jobs can not read stdin. Stream with pog itself.\n')
+                return 1
+
+            try:
+                secret, crypto_box = self._get_keys(args, msg.get('password'))
+                progress = get_progress(args.get('--progress'), out, err)
+                return self.pog.run(args, secret, crypto_box, progress, cwd, self.throttle)
+            except (BrokenPipeError, ConnectionResetError):
+                raise
+            except Exception as e:
+                err.write('pog-daemon: {}: {}\n'.format(type(e).__name__, e))
+                return 1
+
+
+def serve(socket_path, max_jobs=2, max_queued=100, bwlimit=None, bwlimit_file=None, key_ttl=3600):
+    from pog.pog import get_throttle
+
+    route_output()
+    throttle = get_throttle({'--bwlimit': bwlimit, '--bwlimit-file': bwlimit_file})
+    daemon = PogDaemon(max_jobs, max_queued, throttle, key_ttl)
+    daemon.start_reaper()
+    with JsonLineServer(socket_path, daemon.handle) as server:
+        print('*** pog-daemon listening on {}'.format(socket_path), file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            daemon.stop()
+
+
+def submit(socket_path, argv, cwd=None):
+    msg = {'argv': argv, 'cwd': cwd or getcwd()}
+    needs_password = not any(a.startswith(KEYFILE_OPTS) for a in argv) and not {'-h', '--help'} & set(argv)
+    if needs_password:
+        from pog.lib.secret import prompt_password
+        msg['password'] = prompt_password()
+
+    code = 1
+    try:
+        for res in request(socket_path, msg):
+            if 'stdout' in res:
+                sys.stdout.write(res['stdout'])
+                sys.stdout.flush()
+            elif 'stderr' in res:
+                sys.stderr.write(res['stderr'])
+            elif 'exit' in res:
+                code = res['exit']
+    except (ConnectionRefusedError, FileNotFoundError):
+        print('pog-daemon is not running at {}'.format(socket_path), file=sys.stderr)
+    except PermissionError as e:
+        print('pog-daemon: {}'.format(e), file=sys.stderr)
+    return code
+
+
+def status(socket_path):
+    try:
+        for res in request(socket_path, {'status': True}):
+            for job in res['jobs']:
+                print('{id} {state} {cwd}: {argv}'.format(**job))
+    except (ConnectionRefusedError, FileNotFoundError):
+        print('pog-daemon is not running at {}'.format(socket_path), file=sys.stderr)
+        return 1
+    except PermissionError as e:
+        print('pog-daemon: {}'.format(e), file=sys.stderr)
+        return 1
+    return 0
+
+
+def clear_keys(socket_path):
+    try:
+        for res in request(socket_path, {'clear_keys': True}):
+            print('*** cleared {} key(s)'.format(res['cleared']), file=sys.stderr)
+    except (ConnectionRefusedError, FileNotFoundError):
+        print('pog-daemon is not running at {}'.format(socket_path), file=sys.stderr)
+        return 1
+    except PermissionError as e:
+        print('pog-daemon: {}'.format(e), file=sys.stderr)
+        return 1
+    return 0
+
+
+def main():
+    args = docopt(__doc__)
+    socket_path = _socket_path(args)
+    if args['submit']:
+        sys.exit(submit(socket_path, args['<ARGS>']))
+    if args['status']:
+        sys.exit(status(socket_path))
+    if args['clear-keys']:
+        sys.exit(clear_keys(socket_path))
+    serve(
+        socket_path, int(args['--max-jobs']), int(args['--max-queued']), args['--bwlimit'], args['--bwlimit-file'],
+        int(args['--key-ttl'])
+    )
+
+
+if __name__ == '__main__':
+    main()
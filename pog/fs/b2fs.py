@@ -1,6 +1,6 @@
 import re
 import sys
-from os import environ
+from os import environ, path
 from subprocess import check_output
 
 from .pogfs import Pogfs
@@ -40,13 +40,18 @@ class b2fs(Pogfs):
                 success = True
         return fileId if success else ''
 
-    def upload_file(self, local_path, remote_path):
+    def upload_file(self, local_path, remote_path, callback=None):
+        # the b2 cli won't tell us how it's going, so callbacks get the whole file at once
+        if callback:
+            callback(path.getsize(local_path))
         res = _run_command('upload_file', self.bucket_name, local_path, remote_path)
         print(res, file=sys.stderr)
 
-    def download_file(self, local_path, remote_path):
+    def download_file(self, local_path, remote_path, callback=None):
         res = _run_command('download-file-by-name', self.bucket_name, remote_path, local_path)
         print(res, file=sys.stderr)
+        if callback:
+            callback(path.getsize(local_path))
 
     def remove_file(self, remote_path):
         file_id = self.exists(remote_path)
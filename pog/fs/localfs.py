@@ -1,10 +1,89 @@
-from os import remove
+import os
+from os import link, path, remove, replace
 from pathlib import Path
 from shutil import copyfile
+from uuid import uuid4
 
 from .pogfs import Pogfs
 
 
+COPY_CHUNK = 1024 * 1024
+FICLONE = 0x40049409  # linux/fs.h
+
+
+def _link(src, dst):
+    try:
+        link(src, dst)
+        return True
+    except OSError:  # another filesystem, or one without hardlinks
+        return False
+
+
+def _reflink(fsrc, fdst):
+    try:
+        import fcntl
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        return True
+    except (ImportError, OSError):
+        return False
+
+
+def _copy_file_range(fsrc, fdst):
+    if not hasattr(os, 'copy_file_range'):
+        return False
+    size = os.fstat(fsrc.fileno()).st_size
+    offset = 0
+    try:
+        while offset < size:
+            copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), size - offset, offset, offset)
+            if not copied:
+                break
+            offset += copied
+    except OSError:
+        fdst.truncate(0)
+        return False
+    return offset == size
+
+
+def copy_file(src, dst, link=True):
+    '''
+    the cheapest copy we can get: a hardlink, a reflink, copy_file_range() (which NFS and SMB can do server-side),
+    and only then a copy through user space. Returns which one it was.
+    Hardlinks are only safe because nobody modifies blobs or manifests in place. Pass `link=False` for anything else.
+    We go through a temp file next to `dst`, so a file that's already at `dst` is replaced, not written over.
+    '''
+    temp = path.join(path.dirname(dst), '.{}.{}'.format(path.basename(dst), uuid4().hex))
+    try:
+        method = 'link' if link and _link(src, temp) else None
+        if not method:
+            with open(src, 'rb') as fsrc, open(temp, 'xb') as fdst:
+                if _reflink(fsrc, fdst):
+                    method = 'reflink'
+                elif _copy_file_range(fsrc, fdst):
+                    method = 'copy_file_range'
+        if not method:
+            copyfile(src, temp)
+            method = 'copy'
+        replace(temp, dst)
+    except BaseException:
+        if path.exists(temp):
+            remove(temp)
+        raise
+    return method
+
+
+def _copy(src, dst, callback=None):
+    if not callback:
+        return copy_file(src, dst)
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        while True:
+            buf = fsrc.read(COPY_CHUNK)
+            if not buf:
+                break
+            callback(len(buf))
+            fdst.write(buf)
+
+
 class localfs(Pogfs):
     def __init__(self, *args, **kwargs):
         self.root = kwargs.get('root') or ''
@@ -12,14 +91,14 @@ class localfs(Pogfs):
     def exists(self, remote_path):
         return Path(self.root, remote_path).exists()
 
-    def upload_file(self, local_path, remote_path):
+    def upload_file(self, local_path, remote_path, callback=None):
         p = Path(self.root, remote_path)
         p.parent.mkdir(parents=True, exist_ok=True)
-        copyfile(local_path, p.resolve())
+        _copy(local_path, p.resolve(), callback)
 
-    def download_file(self, local_path, remote_path):
+    def download_file(self, local_path, remote_path, callback=None):
         p = Path(self.root, remote_path)
-        copyfile(p.resolve(), local_path)
+        _copy(p.resolve(), local_path, callback)
 
     def remove_file(self, remote_path):
         p = Path(self.root, remote_path)
@@ -1,5 +1,8 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from fnmatch import fnmatch
+from functools import partial
 from os.path import basename
+from threading import Lock
 
 '''
 Implemented per cloud storage service
@@ -7,13 +10,16 @@ Implemented per cloud storage service
 
 
 class Pogfs:
+    '''
+    `callback`, if given, is called with byte counts as a transfer goes. It may block, to slow the transfer down.
+    '''
     def exists(self, remote_path):
         raise NotImplementedError()
 
-    def upload_file(self, local_path, remote_path):
+    def upload_file(self, local_path, remote_path, callback=None):
         raise NotImplementedError()
 
-    def download_file(self, local_path, remote_path):
+    def download_file(self, local_path, remote_path, callback=None):
         raise NotImplementedError()
 
     def remove_file(self, remote_path):
@@ -22,19 +28,69 @@ class Pogfs:
     def list_files(self, remote_path='', pattern=None, recursive=False):
         raise NotImplementedError()
 
+    def list_data(self, concurrency=8):
+        '''
+        every blob under data/. Blobs live in data/xx/ shards, so we find the shards and list them
+        `concurrency` at a time. Files come back as each shard finishes -- in no particular order.
+        '''
+        shards = []
+        for entry in self.list_files('data/'):
+            if entry.endswith('/'):
+                shards.append(entry)
+            else:  # from before blobs were sharded
+                yield entry
+
+        def list_shard(shard):
+            return [f for f in self.list_files(shard, recursive=True) if not f.endswith('/')]
+
+        shards.reverse()
+        with ThreadPoolExecutor(max_workers=concurrency) as exe:
+            # a few shards in hand, so that we aren't holding the whole bucket in memory if the caller is slow
+            running = set()
+            while shards or running:
+                while shards and len(running) < 2 * concurrency:
+                    running.add(exe.submit(list_shard, shards.pop()))
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield from future.result()
+
     def _match(self, path, pattern):
         if path.endswith('/'):  # we want to return directories
             return True
         return fnmatch(basename(path), pattern)
 
 
+# long-running processes (pog-daemon) reuse fs instances -- and their backend clients -- between jobs
+_warm_fs = None
+_warm_lock = Lock()
+
+
+def keep_fs_warm(enabled=True):
+    global _warm_fs
+    if not enabled:
+        _warm_fs = None
+    elif _warm_fs is None:
+        _warm_fs = {}
+
+
+def _warm_instance(name, constructor, bucket=None, **kwargs):
+    key = (name, bucket, tuple(sorted(kwargs.items())))
+    with _warm_lock:
+        if key not in _warm_fs:
+            _warm_fs[key] = constructor(bucket, **kwargs)
+        return _warm_fs[key]
+
+
 def get_cloud_fs(fs):
     FS = {
         'b2': b2fs,
         's3': s3fs,
         'local': localfs,
     }
-    return FS.get(fs)
+    constructor = FS.get(fs)
+    if constructor and _warm_fs is not None:
+        return partial(_warm_instance, fs, constructor)
+    return constructor
 
 
 # these helper functions allow us to throw on failed dependencies iff it's appropriate
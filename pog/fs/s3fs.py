@@ -1,4 +1,5 @@
 from os import environ
+from threading import local
 
 import boto3
 from botocore.exceptions import ClientError
@@ -9,14 +10,33 @@ from .pogfs import Pogfs
 BUCKET_NAME = environ.get('S3_BUCKET_NAME')
 
 
+def _callback_kwargs(callback):
+    return {'Callback': callback} if callback else {}
+
+
 class s3fs(Pogfs):
     def __init__(self, bucket_name=None, **kwargs):
         self.bucket_name = bucket_name or BUCKET_NAME
+        self._client = None
+        self._local = local()
+
+    @property
+    def client(self):
+        # clients are thread safe, and not cheap to create
+        if not self._client:
+            self._client = boto3.client('s3')
+        return self._client
+
+    @property
+    def resource(self):
+        # resources are not thread safe
+        if not hasattr(self._local, 'resource'):
+            self._local.resource = boto3.resource('s3')
+        return self._local.resource
 
     def exists(self, remote_path):
-        resource_s3 = boto3.resource('s3')
         try:
-            resource_s3.Object(self.bucket_name, remote_path).load()
+            self.resource.Object(self.bucket_name, remote_path).load()
             return True
         except ClientError as e:
             if e.response['Error']['Code'] == "404":
@@ -24,21 +44,17 @@ class s3fs(Pogfs):
             else:
                 raise
 
-    def upload_file(self, local_path, remote_path):
-        s3 = boto3.client('s3')
-        s3.upload_file(local_path, self.bucket_name, remote_path)
+    def upload_file(self, local_path, remote_path, callback=None):
+        self.client.upload_file(local_path, self.bucket_name, remote_path, **_callback_kwargs(callback))
 
-    def download_file(self, local_path, remote_path):
-        s3 = boto3.client('s3')
-        s3.download_file(self.bucket_name, remote_path, local_path)
+    def download_file(self, local_path, remote_path, callback=None):
+        self.client.download_file(self.bucket_name, remote_path, local_path, **_callback_kwargs(callback))
 
     def remove_file(self, remote_path):
-        s3 = boto3.client('s3')
-        s3.delete_object(Bucket=self.bucket_name, Key=remote_path)
+        self.client.delete_object(Bucket=self.bucket_name, Key=remote_path)
 
     def list_files(self, remote_path='', pattern=None, recursive=False):
-        s3 = boto3.client('s3')
-        pager = s3.get_paginator("list_objects_v2")
+        pager = self.client.get_paginator("list_objects_v2")
 
         kwargs = {
             'Bucket': self.bucket_name,
@@ -0,0 +1,81 @@
+from threading import Lock
+
+
+MIN_LEVEL = 1
+MAX_LEVEL = 22
+DEFAULT_LEVEL = 3
+
+
+def _level(value):
+    level = int(value)
+    if not MIN_LEVEL <= level <= MAX_LEVEL:
+        raise ValueError('compression levels go from {} to {}, not {}'.format(MIN_LEVEL, MAX_LEVEL, level))
+    return level
+
+
+def parse_compresslevel(spec):
+    '''
+    `3` is a fixed level. `1-19` is an adaptive one.
+    Returns (starting level, AdaptiveLevel or None).
+    '''
+    spec = str(spec or DEFAULT_LEVEL)
+    if '-' not in spec:
+        return _level(spec), None
+    lowest, highest = (_level(s) for s in spec.split('-', 1))
+    if lowest > highest:
+        raise ValueError('bad compression level range: {}'.format(spec))
+    adaptive = AdaptiveLevel(lowest, highest)
+    return adaptive.level, adaptive
+
+
+class AdaptiveLevel():
+    '''
+    the zstd level for the next chunk, within [lowest, highest].
+    We compare how long each blob took to compress with how long it took to upload:
+    if the upload took much longer, there's CPU to spare while we wait on the link, so compress harder.
+    If compressing took longer, the link is waiting on us, so back off.
+    After a change, the old measurements are forgotten.
+    '''
+    def __init__(self, lowest, highest, start=DEFAULT_LEVEL, smoothing=0.3, raise_above=2.0, lower_below=1.0):
+        self.lowest = lowest
+        self.highest = highest
+        self.level = min(max(start, lowest), highest)
+        self.smoothing = smoothing
+        self.raise_above = raise_above
+        self.lower_below = lower_below
+        self.lock = Lock()
+        self._ratio = None
+        self._used = {}
+
+    def used(self, level):
+        with self.lock:
+            self._used[level] = self._used.get(level, 0) + 1
+
+    def levels_used(self):
+        '''
+        {level: blobs compressed at it}. For the manifest.
+        '''
+        with self.lock:
+            return {str(level): count for level, count in sorted(self._used.items())}
+
+    def record(self, level, compress_seconds, upload_seconds):
+        '''
+        returns the level to use next.
+        '''
+        with self.lock:
+            if compress_seconds <= 0 or level != self.level:  # too fast to measure, or from before the last change
+                return self.level
+
+            ratio = upload_seconds / compress_seconds
+            if self._ratio is None:
+                self._ratio = ratio
+            else:
+                self._ratio += self.smoothing * (ratio - self._ratio)
+
+            if self._ratio > self.raise_above and self.level < self.highest:
+                self.level += 1
+                self._ratio = None
+            elif self._ratio < self.lower_below and self.level > self.lowest:
+                self.level -= 1
+                self._ratio = None
+            return self.level
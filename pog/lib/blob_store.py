@@ -1,17 +1,47 @@
-from os import path
-from shutil import copyfile
+from concurrent.futures import ThreadPoolExecutor
+from os import close, path, remove
+from shutil import move, rmtree
 from subprocess import check_output
-from tempfile import NamedTemporaryFile
+from tempfile import NamedTemporaryFile, gettempdir, mkdtemp, mkstemp
+from threading import BoundedSemaphore, Condition, Lock
+from time import monotonic
 from urllib.parse import urlparse
 
 from collections import defaultdict
+from pog.fs.localfs import copy_file
 from pog.fs.pogfs import get_cloud_fs
+from pog.lib.metrics import Metrics
+from pog.lib.throttle import Throttle
+
+
+def _get_temp_dir():
+    # use ramdisk if possible
+    dirs = ['/dev/shm', gettempdir()]
+    for d in dirs:
+        if path.exists(d):
+            return d
 
 
 def _data_path(blob_name):
     return 'data/{}/{}'.format(blob_name[0:2], blob_name)
 
 
+def _dest_name(target, bucket=None):
+    return '{}:{}'.format(target, bucket) if bucket else target
+
+
+def _open_fs(target, bucket=None, working_dir=None):
+    # relative local paths belong to the working dir, not to whichever process happens to be doing the work
+    if target == 'local' and working_dir:
+        return get_cloud_fs(target)(bucket, root=working_dir)
+    return get_cloud_fs(target)(bucket)
+
+
+def _transfer_kwargs(callback):
+    # Pogfs implementations only see a callback if we're throttling
+    return {'callback': callback} if callback else {}
+
+
 def _flatten(*args):
     flatter = []
     for elem in args:
@@ -26,6 +56,9 @@ class download_list():
     def __init__(self, *args, **kwargs):
         self.filenames = _flatten(*args)
         self.fs_info = kwargs.get('fs_info', [])
+        self.metrics = kwargs.get('metrics') or Metrics()
+        self.working_dir = kwargs.get('working_dir')
+        self.throttle = kwargs.get('throttle') or Throttle()
         self.partials = {}
 
         # `extract` mode does two things:
@@ -69,17 +102,22 @@ class download_list():
         except StopIteration:
             raise
 
+    def _local_path(self, filename):
+        if not self.working_dir:
+            return filename
+        return path.join(self.working_dir, filename)
+
     def _download_if_necessary(self, filename, target=None, bucket=None):
         parsed = urlparse(filename)
         target = target or parsed.scheme
         bucket = bucket or parsed.netloc
         if not target:  # just a filename
-            return filename, None, []
+            return self._local_path(filename), None, []
 
         try:
-            fs = get_cloud_fs(target)(bucket)
+            fs = _open_fs(target, bucket, self.working_dir)
         except TypeError:  # not a real fs, treat it as a filename
-            return filename, None, []
+            return self._local_path(filename), None, []
 
         is_mfn = filename.endswith('.mfn')
         suffix = '.mfn' if is_mfn else ''
@@ -90,13 +128,64 @@ class download_list():
 
         f = NamedTemporaryFile(suffix=suffix)
         local_path = f.name
-        fs.download_file(local_path, remote_path)
+        start = monotonic()
+        callback = self.throttle.callback(_dest_name(target, bucket))
+        fs.download_file(local_path, remote_path, **_transfer_kwargs(callback))
+        self.metrics.record(
+            'download', monotonic() - start, path.getsize(local_path), path.basename(remote_path),
+            _dest_name(target, bucket), start
+        )
         return local_path, f, (target, bucket)
 
 
+class _QueuedBlob():
+    '''
+    one blob, on its way to several destinations. Whoever finishes last cleans up.
+    '''
+    def __init__(self, blob_name, temp_path, num_dests, callback=None):
+        self.blob_name = blob_name
+        self.temp_path = temp_path
+        self.results = [None] * num_dests
+        self.remaining = num_dests
+        self.error = None
+        self.callback = callback
+        self.lock = Lock()
+
+    def done(self, i, result=None, error=None):
+        with self.lock:
+            self.results[i] = result
+            self.error = self.error or error
+            self.remaining -= 1
+            if self.remaining:
+                return False
+        remove(self.temp_path)
+        if self.callback and not self.error:
+            self.callback(self.results)
+        return True
+
+
 class BlobStore():
-    def __init__(self, save_to=None):
+    '''
+    With more than one destination, blobs are uploaded in the background: each destination has its own
+    worker threads, and its own limit on how many blobs can be waiting for it.
+    A slow destination only holds up the run once its own queue is full.
+    '''
+    def __init__(self, save_to=None, metrics=None, working_dir=None, upload_concurrency=4, queue_depth=None,
+                 throttle=None):
         self.save_to = self._parse_save_to(save_to)
+        self.metrics = metrics or Metrics()
+        self.throttle = throttle or Throttle()
+        self.working_dir = working_dir
+        self.upload_concurrency = upload_concurrency
+        self.queue_depth = queue_depth or upload_concurrency * 2
+
+        self.lock = Lock()
+        self._destinations = {}  # dest -> (executor, slots)
+        self._stats = {}
+        self._staging_dir = None
+        self._outstanding = 0
+        self._drained = Condition(self.lock)
+        self._errors = []
 
     def _parse_save_to(self, save_to=None):
         if not save_to:
@@ -115,22 +204,192 @@ class BlobStore():
             dests.append(d)
         return dests
 
-    def save(self, name, temp_path):
+    def save(self, name, temp_path, blob=None, overwrite=False):
+        '''
+        returns a list of what happened at each destination: {destination, status (uploaded|exists), seconds}
+        Blobs are never overwritten -- the same name is the same content. Manifests may be, if `overwrite`.
+        '''
+        num_bytes = path.getsize(temp_path)
         if not self.save_to:
-            name = path.basename(name)
-            copyfile(temp_path, name)
+            name = path.join(self.working_dir or '', path.basename(name))
+            start = monotonic()
+            copy_file(temp_path, name)
+            self.metrics.record('upload', monotonic() - start, num_bytes, blob, start=start)
+            return [{'destination': '.', 'status': 'uploaded', 'seconds': monotonic() - start}]
+
+        return [
+            self._save_to_destination(target, bucket, name, temp_path, num_bytes, blob, overwrite)
+            for target, bucket in self.save_to
+        ]
+
+    def _save_to_destination(self, target, bucket, name, temp_path, num_bytes, blob=None, overwrite=False):
+        dest = _dest_name(target, bucket)
+        start = monotonic()
+        status = 'uploaded'
+        fs = get_cloud_fs(target)
+        if not fs:
+            with self.metrics.stage('upload', num_bytes, blob, dest):
+                callback = self.throttle.callback(dest)
+                if callback:  # scripts don't report progress. Pay up front
+                    callback(num_bytes)
+                check_output([target, name, temp_path], cwd=self.working_dir)
+        else:
+            fs = _open_fs(target, bucket, self.working_dir)
+            exists = False
+            if not overwrite:
+                with self.metrics.stage('exists', blob=blob, destination=dest):
+                    exists = fs.exists(name)
+            if exists:
+                status = 'exists'
+            else:
+                with self.metrics.stage('upload', num_bytes, blob, dest):
+                    fs.upload_file(temp_path, name, **_transfer_kwargs(self.throttle.callback(dest)))
+
+        finish = monotonic()
+        with self.lock:
+            stats = self._stats.setdefault(dest, {
+                'destination': dest, 'blobs': 0, 'uploaded': 0, 'bytes': 0, 'busy_seconds': 0.0, 'start': start
+            })
+            stats['blobs'] += 1
+            if status == 'uploaded':
+                stats['uploaded'] += 1
+                stats['bytes'] += num_bytes
+            stats['busy_seconds'] += finish - start
+            stats['finish'] = finish
+        return {'destination': dest, 'status': status, 'seconds': finish - start}
+
+    def _destination(self, target, bucket):
+        dest = _dest_name(target, bucket)
+        with self.lock:
+            if dest not in self._destinations:
+                self._destinations[dest] = (
+                    ThreadPoolExecutor(max_workers=self.upload_concurrency),
+                    BoundedSemaphore(self.queue_depth),
+                )
+            return self._destinations[dest]
+
+    def _stage(self, temp_path):
+        '''
+        the caller's temp file may not outlive the call, so we move it somewhere of our own.
+        '''
+        with self.lock:
+            if not self._staging_dir:
+                self._staging_dir = mkdtemp(dir=_get_temp_dir())
+        fd, staged = mkstemp(dir=self._staging_dir)
+        close(fd)
+        move(temp_path, staged)
+        return staged
+
+    def queue_blob(self, blob_name, temp_path, callback=None):
+        '''
+        sends the blob to every destination. `callback` gets the per-destination results (see `save()`).
+        With several destinations, this returns as soon as there is room in every destination's queue,
+        and the blob is uploaded in the background -- call `drain()` to wait for it.
+        '''
+        if not self.save_to or len(self.save_to) < 2:
+            results = self.save_blob(blob_name, temp_path)
+            if callback:
+                callback(results)
             return
 
-        for target, bucket in self.save_to:
-            fs = get_cloud_fs(target)
-            if not fs:
-                check_output([target, name, temp_path])
-                continue
+        full_name = _data_path(blob_name)
+        num_bytes = path.getsize(temp_path)
+        queued = _QueuedBlob(blob_name, self._stage(temp_path), len(self.save_to), callback)
+        with self.lock:
+            self._outstanding += 1
+
+        for i, (target, bucket) in enumerate(self.save_to):
+            exe, slots = self._destination(target, bucket)
+            slots.acquire()  # backpressure, per destination
+            future = exe.submit(
+                self._save_to_destination, target, bucket, full_name, queued.temp_path, num_bytes, blob_name
+            )
+            future.add_done_callback(lambda f, i=i, slots=slots: self._upload_done(queued, i, f, slots))
+
+    def _upload_done(self, queued, i, future, slots):
+        slots.release()
+        error = future.exception()
+        try:
+            finished = queued.done(i, None if error else future.result(), error)
+        except Exception as e:  # the callback can fail too
+            error, finished = e, True
+        if error:
+            with self.lock:
+                self._errors.append(error)
+        if finished:
+            with self.lock:
+                self._outstanding -= 1
+                self._drained.notify_all()
 
-            fs = fs(bucket)
-            if not fs.exists(name):
-                fs.upload_file(temp_path, name)
+    def drain(self):
+        '''
+        waits until every queued blob has been through every destination. Raises the first upload error, if any.
+        '''
+        with self.lock:
+            self._drained.wait_for(lambda: self._outstanding == 0)
+            if self._errors:
+                raise self._errors[0]
+
+    def filesystems(self):
+        '''
+        (destination name, Pogfs) for each destination we can read back from. Scripts can't be.
+        '''
+        return [
+            (_dest_name(target, bucket), _open_fs(target, bucket, self.working_dir))
+            for target, bucket in self.save_to or [] if get_cloud_fs(target)
+        ]
+
+    def destination_names(self):
+        return [_dest_name(target, bucket) for target, bucket in self.save_to or []]
+
+    def destination_stats(self):
+        '''
+        uploads and throughput per destination: bytes uploaded / the time from its first upload to its last.
+        '''
+        with self.lock:
+            stats = []
+            for s in self._stats.values():
+                wall_seconds = max(s['finish'] - s['start'], 0.000001)
+                stats.append({
+                    'destination': s['destination'], 'blobs': s['blobs'], 'uploaded': s['uploaded'],
+                    'bytes': s['bytes'], 'busy_seconds': s['busy_seconds'], 'wall_seconds': wall_seconds,
+                    'rate': s['bytes'] / wall_seconds,
+                })
+            return stats
+
+    def close(self):
+        with self.lock:
+            destinations = list(self._destinations.values())
+            self._destinations = {}
+        for exe, _ in destinations:
+            exe.shutdown(wait=True)
+        if self._staging_dir:
+            rmtree(self._staging_dir, ignore_errors=True)
+            self._staging_dir = None
+
+    def find_blob(self, blob_name):
+        '''
+        checks for the blob at every destination, before anyone goes to the trouble of making it.
+        Returns the per-destination results if it is everywhere, otherwise None.
+        '''
+        if not self.save_to:
+            if not path.exists(path.join(self.working_dir or '', blob_name)):
+                return None
+            return [{'destination': '.', 'status': 'exists', 'seconds': 0.0}]
+
+        results = []
+        for target, bucket in self.save_to:
+            if not get_cloud_fs(target):  # scripts can't tell us
+                return None
+            dest = _dest_name(target, bucket)
+            start = monotonic()
+            with self.metrics.stage('exists', blob=blob_name, destination=dest):
+                exists = _open_fs(target, bucket, self.working_dir).exists(_data_path(blob_name))
+            if not exists:
+                return None
+            results.append({'destination': dest, 'status': 'exists', 'seconds': monotonic() - start})
+        return results
 
     def save_blob(self, blob_name, temp_path):
         full_name = _data_path(blob_name)
-        self.save(full_name, temp_path)
+        return self.save(full_name, temp_path, blob=blob_name)
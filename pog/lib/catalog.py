@@ -0,0 +1,152 @@
+import sqlite3
+from hashlib import blake2b
+from json import dumps, loads
+from threading import Lock
+
+from nacl.exceptions import CryptoError
+from nacl.secret import SecretBox
+from nacl.utils import random as nacl_random
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS manifests (
+    id INTEGER PRIMARY KEY,
+    name TEXT UNIQUE NOT NULL,
+    sealed_key BLOB NOT NULL,
+    destinations TEXT,
+    files INTEGER,
+    partial INTEGER DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS files (
+    manifest INTEGER NOT NULL,
+    path_hash BLOB NOT NULL,
+    info BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_by_path ON files (path_hash);
+CREATE INDEX IF NOT EXISTS files_by_manifest ON files (manifest);
+CREATE TABLE IF NOT EXISTS blobs (
+    blob_hash BLOB NOT NULL,
+    manifest INTEGER NOT NULL,
+    path_hash BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS blobs_by_blob ON blobs (blob_hash);
+CREATE INDEX IF NOT EXISTS blobs_by_manifest ON blobs (manifest);
+'''
+
+
+class Catalog():
+    '''
+    a local sqlite index of manifests: which paths (and blobs) are in which backups.
+
+    Each manifest's rows are encrypted with a key of their own, and that key is encrypted with the archive's box --
+    so with asymmetric crypto, reading the catalog takes the decryption keyfile, same as reading the manifests.
+    Paths and blobs are looked up by keyed hash. The database itself only gives away manifest names and counts.
+    '''
+    def __init__(self, filename, secret, crypto_box=None):
+        self.filename = filename
+        self.box = crypto_box or SecretBox(secret)
+        self.hash_key = blake2b(secret, digest_size=32, person=b'pog-catalog').digest()
+        self.lock = Lock()
+        self._boxes = {}
+
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        with self.lock, self.db:
+            self.db.executescript(SCHEMA)
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def _hash(self, value):
+        return blake2b(value.encode('utf-8'), key=self.hash_key, digest_size=16).digest()
+
+    def _manifest_box(self, manifest_id, sealed_key):
+        box = self._boxes.get(manifest_id)
+        if not box:
+            try:
+                box = self._boxes[manifest_id] = SecretBox(self.box.decrypt(sealed_key))
+            except (AttributeError, CryptoError, TypeError):
+                raise ValueError('this catalog can only be read with the key that decrypts its manifests')
+        return box
+
+    def _remove(self, manifest_id):
+        for table in ('files', 'blobs'):
+            self.db.execute('DELETE FROM {} WHERE manifest = ?'.format(table), (manifest_id,))
+        self.db.execute('DELETE FROM manifests WHERE id = ?', (manifest_id,))
+        self._boxes.pop(manifest_id, None)
+
+    def add_manifest(self, name, mfn, destinations=None, partial=False):
+        '''
+        adding a manifest that's already in the catalog replaces it.
+        '''
+        key = nacl_random(SecretBox.KEY_SIZE)
+        box = SecretBox(key)
+        files = []
+        blobs = []
+        for path, info in mfn.items():
+            path_hash = self._hash(path)
+            files.append((path_hash, box.encrypt(dumps({'path': path, **info}).encode('utf-8'))))
+            blobs.extend((self._hash(blob), path_hash) for blob in set(info['blobs']))
+
+        with self.lock, self.db:
+            row = self.db.execute('SELECT id FROM manifests WHERE name = ?', (name,)).fetchone()
+            if row:
+                self._remove(row[0])
+            manifest_id = self.db.execute(
+                'INSERT INTO manifests (name, sealed_key, destinations, files, partial) VALUES (?, ?, ?, ?, ?)',
+                (name, self.box.encrypt(key), ','.join(destinations or []), len(files), int(partial))
+            ).lastrowid
+            self.db.executemany(
+                'INSERT INTO files (manifest, path_hash, info) VALUES (?, ?, ?)',
+                ((manifest_id, path_hash, info) for path_hash, info in files)
+            )
+            self.db.executemany(
+                'INSERT INTO blobs (blob_hash, manifest, path_hash) VALUES (?, ?, ?)',
+                ((blob_hash, manifest_id, path_hash) for blob_hash, path_hash in blobs)
+            )
+
+    def remove_manifest(self, name):
+        with self.lock, self.db:
+            row = self.db.execute('SELECT id FROM manifests WHERE name = ?', (name,)).fetchone()
+            if row:
+                self._remove(row[0])
+        return bool(row)
+
+    def manifests(self):
+        with self.lock:
+            rows = self.db.execute(
+                'SELECT name, destinations, files, partial FROM manifests ORDER BY name'
+            ).fetchall()
+        return [
+            {'manifest': name, 'destinations': dests.split(',') if dests else [], 'files': files, 'partial': bool(p)}
+            for name, dests, files, p in rows
+        ]
+
+    def _decrypt_rows(self, rows):
+        for manifest_id, name, sealed_key, info in rows:
+            box = self._manifest_box(manifest_id, sealed_key)
+            yield name, loads(box.decrypt(info).decode('utf-8'))
+
+    def path_history(self, path):
+        '''
+        [(manifest name, file info)] for every manifest that has `path`, oldest first.
+        '''
+        with self.lock:
+            rows = self.db.execute(
+                'SELECT m.id, m.name, m.sealed_key, f.info FROM files f JOIN manifests m ON f.manifest = m.id '
+                'WHERE f.path_hash = ? ORDER BY m.name', (self._hash(path),)
+            ).fetchall()
+            return [(name, info) for name, info in self._decrypt_rows(rows) if info['path'] == path]
+
+    def blob_users(self, blob):
+        '''
+        [(manifest name, path)] for every file that uses `blob`.
+        '''
+        with self.lock:
+            rows = self.db.execute(
+                'SELECT m.id, m.name, m.sealed_key, f.info FROM blobs b '
+                'JOIN manifests m ON b.manifest = m.id '
+                'JOIN files f ON f.manifest = b.manifest AND f.path_hash = b.path_hash '
+                'WHERE b.blob_hash = ? ORDER BY m.name', (self._hash(blob),)
+            ).fetchall()
+            return [(name, info['path']) for name, info in self._decrypt_rows(rows) if blob in info['blobs']]
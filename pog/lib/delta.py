@@ -0,0 +1,24 @@
+def _without_atime(info):
+    return {k: v for k, v in info.items() if k != 'atime'}
+
+
+def manifest_delta(parent, mfn):
+    '''
+    (changed, removed): the entries in `mfn` that aren't the same in `parent`, and the files that are gone.
+    Unlike a diff, mtimes count. atimes don't -- reading the file for the backup is enough to change them,
+    so an unchanged file keeps the parent's atime.
+    '''
+    changed = {
+        filename: info for filename, info in mfn.items()
+        if filename not in parent or _without_atime(parent[filename]) != _without_atime(info)
+    }
+    removed = sorted(filename for filename in parent if filename not in mfn)
+    return changed, removed
+
+
+def apply_delta(parent, changed, removed):
+    mfn = dict(parent)
+    for filename in removed:
+        mfn.pop(filename, None)
+    mfn.update(changed)
+    return dict(sorted(mfn.items()))
@@ -0,0 +1,156 @@
+import re
+from os import path
+
+
+POGIGNORE = '.pogignore'
+
+
+def _translate(pattern):
+    '''
+    glob -> regex. `*` and `?` stop at slashes, `**` doesn't.
+    '''
+    res = []
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        if pattern.startswith('**/', i):
+            res.append('(?:.*/)?')
+            i += 3
+        elif pattern.startswith('**', i):
+            res.append('.*')
+            i += 2
+        elif c == '*':
+            res.append('[^/]*')
+            i += 1
+        elif c == '?':
+            res.append('[^/]')
+            i += 1
+        elif c == '[' and pattern.find(']', i + 1) > 0:
+            j = pattern.find(']', i + 1)
+            chars = pattern[i+1:j]
+            if chars.startswith('!'):
+                chars = '^' + chars[1:]
+            res.append('[{}]'.format(chars.replace('\\', '\\\\')))
+            i = j + 1
+        else:
+            res.append(re.escape(c))
+            i += 1
+    return ''.join(res)
+
+
+def _compile(regexes):
+    if not regexes:
+        return None
+    return re.compile('|'.join('(?:{})'.format(r) for r in regexes))
+
+
+def _compile_group(patterns):
+    regexes = {}
+    for pattern in patterns:
+        dir_only = pattern.endswith('/')
+        pattern = pattern.rstrip('/')
+        on_name = '/' not in pattern
+        regexes.setdefault((on_name, dir_only), []).append(_translate(pattern.lstrip('/')))
+    return [(_compile(r), on_name, dir_only) for (on_name, dir_only), r in regexes.items()]
+
+
+class ExcludeRules():
+    '''
+    gitignore-flavored patterns. Each run of patterns with the same sign is compiled into (at most) four regexes.
+    A pattern without a slash matches a file or directory name at any depth: `node_modules`, `*.tmp`.
+    A pattern with one matches the path relative to `base`: `.git/objects`, `/build`, `cache/**/*.bin`.
+    A trailing slash only matches directories.
+    `!pattern` re-includes what an earlier pattern excluded: the last pattern that matches wins. As with git,
+    nothing under an excluded directory can be re-included -- we never look inside it. `\\!` and `\\#` are literal.
+    '''
+    def __init__(self, patterns, base=''):
+        self.base = base.rstrip('/')
+        self.patterns = []
+        groups = []  # [negated, [patterns]]
+        for pattern in patterns:
+            pattern = pattern.strip()
+            if not pattern or pattern.startswith('#'):
+                continue
+            negated = pattern.startswith('!')
+            body = pattern[1:] if negated else pattern
+            if body.startswith(('\\!', '\\#')):
+                body = body[1:]
+            if not body.rstrip('/'):
+                continue
+            self.patterns.append(pattern)
+
+            if not groups or groups[-1][0] != negated:
+                groups.append([negated, []])
+            groups[-1][1].append(body)
+        self._groups = [(negated, _compile_group(group)) for negated, group in groups]
+
+    def __bool__(self):
+        return bool(self.patterns)
+
+    def decide(self, rel_path, is_dir=False):
+        '''
+        True if the last pattern to match excludes the path, False if it re-includes it, None if none match.
+        '''
+        name = rel_path.rpartition('/')[2]
+        for negated, regexes in reversed(self._groups):
+            if any(
+                regex.fullmatch(name if on_name else rel_path)
+                for regex, on_name, dir_only in regexes if is_dir or not dir_only
+            ):
+                return not negated
+        return None
+
+    def match(self, rel_path, is_dir=False):
+        return bool(self.decide(rel_path, is_dir))
+
+    def excluded(self, full_path, is_dir=False):
+        return self.match(full_path[len(self.base)+1:], is_dir)
+
+
+def excluded_by(rules, full_path, is_dir=False):
+    '''
+    `rules` go from the outside in: --exclude, then each .pogignore on the way down.
+    The deepest rules with an opinion win, so a .pogignore can re-include what was excluded further up.
+    '''
+    for r in reversed(rules):
+        decision = r.decide(full_path[len(r.base)+1:], is_dir)
+        if decision is not None:
+            return decision
+    return False
+
+
+class Excludes():
+    '''
+    the --exclude patterns, and the .pogignore files we found while walking directories.
+    '''
+    def __init__(self, patterns=None):
+        self.patterns = list(patterns or [])
+        self.pogignore = {}
+
+    def rules(self, base=''):
+        return ExcludeRules(self.patterns, base)
+
+    def load_pogignore(self, dirname, display_name=None):
+        with open(path.join(dirname, POGIGNORE)) as f:
+            rules = ExcludeRules(f.read().splitlines(), dirname)
+        if rules:
+            self.pogignore[display_name or dirname] = rules.patterns
+        return rules
+
+    def excluded_path(self, rel_path):
+        '''
+        for paths we didn't walk to: the path or any of its parent directories can be excluded.
+        '''
+        rules = self.rules()
+        if not rules:
+            return False
+        parts = rel_path.strip('/').split('/')
+        return any(rules.match('/'.join(parts[:i+1]), is_dir=i < len(parts) - 1) for i in range(len(parts)))
+
+    def metadata(self):
+        metadata = {}
+        if self.patterns:
+            metadata['exclude'] = self.patterns
+        if self.pogignore:
+            metadata['pogignore'] = self.pogignore
+        return metadata
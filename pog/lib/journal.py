@@ -0,0 +1,66 @@
+from base64 import b64decode, b64encode
+from binascii import Error as B64Error
+from json import dumps, loads
+from os import fsync, path, remove, replace
+from threading import Lock
+
+from nacl.exceptions import CryptoError
+
+
+class Journal():
+    '''
+    an append-only record of finished work, so that an interrupted run can pick up where it left off.
+    Each line is one json record, encrypted on its own (with the same key as the manifest index).
+    A torn last line -- from a crash -- costs us that one record, and nothing else.
+    '''
+    def __init__(self, filename, box):
+        self.filename = filename
+        self.box = box
+        self.lock = Lock()
+        self.f = None
+
+    def exists(self):
+        return path.exists(self.filename)
+
+    def load(self):
+        records = []
+        with open(self.filename, 'rb') as f:
+            for line in f:
+                try:
+                    records.append(loads(self.box.decrypt(b64decode(line.strip(), validate=True)).decode('utf-8')))
+                except (B64Error, CryptoError, ValueError):
+                    break  # everything after a bad record is suspect
+        return records
+
+    def _line(self, record):
+        return b64encode(self.box.encrypt(dumps(record).encode('utf-8'))) + b'\n'
+
+    def open(self, records=None):
+        '''
+        starts the journal over with `records` -- e.g. the ones that survived the last run.
+        We don't append to the old file, in case it ends with a torn line.
+        '''
+        with open(self.filename + '.tmp', 'wb') as f:
+            for record in records or []:
+                f.write(self._line(record))
+            f.flush()
+            fsync(f.fileno())
+        replace(self.filename + '.tmp', self.filename)
+        self.f = open(self.filename, 'ab')
+
+    def append(self, record):
+        line = self._line(record)
+        with self.lock:
+            self.f.write(line)
+            self.f.flush()
+            fsync(self.f.fileno())
+
+    def close(self):
+        with self.lock:
+            if self.f:
+                self.f.close()
+                self.f = None
+
+    def remove(self):
+        self.close()
+        remove(self.filename)
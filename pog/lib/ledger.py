@@ -0,0 +1,125 @@
+from json import dumps, loads
+from os import makedirs, path
+from tempfile import TemporaryDirectory
+
+import zstandard as zstd
+
+from pog.fs.localfs import copy_file
+
+
+LEDGER_DIR = 'ledger/'
+GENERATION_DIGITS = 12
+
+
+def _cache_name(dest):
+    return '{}.ledger'.format(dest.replace(':', '_').replace('/', '_'))
+
+
+class Ledger():
+    '''
+    blob refcounts for one destination: how many manifests use each blob, and what each manifest depends on.
+    It's updated as backups finish and as manifests are retired, so garbage collection never has to re-read history.
+
+    Each save is a new generation (ledger/000000000042), and the old one is removed after.
+    A local copy in `cache_dir` is used for as long as it's the latest generation -- which one listing tells us.
+    It is encrypted with `box` (the same key as a manifest index), so backups with an encryption keyfile can update it.
+    There should only be one writer per destination at a time.
+    '''
+    def __init__(self, fs, box, dest='', cache_dir=None):
+        self.fs = fs
+        self.box = box
+        self.cache_path = path.join(cache_dir, _cache_name(dest)) if cache_dir else None
+        self.generation = 0
+        self.manifests = {}
+        self.refs = {}
+
+    def _generations(self):
+        names = (path.basename(f.rstrip('/')) for f in self.fs.list_files(LEDGER_DIR))
+        return sorted(int(n) for n in names if n.isdigit())
+
+    def _decode(self, data):
+        return loads(zstd.ZstdDecompressor().decompress(self.box.decrypt(data)).decode('utf-8'))
+
+    def _encode(self):
+        contents = {'generation': self.generation, 'manifests': self.manifests, 'refs': self.refs}
+        return self.box.encrypt(zstd.ZstdCompressor().compress(dumps(contents).encode('utf-8')))
+
+    def _read_cache(self, generation):
+        if not self.cache_path or not path.exists(self.cache_path):
+            return None
+        with open(self.cache_path, 'rb') as f:
+            contents = self._decode(f.read())
+        return contents if contents['generation'] == generation else None
+
+    def load(self):
+        generations = self._generations()
+        if not generations:
+            return self
+        generation = generations[-1]
+
+        contents = self._read_cache(generation)
+        if not contents:
+            with TemporaryDirectory() as tempdir:
+                local_path = path.join(tempdir, 'ledger')
+                self.fs.download_file(local_path, '{}{:0{}d}'.format(LEDGER_DIR, generation, GENERATION_DIGITS))
+                with open(local_path, 'rb') as f:
+                    contents = self._decode(f.read())
+                self._update_cache(local_path)
+
+        self.generation = contents['generation']
+        self.manifests = contents['manifests']
+        self.refs = contents['refs']
+        return self
+
+    def _update_cache(self, local_path):
+        if self.cache_path:
+            makedirs(path.dirname(self.cache_path), exist_ok=True)
+            copy_file(local_path, self.cache_path)
+
+    def save(self):
+        old = self._generations()
+        self.generation = max(old + [self.generation]) + 1
+        with TemporaryDirectory() as tempdir:
+            local_path = path.join(tempdir, 'ledger')
+            with open(local_path, 'wb') as f:
+                f.write(self._encode())
+            self.fs.upload_file(local_path, '{}{:0{}d}'.format(LEDGER_DIR, self.generation, GENERATION_DIGITS))
+            self._update_cache(local_path)
+        for generation in old:
+            self.fs.remove_file('{}{:0{}d}'.format(LEDGER_DIR, generation, GENERATION_DIGITS))
+
+    def add_manifest(self, name, blobs, parent=None):
+        '''
+        a manifest we already know about is left alone: same name, same run.
+        '''
+        if name in self.manifests:
+            return False
+        blobs = set(blobs)
+        for blob in blobs:
+            self.refs[blob] = self.refs.get(blob, 0) + 1
+        self.manifests[name] = {'blobs': len(blobs), 'parent': parent}
+        return True
+
+    def children(self, name):
+        return sorted(m for m, info in self.manifests.items() if info.get('parent') == name)
+
+    def retire_manifest(self, name, blobs):
+        '''
+        forgets the manifest, and returns the blobs that nothing uses anymore.
+        '''
+        if name not in self.manifests:
+            raise ValueError('{} is not in the ledger'.format(name))
+        children = self.children(name)
+        if children:
+            raise ValueError('{} is the parent of {}, and can not be retired first'.format(name, ', '.join(children)))
+
+        unused = []
+        for blob in set(blobs):
+            count = self.refs.get(blob, 0) - 1
+            if count > 0:
+                self.refs[blob] = count
+            else:
+                self.refs.pop(blob, None)
+                unused.append(blob)
+        del self.manifests[name]
+        return sorted(unused)
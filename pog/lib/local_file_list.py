@@ -1,23 +1,60 @@
 import glob
 import os
 
+from pog.lib.exclude import POGIGNORE, Excludes, excluded_by
+
+
+def _walk(top, rules, excludes, prefix):
+    '''
+    every file under `top`. Excluded directories are never entered.
+    '''
+    try:
+        with os.scandir(top) as it:
+            entries = list(it)
+    except OSError:
+        return
+
+    if any(entry.name == POGIGNORE for entry in entries):
+        display_name = top[len(prefix):] if prefix and top.startswith(prefix) else top
+        rules = rules + [excludes.load_pogignore(top, display_name or '.')]
+
+    for entry in entries:
+        if entry.name.startswith('.'):  # like the `**` glob we used to use, skip hidden files and directories
+            continue
+        is_dir = entry.is_dir()
+        if excluded_by(rules, entry.path, is_dir):
+            continue
+        if is_dir:
+            yield from _walk(entry.path, rules, excludes, prefix)
+        elif entry.is_file():
+            yield entry.path
+
 
 def local_file_list(*args, **kwargs):
     '''
     normalizes a list of files, dirs, and patterns into a list of files
+    relative paths are resolved against `working_dir` (if provided), but are still returned relative to it
+    `exclude` (an `Excludes`) prunes directories as they're walked, and filters what patterns match.
+    Files and directories named explicitly are never excluded.
     '''
+    working_dir = kwargs.get('working_dir')
+    prefix = os.path.join(working_dir, '') if working_dir else ''
+    excludes = kwargs.get('exclude') or Excludes()
+
     all_files = set()  # avoid dups
     for path in args:
-        if os.path.isfile(path):
-            all_files.add(path)
+        local_prefix = '' if os.path.isabs(path) else prefix
+        full_path = local_prefix + path
+        if os.path.isfile(full_path):
+            all_files.add(full_path)
             continue
 
-        if os.path.isdir(path):
-            pattern = '{}/**/*'.format(path)
-        else:
-            pattern = path
+        if os.path.isdir(full_path):
+            rules = excludes.rules(full_path)
+            all_files.update(_walk(full_path, [rules] if rules else [], excludes, prefix))
+            continue
 
-        for filename in glob.iglob(pattern, recursive=True):
-            if os.path.isfile(filename):
+        for filename in glob.iglob(glob.escape(local_prefix) + path, recursive=True):
+            if os.path.isfile(filename) and not excludes.excluded_path(filename[len(local_prefix):]):
                 all_files.add(filename)
-    return sorted(all_files)
+    return sorted(f[len(prefix):] if prefix and f.startswith(prefix) else f for f in all_files)
@@ -0,0 +1,109 @@
+from bisect import bisect_left
+from collections import defaultdict
+from hashlib import blake2b
+from json import dumps
+
+
+def _digest(obj):
+    return blake2b(dumps(obj, separators=(',', ':')).encode('utf-8'), digest_size=16).hexdigest()
+
+
+def entry_digest(info):
+    '''
+    what a file's contents look like to the manifest. atime and mtime don't count.
+    '''
+    return _digest([info['blobs'], info.get('holes')])
+
+
+def _dirname(filename):
+    return filename.rpartition('/')[0]
+
+
+def _depth(dirname):
+    return dirname.count('/') + 1 if dirname else 0
+
+
+def manifest_tree(mfn):
+    '''
+    {directory: hash}, where a directory's hash covers its files' entries and its subdirectories' hashes.
+    Two manifests with the same hash for a directory have the same contents under it.
+    The top level is ''.
+    '''
+    children = defaultdict(dict)
+    for filename, info in mfn.items():
+        parent, _, name = filename.rpartition('/')
+        children[parent]['f:' + name] = entry_digest(info)
+
+    for dirname in list(children):
+        while dirname:
+            dirname = _dirname(dirname)
+            if dirname in children:
+                break
+            children[dirname] = {}
+    children.setdefault('', {})
+
+    tree = {}
+    for dirname in sorted(children, key=_depth, reverse=True):
+        tree[dirname] = _digest(sorted(children[dirname].items()))
+        if dirname:
+            parent, _, name = dirname.rpartition('/')
+            children[parent]['d:' + name] = tree[dirname]
+    return tree
+
+
+def _subdirs(*trees):
+    children = defaultdict(set)
+    for tree in trees:
+        for dirname in tree:
+            if dirname:
+                children[_dirname(dirname)].add(dirname)
+    return children
+
+
+def _files_in(names, dirname):
+    '''
+    the files directly in `dirname`, from a sorted list of filenames.
+    Everything under a directory is one contiguous run of the list, so subdirectories are jumped over, not walked.
+    '''
+    prefix = dirname + '/' if dirname else ''
+    i = bisect_left(names, prefix)
+    end = bisect_left(names, dirname + '0') if dirname else len(names)  # '0' comes right after '/'
+    while i < end:
+        name = names[i]
+        slash = name.find('/', len(prefix))
+        if slash < 0:
+            yield name
+            i += 1
+        else:
+            i = bisect_left(names, name[:slash] + '0', i, end)
+
+
+def diff_manifests(old, new, old_tree=None, new_tree=None):
+    '''
+    yields (filename, status, old info, new info) for each file that was added, removed or changed, in order.
+    We walk down from the top, and a directory whose hash didn't change isn't entered.
+    '''
+    old_tree = old_tree or manifest_tree(old)
+    new_tree = new_tree or manifest_tree(new)
+    if old_tree.get('') == new_tree.get(''):
+        return
+
+    old_names, new_names = sorted(old), sorted(new)  # pog writes manifests sorted, so this is one pass
+    subdirs = _subdirs(old_tree, new_tree)
+    changes = []
+    pending = ['']
+    while pending:
+        dirname = pending.pop()
+        if old_tree.get(dirname) == new_tree.get(dirname):
+            continue
+        for filename in _files_in(new_names, dirname):
+            info, old_info = new[filename], old.get(filename)
+            if old_info is None:
+                changes.append((filename, 'added', None, info))
+            elif entry_digest(old_info) != entry_digest(info):
+                changes.append((filename, 'changed', old_info, info))
+        for filename in _files_in(old_names, dirname):
+            if filename not in new:
+                changes.append((filename, 'removed', old[filename], None))
+        pending.extend(subdirs.get(dirname, ()))
+    yield from sorted(changes, key=lambda c: c[0])
@@ -0,0 +1,116 @@
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+from json import dump
+from os import replace
+from threading import Lock
+from time import monotonic
+
+
+class _TimedReader():
+    '''
+    wraps a file object, keeping track of how long we spend in read()
+    '''
+    def __init__(self, f):
+        self.f = f
+        self.seconds = 0.0
+        self.bytes = 0
+
+    def read(self, size=-1):
+        start = monotonic()
+        data = self.f.read(size)
+        self.seconds += monotonic() - start
+        self.bytes += len(data)
+        return data
+
+    def lap(self):
+        res = (self.seconds, self.bytes)
+        self.seconds = 0.0
+        self.bytes = 0
+        return res
+
+
+class Metrics():
+    '''
+    cumulative durations and byte counts for each pipeline stage, optionally labeled by destination.
+    If `spans` is set, we also keep a record of every timed stage that can be tied to a blob.
+    '''
+    def __init__(self, spans=False):
+        self.lock = Lock()
+        self.keep_spans = spans
+        self.stages = defaultdict(lambda: {'seconds': 0.0, 'bytes': 0, 'count': 0})
+        self.spans = []
+        self.started = datetime.now()
+        self.start = monotonic()
+
+    @contextmanager
+    def stage(self, name, num_bytes=0, blob=None, destination=None):
+        start = monotonic()
+        try:
+            yield
+        finally:
+            self.record(name, monotonic() - start, num_bytes, blob, destination, start)
+
+    def record(self, name, seconds, num_bytes=0, blob=None, destination=None, start=None):
+        with self.lock:
+            totals = self.stages[(name, destination)]
+            totals['seconds'] += seconds
+            totals['bytes'] += num_bytes
+            totals['count'] += 1
+            if self.keep_spans and blob:
+                start = (start or monotonic() - seconds) - self.start
+                span = {'blob': blob, 'stage': name, 'start': start, 'seconds': seconds, 'bytes': num_bytes}
+                if destination:
+                    span['destination'] = destination
+                self.spans.append(span)
+
+    def summary(self):
+        with self.lock:
+            stages = [
+                {'stage': name, 'destination': dest, **totals}
+                for (name, dest), totals in sorted(self.stages.items(), key=lambda kv: (kv[0][0], kv[0][1] or ''))
+            ]
+            res = {
+                'started': self.started.isoformat(),
+                'wall_seconds': monotonic() - self.start,
+                'stages': stages,
+            }
+            if self.keep_spans:
+                res['spans'] = list(self.spans)
+            return res
+
+    def save_json(self, filename):
+        with open(filename + '.tmp', 'w') as f:
+            dump(self.summary(), f, indent=2)
+        replace(filename + '.tmp', filename)
+
+    def save_textfile(self, filename):
+        '''
+        prometheus text format, for the node exporter's textfile collector.
+        The collector may read at any time, so we write to a temp file and rename.
+        '''
+        summary = self.summary()
+        lines = []
+        for metric, field, help_text in [
+            ('pog_stage_seconds_total', 'seconds', 'Cumulative time spent in each pipeline stage.'),
+            ('pog_stage_bytes_total', 'bytes', 'Cumulative bytes processed by each pipeline stage.'),
+            ('pog_stage_calls_total', 'count', 'Number of times each pipeline stage ran.'),
+        ]:
+            lines.append('# HELP {} {}'.format(metric, help_text))
+            lines.append('# TYPE {} counter'.format(metric))
+            for s in summary['stages']:
+                labels = 'stage="{}"'.format(s['stage'])
+                if s['destination']:
+                    labels += ',destination="{}"'.format(s['destination'].replace('\\', '\\\\').replace('"', '\\"'))
+                lines.append('{}{{{}}} {}'.format(metric, labels, s[field]))
+
+        lines.append('# HELP pog_run_seconds Wall clock time of the last run.')
+        lines.append('# TYPE pog_run_seconds gauge')
+        lines.append('pog_run_seconds {}'.format(summary['wall_seconds']))
+        lines.append('# HELP pog_run_start_timestamp_seconds When the last run started.')
+        lines.append('# TYPE pog_run_start_timestamp_seconds gauge')
+        lines.append('pog_run_start_timestamp_seconds {}'.format(self.started.timestamp()))
+
+        with open(filename + '.tmp', 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        replace(filename + '.tmp', filename)
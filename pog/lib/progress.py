@@ -0,0 +1,113 @@
+import sys
+from datetime import datetime
+from json import dumps
+from threading import Lock
+from time import monotonic, time
+
+
+class Cancelled(Exception):
+    pass
+
+
+class TextProgress():
+    '''
+    the classic output: `*** count/total: filename` lines, and blob names.
+    Everything that isn't part of that format is dropped.
+    `out` and `err` default to whatever sys.stdout and sys.stderr are at the time.
+    '''
+    def __init__(self, out=None, err=None):
+        self.out = out
+        self.err = err
+        self.lock = Lock()
+        self.start = monotonic()
+        self.total_bytes = 0
+        self.done_bytes = 0
+
+    def emit(self, event, text=False, **info):
+        '''
+        `text` marks the events that are part of the classic output.
+        '''
+        with self.lock:
+            info = self._track(event, info)
+            self._write(event, text, info)
+
+    def _track(self, event, info):
+        if event == 'start':
+            self.start = monotonic()
+            self.total_bytes = info.get('bytes', 0)
+            self.done_bytes = 0
+        elif event == 'file_end':
+            self.done_bytes += info.get('bytes_in', 0)
+            elapsed = monotonic() - self.start
+            rate = self.done_bytes / elapsed if elapsed else 0
+            info['done_bytes'] = self.done_bytes
+            info['rate'] = rate
+            if self.total_bytes and rate:
+                info['eta'] = max(self.total_bytes - self.done_bytes, 0) / rate
+        return info
+
+    def _write(self, event, text, info):
+        if event == 'error':
+            print('error: {}: {}'.format(info.get('filename'), info.get('error')), file=self.err or sys.stderr)
+        elif event == 'destination':
+            print('*** {destination}: {uploaded}/{blobs} blobs uploaded, {bytes} bytes in {wall_seconds:.2f}s '
+                  '({mb_s:.2f} MB/s)'.format(mb_s=info['rate'] / 1000000, **info), file=self.err or sys.stderr)
+        elif event == 'done' and info.get('action') == 'diff':
+            print('*** {added} added, {removed} removed, {changed} changed. {bytes} bytes in new and changed files'.format(
+                **info), file=self.err or sys.stderr)
+        elif event == 'checkpoint':
+            print('*** checkpoint: {files} files in {manifest}'.format(**info), file=self.err or sys.stderr)
+        if not text:
+            return
+
+        out = self.out or sys.stdout
+        if event == 'blob':
+            print(info['blob'], file=out)
+        elif event == 'problem':
+            print('{}: {}'.format(info['problem'], info['blob']), file=out)
+        elif event == 'found' and 'blob' in info:
+            print('{manifest}: {filename}'.format(**info), file=out)
+        elif event == 'found':
+            print('{}: {}{}'.format(
+                info['manifest'], datetime.fromtimestamp(info['mtime']).isoformat(), ' (changed)' if info['changed'] else ''
+            ), file=out)
+        elif event == 'catalog_manifest':
+            print('{}: {} files{}{}'.format(
+                info['manifest'], info['files'], ' (partial)' if info['partial'] else '',
+                ''.join(' ' + d for d in info['destinations'])
+            ), file=out)
+        elif event == 'diff':
+            mark = {'added': '+', 'removed': '-', 'changed': 'M'}[info['status']]
+            print('{} {}'.format(mark, info['filename']), file=out)
+        else:
+            print('*** {}/{}: {}'.format(info['current'], info['total'], info['filename']), file=out)
+
+
+class JsonProgress(TextProgress):
+    '''
+    one json object per line, with an `event` type and a timestamp.
+    '''
+    def _write(self, event, text, info):
+        print(dumps({'event': event, 'time': time(), **info}), file=self.out or sys.stdout, flush=True)
+
+
+class QueueProgress(TextProgress):
+    '''
+    hands events over to another thread, as dicts.
+    This is also how an in-process run finds out it has been cancelled: the next event raises.
+    '''
+    def __init__(self, events, cancelled):
+        super().__init__()
+        self.events = events
+        self.cancelled = cancelled
+
+    def _write(self, event, text, info):
+        if self.cancelled.is_set():
+            raise Cancelled()
+        self.events.put({'event': event, 'time': time(), **info})
+
+
+def get_progress(name=None, out=None, err=None):
+    return {
+        'json': JsonProgress,
+    }.get(name, TextProgress)(out, err)
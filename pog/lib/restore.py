@@ -0,0 +1,77 @@
+from collections import Counter
+from json import dumps
+from os import path, remove
+
+from pog.fs.localfs import copy_file
+
+
+def _contents(info):
+    return dumps([info['blobs'], info.get('holes'), info.get('size')])
+
+
+class RestorePlan():
+    '''
+    what a restore needs, worked out before anything is downloaded.
+    Files with the same blobs (and holes) have the same contents: only the first one is decrypted,
+    the rest are copied from it. `uses` counts how many of the files left to decrypt need each blob.
+    '''
+    def __init__(self, mfn, partials=None):
+        self.entries = []
+        self.copies = {}
+        self.uses = Counter()
+        first = {}
+        for count, (filename, info) in enumerate(mfn.items()):
+            if partials and filename not in partials:
+                continue
+            self.entries.append((count, filename, info))
+
+            contents = _contents(info)
+            if contents in first:
+                self.copies[filename] = first[contents]
+                continue
+            first[contents] = filename
+            self.uses.update(info['blobs'])
+
+    def copy_of(self, filename):
+        '''
+        the file that was restored with the same contents, if there is one.
+        '''
+        return self.copies.get(filename)
+
+
+class BlobCache():
+    '''
+    downloaded blobs that the restore will need again, kept (still encrypted) in `dirname` until their last use.
+    It holds up to `max_bytes`. Past that, blobs aren't kept, and are downloaded again when they come up.
+    '''
+    def __init__(self, uses, dirname, max_bytes):
+        self.remaining = dict(uses)
+        self.dirname = dirname
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.paths = {}
+
+    def get(self, blob):
+        return self.paths.get(blob)
+
+    def add(self, blob, local_path):
+        if self.remaining.get(blob, 0) < 2 or blob in self.paths:
+            return
+        size = path.getsize(local_path)
+        if self.bytes + size > self.max_bytes:
+            return
+        cached = path.join(self.dirname, blob)
+        copy_file(local_path, cached)
+        self.paths[blob] = cached
+        self.bytes += size
+
+    def used(self, blob):
+        '''
+        returns how many more times the blob will be needed.
+        '''
+        remaining = self.remaining[blob] = self.remaining.get(blob, 1) - 1
+        if remaining <= 0 and blob in self.paths:
+            cached = self.paths.pop(blob)
+            self.bytes -= path.getsize(cached)
+            remove(cached)
+        return remaining
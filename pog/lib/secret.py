@@ -1,6 +1,9 @@
-import argon2
+import sys
+from getpass import getpass
 from hashlib import sha256
 
+import argon2
+
 
 def pass_to_hash(pw):
     # prompted passwords are likely to be weaker -> potentially brute-forceable. So we'll use a stronger hash algo.
@@ -11,3 +14,23 @@ def pass_to_hash(pw):
         type=argon2.low_level.Type.ID
     )
     return ar2
+
+
+def hash_keyfile(keyfile):
+    with open(keyfile, 'rb') as f:
+        h = sha256()
+        buffer = f.read(16384)
+        while buffer:
+            h.update(buffer)
+            buffer = f.read(16384)
+        return h.digest()
+
+
+def prompt_password():
+    while True:
+        password = getpass()
+        pass2 = getpass()
+        if password != pass2:
+            print('passwords did not match! Please try again.', file=sys.stderr)
+            continue
+        return password
@@ -0,0 +1,167 @@
+import errno
+from os import SEEK_SET, lseek
+
+try:
+    from os import SEEK_DATA, SEEK_HOLE
+except ImportError:  # not every platform can tell us where the holes are
+    SEEK_DATA = SEEK_HOLE = None
+
+
+# with detect_zeros, aligned blocks of this size that are all zeros are treated as holes
+ZERO_BLOCK = 1024 * 1024
+_ZEROS = bytes(ZERO_BLOCK)
+
+
+def data_extents(f, size):
+    '''
+    [(start, end)] of the parts of the file that hold data. Filesystems that don't know about holes say it's all data.
+    '''
+    if SEEK_DATA is None:
+        return [(0, size)]
+
+    fd = f.fileno()
+    extents = []
+    pos = 0
+    try:
+        while pos < size:
+            try:
+                start = lseek(fd, pos, SEEK_DATA)
+            except OSError as e:
+                if e.errno == errno.ENXIO:  # nothing but hole from here on
+                    break
+                raise
+            end = min(lseek(fd, start, SEEK_HOLE), size)
+            extents.append((start, end))
+            pos = end
+    except OSError:
+        return [(0, size)]
+    finally:
+        lseek(fd, 0, SEEK_SET)
+        f.seek(0)
+    return extents
+
+
+class SparseReader():
+    '''
+    reads the data in a file, skipping over its holes -- and, with `detect_zeros`, over blocks of zeros.
+    Once we've read to the end, `holes` is a list of [offset, length]. Pass in `holes` to have them added to it.
+    '''
+    def __init__(self, f, size, detect_zeros=False, holes=None):
+        self.f = f
+        self.size = size
+        self.detect_zeros = detect_zeros
+        self.extents = data_extents(f, size)
+        self.pos = 0
+        self.holes = holes if holes is not None else []
+        self.buf = b''
+
+    def _hole(self, offset, length):
+        if self.holes and sum(self.holes[-1]) == offset:
+            self.holes[-1][1] += length
+        else:
+            self.holes.append([offset, length])
+
+    def _next_block(self):
+        while self.extents:
+            start, end = self.extents[0]
+            if self.pos < start:
+                self._hole(self.pos, start - self.pos)
+                self.pos = start
+                self.f.seek(start)
+            if self.pos >= end:
+                self.extents.pop(0)
+                continue
+
+            offset = self.pos
+            data = self.f.read(min(end, (offset // ZERO_BLOCK + 1) * ZERO_BLOCK) - offset)
+            if not data:  # the file got shorter
+                self.extents = []
+                self.size = offset
+                break
+            self.pos += len(data)
+            if self.detect_zeros and data == _ZEROS[:len(data)]:
+                self._hole(offset, len(data))
+                continue
+            return data
+
+        if self.pos < self.size:
+            self._hole(self.pos, self.size - self.pos)
+            self.pos = self.size
+        return b''
+
+    def read(self, size=-1):
+        parts = [self.buf]
+        have = len(self.buf)
+        while size < 0 or have < size:
+            data = self._next_block()
+            if not data:
+                break
+            parts.append(data)
+            have += len(data)
+
+        data = b''.join(parts)
+        if size < 0:
+            self.buf = b''
+            return data
+        self.buf = data[size:]
+        return data[:size]
+
+
+class SparseWriter():
+    '''
+    the other end of SparseReader: writes data around the holes, then sets the file's size.
+    We seek over the holes rather than writing zeros, so the filesystem can leave them unallocated.
+    '''
+    def __init__(self, f, holes, size):
+        self.f = f
+        self.holes = [tuple(h) for h in holes]
+        self.size = size
+        self.pos = 0
+        self._skip_holes()
+
+    def _skip_holes(self):
+        while self.holes and self.holes[0][0] <= self.pos:
+            offset, length = self.holes.pop(0)
+            self.pos = offset + length
+            self.f.seek(self.pos)
+
+    def write(self, data):
+        view = memoryview(data)
+        while view:
+            n = len(view)
+            if self.holes:
+                n = min(n, self.holes[0][0] - self.pos)
+            self.f.write(view[:n])
+            self.pos += n
+            view = view[n:]
+            self._skip_holes()
+        return len(data)
+
+    def flush(self):
+        self.f.flush()
+
+    def close(self):
+        if not self.f.closed:
+            self.f.truncate(self.size)
+            self.f.close()
+
+
+def copy_sparse(src, dst, holes, size):
+    '''
+    copies the data around `holes` from one file to another, which ends up with the same holes.
+    For a file we've restored sparse: a plain copy would write its holes out as zeros.
+    '''
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        out = SparseWriter(fdst, holes, size)
+        pos = 0
+        for offset, length in [tuple(h) for h in holes] + [(size, 0)]:
+            fsrc.seek(pos)
+            remaining = offset - pos
+            while remaining > 0:
+                data = fsrc.read(min(remaining, ZERO_BLOCK))
+                if not data:
+                    break
+                out.write(data)
+                remaining -= len(data)
+            pos = offset + length
+        out.close()
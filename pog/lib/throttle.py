@@ -0,0 +1,197 @@
+from datetime import datetime
+from functools import partial
+from os import stat
+from threading import Lock
+from time import monotonic, sleep
+
+from humanfriendly import parse_size
+
+
+def parse_limits(spec):
+    '''
+    `10MB` is shared by every transfer. `s3=2MB,b2:mybucket=1MB` are per destination. Both can be given at once.
+    Returns {None: total, destination: rate}, in bytes/second. 0 or `off` is no limit.
+    '''
+    limits = {}
+    for part in (spec or '').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        dest, _, rate = part.rpartition('=')
+        limits[dest or None] = 0 if rate in ('off', 'none') else parse_size(rate)
+    return limits
+
+
+def _minutes(hhmm):
+    hours, _, minutes = hhmm.partition(':')
+    return int(hours) * 60 + int(minutes or 0)
+
+
+def parse_schedule(text):
+    '''
+    one set of limits per line, optionally preceded by the hours they apply to:
+        08:00-18:00 s3=2MB,b2=1MB
+        22:00-06:00 off
+        10MB
+    Returns [(start minute, end minute) or None, limits].
+    '''
+    schedule = []
+    for line in text.splitlines():
+        line = line.split('#', 1)[0].strip()
+        if not line:
+            continue
+        first, _, rest = line.partition(' ')
+        if '-' in first and ':' in first:
+            start, end = first.split('-', 1)
+            schedule.append(((_minutes(start), _minutes(end)), parse_limits(rest)))
+        else:
+            schedule.append((None, parse_limits(line)))
+    return schedule
+
+
+def _in_window(window, minute):
+    start, end = window
+    if start <= end:
+        return start <= minute < end
+    return minute >= start or minute < end  # over midnight
+
+
+class TokenBucket():
+    '''
+    holds up to a second's worth of bytes. Transfers take what they need, and may go into debt --
+    whoever comes next waits for the debt to be paid off. Rate changes apply to the debt too.
+    '''
+    def __init__(self, rate=None):
+        self.lock = Lock()
+        self.rate = None
+        self.tokens = 0.0
+        self.last = monotonic()
+        self.set_rate(rate)
+
+    def _refill(self):
+        now = monotonic()
+        if self.rate:
+            self.tokens = min(self.tokens + (now - self.last) * self.rate, self.rate)
+        self.last = now
+
+    def set_rate(self, rate):
+        with self.lock:
+            self._refill()
+            if rate and not self.rate:
+                self.tokens = rate
+            self.rate = rate or None
+            if self.rate:
+                self.tokens = min(self.tokens, self.rate)
+
+    def consume(self, num_bytes):
+        '''
+        returns how long we waited
+        '''
+        with self.lock:
+            if not self.rate:
+                return 0
+            self._refill()
+            self.tokens -= num_bytes
+
+        waited = 0
+        while True:
+            with self.lock:
+                if not self.rate:
+                    self.tokens = 0.0
+                    return waited
+                self._refill()
+                if self.tokens >= 0:
+                    return waited
+                wait = min(-self.tokens / self.rate, 0.25)
+            sleep(wait)
+            waited += wait
+
+
+class Throttle():
+    '''
+    bandwidth limits for uploads and downloads, in bytes/second -- see parse_limits() and parse_schedule().
+    The schedule file wins over `limits` while one of its lines applies. It is re-read when it changes.
+    '''
+    CHECK_INTERVAL = 1.0
+
+    def __init__(self, limits=None, schedule_file=None):
+        self.lock = Lock()
+        self.default_limits = parse_limits(limits)
+        self.schedule_file = schedule_file
+        self.schedule = []
+        self.limits = {}
+        self.total = TokenBucket()
+        self.buckets = {}
+        self._mtime = None
+        self._checked = None
+        self.check()
+
+    @property
+    def enabled(self):
+        return bool(self.default_limits or self.schedule_file)
+
+    def _read_schedule(self):
+        try:
+            mtime = stat(self.schedule_file).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self._mtime:
+            return
+        self._mtime = mtime
+        if mtime is None:
+            self.schedule = []
+            return
+        with open(self.schedule_file) as f:
+            self.schedule = parse_schedule(f.read())
+
+    def active_limits(self, now=None):
+        now = now or datetime.now()
+        minute = now.hour * 60 + now.minute
+        for window, limits in self.schedule:
+            if window is None or _in_window(window, minute):
+                return limits
+        return self.default_limits
+
+    def _rate(self, limits, dest):
+        if dest in limits:
+            return limits[dest]
+        return limits.get(dest.split(':', 1)[0])
+
+    def check(self, force=False):
+        with self.lock:
+            if not force and self._checked and monotonic() - self._checked < self.CHECK_INTERVAL:
+                return
+            self._checked = monotonic()
+            if self.schedule_file:
+                self._read_schedule()
+            self.limits = self.active_limits()
+            self.total.set_rate(self.limits.get(None))
+            for dest, bucket in self.buckets.items():
+                bucket.set_rate(self._rate(self.limits, dest))
+
+    def reload(self):
+        '''
+        e.g. on SIGHUP
+        '''
+        with self.lock:
+            self._mtime = None
+        self.check(force=True)
+
+    def _bucket(self, dest):
+        with self.lock:
+            bucket = self.buckets.get(dest)
+            if not bucket:
+                bucket = self.buckets[dest] = TokenBucket(self._rate(self.limits, dest))
+            return bucket
+
+    def consume(self, dest, num_bytes):
+        self.check()
+        return self._bucket(dest).consume(num_bytes) + self.total.consume(num_bytes)
+
+    def callback(self, dest):
+        '''
+        for Pogfs.upload_file()/download_file(). None if we aren't throttling at all.
+        '''
+        if not self.enabled:
+            return None
+        return partial(self.consume, dest)
@@ -0,0 +1,124 @@
+import socket
+import socketserver
+import struct
+from json import dumps, loads
+from os import chmod, environ, getuid, path, remove, stat, umask
+from threading import Lock
+
+
+def default_socket_path(name):
+    runtime_dir = environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir and path.isdir(runtime_dir):
+        return path.join(runtime_dir, '{}.sock'.format(name))
+    return '/tmp/{}-{}.sock'.format(name, getuid())
+
+
+def _peer_uid(sock):
+    '''
+    None if the platform can't tell us -- in which case, the socket's permissions are all we have.
+    '''
+    if not hasattr(socket, 'SO_PEERCRED'):
+        return None
+    creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+    _, uid, _ = struct.unpack('3i', creds)
+    return uid
+
+
+def _check_server(sock, socket_path):
+    '''
+    the default socket path can be in /tmp, where anyone could be listening first.
+    We only talk to a server run by our own user.
+    '''
+    uid = _peer_uid(sock)
+    if uid is None:
+        st = stat(socket_path)
+        uid = st.st_uid if not st.st_mode & 0o077 else None
+    if uid != getuid():
+        raise PermissionError('{} is not a socket of ours: another user is listening on it'.format(socket_path))
+
+
+class Connection():
+    '''
+    one json object per line, in both directions.
+    Sends are thread safe, since a job can have several threads talking to its client.
+    '''
+    def __init__(self, rfile, wfile):
+        self.rfile = rfile
+        self.wfile = wfile
+        self.lock = Lock()
+
+    def send(self, msg):
+        with self.lock:
+            self.wfile.write(dumps(msg).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+    def receive(self):
+        line = self.rfile.readline()
+        return loads(line) if line else None
+
+    def __iter__(self):
+        for line in self.rfile:
+            yield loads(line)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        conn = Connection(self.rfile, self.wfile)
+        request = conn.receive()
+        if request is None:
+            return
+        try:
+            self.server.handle_request_msg(request, conn, self.request)
+        except (BrokenPipeError, ConnectionResetError):  # the client went away
+            pass
+
+
+class JsonLineServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    '''
+    serves `handler(request, conn, sock)` for each connection, in its own thread.
+    The socket is only accessible by its owner.
+    '''
+    daemon_threads = True
+
+    def __init__(self, socket_path, handler):
+        self.socket_path = socket_path
+        self.handle_request_msg = handler
+        _remove_stale_socket(socket_path)
+
+        old_umask = umask(0o177)  # no window where someone else could connect
+        try:
+            super().__init__(socket_path, _Handler)
+        finally:
+            umask(old_umask)
+        chmod(socket_path, 0o600)
+
+    def server_close(self):
+        super().server_close()
+        if path.exists(self.socket_path):
+            remove(self.socket_path)
+
+
+def _remove_stale_socket(socket_path):
+    if not path.exists(socket_path):
+        return
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.connect(socket_path)
+    except (ConnectionRefusedError, FileNotFoundError):
+        remove(socket_path)
+        return
+    raise RuntimeError('something is already listening on {}'.format(socket_path))
+
+
+def request(socket_path, msg):
+    '''
+    sends `msg`, and yields every message we get back until the server hangs up.
+    Raises PermissionError (before sending anything) if the server isn't running as us.
+    '''
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.connect(socket_path)
+        _check_server(s, socket_path)
+        with s.makefile('rb') as rfile, s.makefile('wb') as wfile:
+            conn = Connection(rfile, wfile)
+            conn.send(msg)
+            yield from conn
@@ -6,10 +6,24 @@
 Usage:
   pog <INPUTS>...
   pog [--keyfile=<filename> | --encryption-keyfile=<filename>] [--save-to=<b2|s3|filename|...>] [--chunk-size=<bytes>]
-      [--compresslevel=<1-22>] [--concurrency=<1-N>] [--store-absolute-paths] <INPUTS>...
-  pog [--keyfile=<filename> | --decryption-keyfile=<filename>] [--decrypt | --dump-manifest] [--consume] <INPUTS>...
+      [--compresslevel=<1-22|min-max>] [--concurrency=<1-N>] [--store-absolute-paths] [--blob-naming=<sha256|blake2b>]
+      [--blob-identity=<compressed|plaintext>] [--journal=<filename> [--resume]] [--checkpoint-interval=<seconds>]
+      [--detect-zeros] [--catalog=<filename>] [--parent=<manifest> [--max-chain=<n>]] [--exclude=<pattern>...]
+      [--stdin-name=<name>] [--ledger [--ledger-cache=<dir>]] [--session-key] [--workers=<thread|process>]
+      [--bwlimit=<rates>] [--bwlimit-file=<filename>] [--progress=<text|json>] [--metrics=<filename>]
+      [--metrics-textfile=<filename>] <INPUTS>...
+  pog [--keyfile=<filename> | --decryption-keyfile=<filename>] [--decrypt | --dump-manifest] [--consume]
+      [--restore-cache=<bytes>] [--bwlimit=<rates>] [--bwlimit-file=<filename>] [--progress=<text|json>]
+      [--metrics=<filename>] [--metrics-textfile=<filename>] <INPUTS>...
   pog [--keyfile=<filename> | --decryption-keyfile=<filename> | --encryption-keyfile=<filename>] [--dump-manifest-index]
       <INPUTS>...
+  pog [--keyfile=<filename> | --decryption-keyfile=<filename>] --diff [--progress=<text|json>] <OLD> <NEW>
+  pog [--keyfile=<filename> | --decryption-keyfile=<filename>] --catalog=<filename> --catalog-import
+      [--progress=<text|json>] <INPUTS>...
+  pog [--keyfile=<filename> | --decryption-keyfile=<filename>] --catalog=<filename>
+      (--find=<path> | --find-blob=<blob> | --list-manifests) [--progress=<text|json>]
+  pog [--keyfile=<filename> | --decryption-keyfile=<filename> | --encryption-keyfile=<filename>] --verify [--deep]
+      [--concurrency=<1-N>] [--bwlimit=<rates>] [--bwlimit-file=<filename>] [--progress=<text|json>] <INPUTS>...
   pog (-h | --help)
 
 Examples:
@@ -19,53 +33,151 @@ Examples:
   pog --decrypt 2019-10-31T12:34:56.012345.mfn
 
   pog /home/myfile.original > outputs.txt
+  pg_dump mydb | pog --keyfile=secret.key --save-to=s3://mybucket --stdin-name=mydb.sql -
   pog --decrypt $(cat outputs.txt) > myfile.copy
 
   pog --encryption-keyfile=pki.encrypt /path/to/file* --save-to=s3://mybucket,b2://myotherbucket
   pog --encryption-keyfile=pki.encrypt --dump-manifest-index 2019-*
   pog --decryption-keyfile=pki.decrypt s3://mybucket/2019-10-31T12:34:56.012345.mfn
   pog --decryption-keyfile=pki.decrypt --consume 2019-10-31T12:34:56.012345.mfn
+  pog --keyfile=secret.key /opt/data --save-to=s3://mybucket --journal=opt-data.journal --resume
+  pog --keyfile=secret.key /opt/data --save-to=s3://mybucket,b2://mybucket --bwlimit=s3=2MB,b2=1MB
+  pog --keyfile=secret.key /opt/data --save-to=s3://mybucket --metrics-textfile=/var/lib/node_exporter/pog.prom
+  pog --keyfile=secret.key /home --save-to=s3://mybucket --exclude=node_modules --exclude='*.tmp' --exclude=.cache/
+  pog --keyfile=secret.key /etc --save-to=s3://mybucket --store-absolute-paths --catalog=backups.catalog
+  pog --keyfile=secret.key --catalog=backups.catalog --find=/etc/fstab
+  pog --keyfile=secret.key /srv --save-to=s3://mybucket --parent=s3://mybucket/2019-10-30T12:34:56.012345.mfn
+  pog --keyfile=secret.key --diff s3://mybucket/2019-10-30T12:34:56.012345.mfn 2019-10-31T12:34:56.012345.mfn
+  pog --encryption-keyfile=pki.encrypt --verify s3://mybucket/2019-10-31T12:34:56.012345.mfn
+  pog --decryption-keyfile=pki.decrypt --verify --deep s3://mybucket/2019-10-31T12:34:56.012345.mfn
 
 Options:
   -h --help                        Show this help.
   --version                        Show version.
+  --blob-identity=<compressed|plaintext>  Name blobs after their compressed contents, or after the plaintext.
+                                   With `plaintext`, blobs that already exist at every destination are not compressed or
+                                   encrypted at all -- and compression settings don't change blob names.
+                                   It is recorded in the manifest. [default: compressed]
+  --blob-naming=<sha256|blake2b>   How encrypted blobs are named. `blake2b` is faster, but won't dedup against
+                                   blobs named the other way. It is recorded in the manifest, and at each --save-to
+                                   destination: a run that names blobs differently is turned away. [default: sha256]
+  --bwlimit=<rates>                Limit transfer rates, in bytes/second: `10MB` for everything together, and/or
+                                   `s3=2MB,b2:mybucket=1MB` per destination.
+  --bwlimit-file=<filename>        Read --bwlimit rates from a schedule file, one set per line. Lines may start with the
+                                   hours they apply to (`08:00-18:00 s3=2MB`). Re-read when it changes, or on SIGHUP.
+  --checkpoint-interval=<seconds>  With --journal, save a partial manifest this often. [default: 1800]
+  --catalog=<filename>             A local (encrypted) index of manifests, paths and blobs. Manifests are added as they are
+                                   saved, or with --catalog-import. --find, --find-blob and --list-manifests use it.
+  --catalog-import                 Add (or refresh) manifests in the --catalog.
   --chunk-size=<bytes>             When encrypting, split large files into <chunkMB> size parts [default: 100MB].
-  --compresslevel=<1-22>           Zstd compression level during encryption. [default: 3]
+  --compresslevel=<1-22|min-max>   Zstd compression level during encryption. A range (`1-19`) adapts the level as we
+                                   go: higher while uploads are the bottleneck, lower while compression is. The levels
+                                   used are recorded in the manifest. [default: 3]
   --concurrency=<1-N>              How many threads to use for uploads. [default: 8]
   --consume                        Used with decrypt -- after decrypting a blob, delete it from disk to conserve space.
   --decrypt                        Decrypt instead.
+  --detect-zeros                   Also treat aligned 1MiB blocks of zeros as holes: they are read, but not compressed,
+                                   uploaded or restored. (Holes in sparse files are always skipped.)
+  --diff                           Show the files that were added, removed or changed between two manifests.
+  --deep                           Used with verify -- download, authenticate and decompress every blob.
   --decryption-keyfile=<filename>  Use asymmetric decryption -- <filename> contains the (binary) private key.
   --encryption-keyfile=<filename>  Use asymmetric encryption -- <filename> contains the (binary) public key.
+  --exclude=<pattern>              Skip files and directories that match <pattern>, gitignore-style: `node_modules`,
+                                   `*.tmp`, `build/cache/`. Excluded directories aren't walked. `.pogignore` files in
+                                   the directories we walk add patterns of their own, and `!<pattern>` re-includes.
+                                   Both are recorded in the manifest.
+  --find=<path>                    Which manifests in the --catalog have <path>, and when it changed.
+  --find-blob=<blob>               Which files in the --catalog use <blob>.
+  --journal=<filename>             Record finished files and blobs in <filename> as we go, so that an interrupted run can
+                                   be picked up again with --resume. It is removed when the run completes.
   --keyfile=<filename>             Instead of prompting for a password, use file contents as the secret.
+  --ledger                         Count each blob's manifests in an (encrypted) ledger at every --save-to destination,
+                                   so that `pog-cleanup --retire` can tell which blobs a retired manifest leaves unused.
+  --ledger-cache=<dir>             Where to keep local copies of ledgers. [default: ~/.cache/pog]
+  --list-manifests                 The manifests in the --catalog.
+  --max-chain=<n>                  With --parent, save a full manifest instead once restoring would mean resolving more
+                                   than <n> deltas. [default: 10]
+  --metrics=<filename>             Write a json summary of time and bytes spent per stage (and per blob) to <filename>.
+  --metrics-textfile=<filename>    Write per-stage metrics to <filename>, in prometheus' text format.
+  --parent=<manifest>              Save the manifest as a delta against <manifest>: only the files that were added,
+                                   changed or removed since. <manifest> must be kept alongside it. Needs a symmetric key.
+  --progress=<text|json>           Progress output format. `json` is one event per line, with byte counts, rates and
+                                   per-destination timings. [default: text]
+  --session-key                    With --encryption-keyfile, seal one key per run (saved with the blobs, as <id>.session)
+                                   and derive each blob's key from it, instead of sealing a key per blob. Much cheaper for
+                                   many small blobs. Older versions of pog can't read these blobs.
+  --stdin-name=<name>              The filename to store `-` (stdin) under. [default: stdin]
   --store-absolute-paths           Store files under their absolute paths (i.e. for backups)
+  --restore-cache=<bytes>          While decrypting, keep up to <bytes> of downloaded blobs that later files need, so each
+                                   blob is only downloaded once. The cache is in the system temp dir ($TMPDIR), on disk.
+                                   Files with the same contents are restored by copying the first one. [default: 1GB]
+  --resume                         Continue the run recorded in --journal. Files that were finished (and haven't changed
+                                   since) are skipped, and blobs that were uploaded aren't uploaded again.
   --save-to=<b2|s3|filename|...>   During encryption, where to save encrypted data. Can be a cloud service (s3, b2), or the
                                    path to a script to run with (<encrypted file name>, <temp file path>).
+  --verify                         Check that every blob referenced by the manifest(s) exists. Nothing is written.
+  --workers=<thread|process>       Where files are compressed and encrypted. `process` uses --concurrency worker
+                                   processes, to use more cores than Python threads can. Uploads stay in threads, and
+                                   stdin is always read in-process. [default: thread]
 """
+import signal
 import sys
 from base64 import urlsafe_b64encode
 from collections import ChainMap
-from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
-from getpass import getpass
-from hashlib import sha256
+from hashlib import blake2b, sha256
 from json import dumps, loads
+from multiprocessing import get_context
 from os import fdopen, makedirs, remove, utime, path
-from tempfile import TemporaryDirectory, gettempdir
+from queue import Empty
+from shutil import move
+from tempfile import TemporaryDirectory
+from threading import Lock
+from time import monotonic, time
 
 import zstandard as zstd
+from nacl.exceptions import CryptoError
 from nacl.secret import SecretBox as nacl_SecretBox
 from nacl.public import PrivateKey, PublicKey, SealedBox as nacl_SealedBox
 from nacl.utils import random as nacl_random
 from docopt import docopt
 from humanfriendly import parse_size
 
-from pog.lib.blob_store import BlobStore, download_list
+from pog.agent import agent_key_name, agent_socket_path, fetch_secret
+from pog.fs.localfs import copy_file
+from pog.lib.adaptive import AdaptiveLevel, parse_compresslevel
+from pog.lib.journal import Journal
+from pog.lib.ledger import Ledger
+from pog.lib.catalog import Catalog
+from pog.lib.delta import apply_delta, manifest_delta
+from pog.lib.exclude import Excludes
+from pog.lib.blob_store import BlobStore, download_list, _data_path, _get_temp_dir, _open_fs
 from pog.lib.local_file_list import local_file_list
-from pog.lib.secret import pass_to_hash
+from pog.lib.merkle import diff_manifests, manifest_tree
+from pog.lib.restore import BlobCache, RestorePlan
+from pog.lib.metrics import Metrics, _TimedReader
+from pog.lib.progress import TextProgress, get_progress
+from pog.lib.secret import hash_keyfile, pass_to_hash, prompt_password
+from pog.lib.sparse import SparseReader, SparseWriter, copy_sparse
+from pog.lib.throttle import Throttle
 
 
 KEY_SIZE = 32  # 256 bits
 MANIFEST_INDEX_BYTES = 4  # up to 4GB -- only enforced for asymmetric encryption
+MANIFEST_METADATA = ''  # archive-wide settings live under a key that can't be a filename
+SESSION_MAGIC = b'POGSESS\x01'  # a sealed box header starts with a random public key, so this won't collide
+SESSION_ID_BYTES = 8
+SESSION_NONCE_BYTES = 16
+SESSION_SUFFIX = '.session'
+WORKER_WINDOW = 2  # blobs a worker process can get ahead of its uploads
+WORKER_CHECK_SECONDS = 1  # how often we make sure a worker we're waiting on is still alive
+BLOB_NAMING_MARKER = 'blob_naming'  # at each destination, next to the manifests
+PATH_OPTS = (
+    '--keyfile', '--decryption-keyfile', '--encryption-keyfile', '--metrics', '--metrics-textfile', '--journal',
+    '--bwlimit-file', '--catalog', '--ledger-cache'
+)
 
 
 stdoutfd = None
@@ -78,14 +190,6 @@ def _stdout():
     return stdoutfd
 
 
-def _get_temp_dir():
-    # use ramdisk if possible
-    dirs = ['/dev/shm', gettempdir()]
-    for d in dirs:
-        if path.exists(d):
-            return d
-
-
 def _compress(bites, compresslevel):
     params = zstd.ZstdCompressionParameters.from_level(compresslevel)
     cctx = zstd.ZstdCompressor(compression_params=params)
@@ -97,6 +201,46 @@ def _decompress(bites):
     return cctx.decompress(bites)
 
 
+class _FullReader():
+    '''
+    pipes hand back whatever they have. We want whole chunks, so that the same stream makes the same blobs.
+    '''
+    def __init__(self, f):
+        self.f = f
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        if size < 0 or not data:
+            return data
+        parts = [data]
+        remaining = size - len(data)
+        while remaining > 0:
+            more = self.f.read(remaining)
+            if not more:
+                break
+            parts.append(more)
+            remaining -= len(more)
+        return b''.join(parts)
+
+
+class _NullSink():
+    '''
+    a write-only file that throws everything away, but keeps count.
+    '''
+    def __init__(self):
+        self.bytes_written = 0
+
+    def write(self, data):
+        self.bytes_written += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
 def _box_overhead(box):
     if isinstance(box, nacl_SecretBox):
         overhead = box.NONCE_SIZE + box.MACBYTES
@@ -109,6 +253,14 @@ def _header_size(box):
     return KEY_SIZE + _box_overhead(box)
 
 
+def _session_name(session_id):
+    return '{}{}'.format(session_id.hex(), SESSION_SUFFIX)
+
+
+def _session_file_key(session_key, nonce):
+    return blake2b(nonce, key=session_key, digest_size=KEY_SIZE, person=b'pog-session').digest()
+
+
 def get_asymmetric_encryption(decryption_keyfile=None, encryption_keyfile=None):
     secret = None
     box = None
@@ -133,42 +285,128 @@ def blobname(content, secret):
     return urlsafe_b64encode(sha256(secret + content_hash).digest())
 
 
-def _print_progress(count, total, filename):
-    print('*** {}/{}: {}'.format(count, total, filename))
+def blobname_blake2b(content, secret):
+    # one pass, keyed. Same length as the sha256 names
+    return urlsafe_b64encode(blake2b(content, key=secret, digest_size=32, person=b'pog-blob').digest())
+
 
+BLOB_NAMING = {
+    'sha256': blobname,
+    'blake2b': blobname_blake2b,
+}
+
+
+def get_secret(keyfile=None, prompt=True):
+    '''
+    if $POG_AGENT_SOCK is set, pog-agent is asked first.
+    It may already have the key -- and if not, it will keep it for next time.
+    A password key is only used without prompting if it's named in $POG_AGENT_KEY.
+    '''
+    use_agent = bool(agent_socket_path())
+    if use_agent:
+        secret = fetch_secret(keyfile, name=None if keyfile else agent_key_name())
+        if secret:
+            return secret
 
-def get_secret(keyfile=None):
     if keyfile:
-        with open(keyfile, 'rb') as f:
-            h = sha256()
-            buffer = f.read(16384)
-            while buffer:
-                h.update(buffer)
-                buffer = f.read(16384)
-            return h.digest()
+        return hash_keyfile(keyfile)
 
     # if keyfile failed, prompt for password
-    while True:
-        password = getpass()
-        pass2 = getpass()
-        if password != pass2:
-            print('passwords did not match! Please try again.', file=sys.stderr)
-            continue
-        break
+    if not prompt:
+        raise ValueError('no keyfile, and pog-agent does not have the password key named by $POG_AGENT_KEY')
+    password = prompt_password()
+    if use_agent:
+        secret = fetch_secret(password=password)
+        if secret:
+            return secret
     return pass_to_hash(password)
 
 
+class _PendingFile():
+    '''
+    counts down a file's blobs as they land at every destination. `done()` is called once they all have.
+    The file itself holds one count, until we're done making blobs for it.
+    '''
+    def __init__(self, done):
+        self.remaining = 1
+        self.done = done
+        self.lock = Lock()
+
+    def add(self):
+        with self.lock:
+            self.remaining += 1
+
+    def finish(self):
+        with self.lock:
+            self.remaining -= 1
+            last = self.remaining == 0
+        if last:
+            self.done()
+
+
 class Encryptor():
     def __init__(self, secret, crypto_box=None, chunk_size=100000000, compresslevel=3, concurrency=8,
-                 store_absolute_paths=False, blob_store=None):
+                 store_absolute_paths=False, blob_store=None, metrics=None, progress=None, working_dir=None,
+                 blob_naming='sha256', blob_identity='compressed', journal=None, resume=False,
+                 checkpoint_interval=1800, detect_zeros=False, catalog=None, parent=None, max_chain=10,
+                 exclude=None, ledger=False, ledger_cache=None, adaptive_level=None, session_key=False,
+                 workers='thread'):
+        self._raw_secret = secret
         self.secret = sha256(secret).digest()
         self.index_box = nacl_SecretBox(secret)
         self.box = crypto_box or self.index_box
         self.chunk_size = chunk_size
         self.compresslevel = compresslevel
+        self.adaptive_level = adaptive_level
         self.concurrency = concurrency
         self.store_absolute_paths = store_absolute_paths
-        self.blob_store = blob_store or BlobStore()
+        self.blob_store = blob_store or BlobStore(metrics=metrics, working_dir=working_dir)
+        self.metrics = metrics or self.blob_store.metrics
+        self.progress = progress or TextProgress()
+        self.working_dir = working_dir
+
+        if blob_naming not in BLOB_NAMING:
+            raise ValueError('unknown blob naming: {}'.format(blob_naming))
+        self.blob_naming = blob_naming
+
+        if blob_identity not in ('compressed', 'plaintext'):
+            raise ValueError('unknown blob identity: {}'.format(blob_identity))
+        self.blob_identity = blob_identity
+        # plaintext names must never collide with compressed names, so they get their own key
+        self.plaintext_secret = sha256(b'pog-plaintext-identity' + secret).digest()
+        self.detect_zeros = detect_zeros
+        self.catalog = catalog
+        self.exclude = exclude or []
+        self.ledger = ledger
+        self.ledger_cache = ledger_cache
+
+        if parent and crypto_box:
+            raise ValueError('delta manifests need a key that can read the --parent manifest')
+        if session_key and not crypto_box:
+            raise ValueError('session keys are for asymmetric encryption')
+        self.session_key = session_key
+        self._session = None
+
+        if workers not in ('thread', 'process'):
+            raise ValueError('unknown workers: {}'.format(workers))
+        self.workers = workers
+        self._process_pool = None
+        self._process_manager = None
+        self.parent = parent
+        self.max_chain = max_chain
+        self._parent_reader = Decryptor(secret, metrics=self.metrics, working_dir=working_dir) if parent else None
+
+        self.journal = Journal(self._local_path(journal), self.index_box) if journal else None
+        self.resume = resume
+        self.checkpoint_interval = checkpoint_interval
+        self.lock = Lock()
+        self._journal_files = {}
+        self._journal_blobs = set()
+        self._journal_sessions = []
+        self._completed = {}
+        self._blob_levels = {}
+        self._last_checkpoint = monotonic()
+        self._checkpointing = Lock()
 
     def _pad_data(self, data):
         '''
@@ -188,6 +426,11 @@ class Encryptor():
             return data + padding
         return data
 
+    def _local_path(self, filename):
+        if not self.working_dir:
+            return filename
+        return path.join(self.working_dir, filename)
+
     def archived_filename(self, filename):
         '''
         for the moment we're doing some slightly weird stuff
@@ -202,7 +445,39 @@ class Encryptor():
         # otherwise, relative path
         return filename
 
-    def _write_header(self, f):
+    def _start_session(self):
+        '''
+        one sealed key for the run, saved (like a blob) before any blob that needs it.
+        '''
+        session_id, session_key = nacl_random(SESSION_ID_BYTES), nacl_random(KEY_SIZE)
+        with TemporaryDirectory(dir=_get_temp_dir()) as tempdir:
+            temp_path = path.join(tempdir, 'session')
+            with open(temp_path, 'wb') as f:
+                f.write(self.box.encrypt(session_key))
+            self.blob_store.save_blob(_session_name(session_id), temp_path)
+        self._session = (session_id, session_key)
+        if self.journal:
+            self.journal.append({'session': _session_name(session_id)})
+
+    def _session_blobs(self):
+        '''
+        the session key file is needed to read this run's blobs, so manifests list it alongside them.
+        If we're resuming, the blobs from before we were interrupted need that run's session.
+        Blobs that were already stored may need an earlier run's session instead, so it is never removed.
+        '''
+        sessions = list(self._journal_sessions)
+        if self._session:
+            sessions.append(_session_name(self._session[0]))
+        return sorted(set(sessions))
+
+    def _write_header(self, f, blob=None):
+        if blob and self._session:
+            # the blob's key is derived from the session key, instead of sealed on its own
+            session_id, session_key = self._session
+            nonce = nacl_random(SESSION_NONCE_BYTES)
+            f.write(SESSION_MAGIC + session_id + nonce)
+            return nacl_SecretBox(_session_file_key(session_key, nonce))
+
         file_key = nacl_random(KEY_SIZE)
         header = self.box.encrypt(file_key)
         assert len(header) == _header_size(self.box)
@@ -222,19 +497,41 @@ class Encryptor():
         file_box = nacl_SecretBox(file_key)
         return file_box
 
-    def _write(self, f, data, manifest_index=False):
-        data = self._pad_data(data)
-        if manifest_index:
-            file_box = self._write_index_header(f, len(data))
-        else:
-            file_box = self._write_header(f)
-        f.write(file_box.encrypt(data))
+    def _write(self, f, data, manifest_index=False, blob=None):
+        with self.metrics.stage('encrypt', len(data), blob):
+            data = self._pad_data(data)
+            if manifest_index:
+                file_box = self._write_index_header(f, len(data))
+            else:
+                file_box = self._write_header(f, blob)
+            data = file_box.encrypt(data)
+        with self.metrics.stage('write', len(data), blob):
+            f.write(data)
 
     def _mfn_get_all_blobs(self, mfn):
         for og_filename, info in mfn.items():
             yield from info['blobs']
 
-    def save_manifest(self, mfn, filename=None):
+    def manifest_metadata(self):
+        '''
+        settings are only recorded when they aren't the default.
+        '''
+        metadata = {}
+        if self.blob_naming != 'sha256':
+            metadata['blob_naming'] = self.blob_naming
+        if self.blob_identity != 'compressed':
+            metadata['blob_identity'] = self.blob_identity
+        if self.adaptive_level:
+            metadata['compresslevels'] = self.adaptive_level.levels_used()
+        sessions = self._session_blobs()
+        if sessions:
+            metadata['sessions'] = sessions
+        return metadata
+
+    def save_manifest(self, mfn, filename=None, metadata=None, catalog_mfn=None):
+        '''
+        `catalog_mfn` is what goes in the catalog, if `mfn` is only a delta.
+        '''
         if not filename:
             filename = '{}.mfn'.format(datetime.now().isoformat())
 
@@ -243,67 +540,564 @@ class Encryptor():
             with open(temp_path, 'wb') as f:
                 # store mfn index if needed
                 if self.box != self.index_box:
-                    all_blobs = sorted(list(self._mfn_get_all_blobs(mfn)))
+                    sessions = metadata.get('sessions', []) if metadata else []
+                    all_blobs = sorted(list(self._mfn_get_all_blobs(mfn)) + sessions)
                     index_bytes = dumps(all_blobs).encode('utf-8')
                     self._write(f, _compress(index_bytes, self.compresslevel), manifest_index=True)
 
-                full_manifest_bytes = dumps(mfn).encode('utf-8')
+                full_mfn = {MANIFEST_METADATA: metadata, **mfn} if metadata else mfn
+                full_manifest_bytes = dumps(full_mfn).encode('utf-8')
                 self._write(f, _compress(full_manifest_bytes, self.compresslevel))
-            self.blob_store.save(filename, temp_path)
+            self.blob_store.save(filename, temp_path, overwrite=True)
+        if self.catalog:
+            self.catalog.add_manifest(
+                filename, catalog_mfn or mfn, self.blob_store.destination_names(),
+                partial=bool(metadata and metadata.get('partial'))
+            )
         return filename
 
-    def generate_encrypted_blobs(self, filename):
-        cctx = zstd.ZstdCompressor(level=self.compresslevel)
-        td = TemporaryDirectory(dir=_get_temp_dir())
-        with open(filename, 'rb') as f, cctx.stream_reader(f) as compressed_stream, td as tempdir:
+    def _load_parent(self):
+        '''
+        (name, resolved manifest, chain length) for --parent.
+        '''
+        reader = self._parent_reader
+        for filename, fs_info, _ in reader._download_list([self.parent], extract=True):
+            mfn, metadata = reader.load_manifest(filename, with_metadata=True, fs_info=fs_info)
+        if metadata.get('partial'):
+            # the checkpoint will be replaced by the finished manifest, and the delta would stop making sense
+            raise ValueError('{} is a partial manifest, and can not be a --parent'.format(self.parent))
+        return path.basename(self.parent), mfn, metadata.get('chain', 0)
+
+    def _delta(self, mfn, metadata, parent):
+        '''
+        the manifest to save: `mfn` as a delta against `parent` -- unless the chain is too long,
+        or so much changed that the delta wouldn't be any smaller. `metadata` is updated to match.
+        '''
+        parent_name, parent_mfn, chain = parent
+        if chain + 1 > self.max_chain:
+            return mfn
+        changed, removed = manifest_delta(parent_mfn, mfn)
+        if len(changed) + len(removed) >= len(mfn):
+            return mfn
+        metadata.update(parent=parent_name, chain=chain + 1, removed=removed)
+        return changed
+
+    def _check_blob_naming(self):
+        '''
+        blobs named one way never dedup against blobs named the other way, so a destination sticks to one scheme.
+        The first run to a destination records it -- and runs with another scheme are turned away.
+        '''
+        for dest, fs in self.blob_store.filesystems():
+            with TemporaryDirectory(dir=_get_temp_dir()) as tempdir:
+                local_path = path.join(tempdir, BLOB_NAMING_MARKER)
+                if fs.exists(BLOB_NAMING_MARKER):
+                    fs.download_file(local_path, BLOB_NAMING_MARKER)
+                    with open(local_path) as f:
+                        recorded = f.read().strip()
+                    if recorded != self.blob_naming:
+                        raise ValueError(
+                            '{} has blobs named with --blob-naming={}, which blobs named with {} would never dedup '
+                            'against. Use --blob-naming={}, or another destination'.format(
+                                dest, recorded, self.blob_naming, recorded)
+                        )
+                    continue
+
+                with open(local_path, 'w') as f:
+                    f.write(self.blob_naming + '\n')
+                fs.upload_file(local_path, BLOB_NAMING_MARKER)
+
+    def _update_ledgers(self, mfn_filename, mfn, parent=None):
+        # session key files aren't counted (or retired): a deduplicated blob may need an earlier run's session
+        blobs = list(self._mfn_get_all_blobs(mfn))
+        for dest, fs in self.blob_store.filesystems():
+            ledger = Ledger(fs, self.index_box, dest, self.ledger_cache).load()
+            if ledger.add_manifest(mfn_filename, blobs, parent):
+                ledger.save()
+            self.progress.emit(
+                'ledger', action='encrypt', destination=dest, generation=ledger.generation, blobs=len(ledger.refs)
+            )
+
+    def _reader(self, raw, holes):
+        '''
+        holes are skipped, not read. If `holes` is a list, it's filled in with them once the file has been read.
+        '''
+        return _TimedReader(SparseReader(raw, path.getsize(raw.name), self.detect_zeros, holes))
+
+    def generate_encrypted_blobs(self, filename, holes=None):
+        with open(filename, 'rb') as raw:
+            yield from self._encrypted_blobs(self._reader(raw, holes))
+
+    def _level(self):
+        return self.adaptive_level.level if self.adaptive_level else self.compresslevel
+
+    def _compressed_at(self, blob_name, level, seconds):
+        '''
+        with an adaptive level, the level is checked against the upload once the blob lands.
+        '''
+        if self.adaptive_level:
+            self.adaptive_level.used(level)
+            self._blob_levels[blob_name] = (level, seconds)
+
+    def _encrypted_blobs(self, reader):
+        # one zstd stream per file, so an adaptive level can only change between files
+        level = self._level()
+        cctx = zstd.ZstdCompressor(level=level)
+        with TemporaryDirectory(dir=_get_temp_dir()) as tempdir:
+            with cctx.stream_reader(reader) as compressed_stream:
+                while True:
+                    start = monotonic()
+                    data = compressed_stream.read(self.chunk_size)
+                    elapsed = monotonic() - start
+                    read_seconds, read_bytes = reader.lap()
+                    if not data:
+                        break
+
+                    hash_start = monotonic()
+                    blob_name = BLOB_NAMING[self.blob_naming](data, self.secret).decode('utf-8')
+                    self.metrics.record('hash', monotonic() - hash_start, len(data), blob_name, start=hash_start)
+                    self.metrics.record('read', read_seconds, read_bytes, blob_name, start=start)
+                    self.metrics.record('compress', elapsed - read_seconds, len(data), blob_name, start=start)
+                    self._compressed_at(blob_name, level, elapsed - read_seconds)
+
+                    temp_path = path.join(tempdir, blob_name)
+                    with open(temp_path, 'wb') as f:
+                        self._write(f, data, blob=blob_name)
+                    yield blob_name, temp_path, read_bytes, None
+
+    def generate_plaintext_named_blobs(self, filename, holes=None):
+        '''
+        each chunk of the file is named for its plaintext, then compressed as its own zstd frame.
+        If the blob is already everywhere it needs to be, we don't compress or encrypt it at all:
+        temp_path is None, and we yield what each destination told us instead.
+        '''
+        with open(filename, 'rb') as raw:
+            yield from self._plaintext_named_blobs(self._reader(raw, holes))
+
+    def _plaintext_named_blobs(self, reader):
+        # each chunk is its own frame, so an adaptive level can change from one to the next
+        compressors = {}
+        with TemporaryDirectory(dir=_get_temp_dir()) as tempdir:
             while True:
-                data = compressed_stream.read(self.chunk_size)
+                start = monotonic()
+                data = reader.read(self.chunk_size)
+                read_seconds, read_bytes = reader.lap()
                 if not data:
                     break
 
-                blob_name = blobname(data, self.secret).decode('utf-8')
+                hash_start = monotonic()
+                blob_name = BLOB_NAMING[self.blob_naming](data, self.plaintext_secret).decode('utf-8')
+                self.metrics.record('hash', monotonic() - hash_start, len(data), blob_name, start=hash_start)
+                self.metrics.record('read', read_seconds, read_bytes, blob_name, start=start)
+
+                found = [] if blob_name in self._journal_blobs else self.blob_store.find_blob(blob_name)
+                if found is not None:
+                    yield blob_name, None, read_bytes, found
+                    continue
+
+                level = self._level()
+                if level not in compressors:
+                    compressors[level] = zstd.ZstdCompressor(level=level)
+                cctx = compressors[level]
+                compress_start = monotonic()
+                with self.metrics.stage('compress', len(data), blob_name):
+                    data = cctx.compress(data)
+                self._compressed_at(blob_name, level, monotonic() - compress_start)
+
                 temp_path = path.join(tempdir, blob_name)
                 with open(temp_path, 'wb') as f:
-                    self._write(f, data)
-                yield temp_path
+                    self._write(f, data, blob=blob_name)
+                yield blob_name, temp_path, read_bytes, None
+
+    def _start_journal(self):
+        '''
+        returns the manifest filename for this run -- the one in the journal, if we're resuming.
+        '''
+        settings = {
+            'blob_naming': self.blob_naming, 'blob_identity': self.blob_identity, 'chunk_size': self.chunk_size,
+            'store_absolute_paths': bool(self.store_absolute_paths),
+        }
+        records = []
+        if self.journal.exists():
+            if not self.resume:
+                raise ValueError(
+                    'journal {} already exists. Use --resume to continue that run, or remove it'.format(
+                        self.journal.filename)
+                )
+            records = self.journal.load()
+
+        run = records[0].get('run') if records else None
+        if run:
+            changed = sorted(k for k, v in settings.items() if run.get(k) != v)
+            if changed:
+                raise ValueError('journal {} was written with different settings: {}'.format(
+                    self.journal.filename, ', '.join(changed)))
+        else:
+            run = {'manifest': '{}.mfn'.format(datetime.now().isoformat()), **settings}
+            records = [{'run': run}]
+
+        for record in records[1:]:
+            if 'blob' in record:
+                self._journal_blobs.add(record['blob'])
+            elif 'session' in record:
+                self._journal_sessions.append(record['session'])
+            elif 'file' in record:
+                self._journal_files[record['file']] = record
+        self.journal.open(records)
+        return run['manifest']
+
+    def _checkpoint(self, mfn_filename):
+        '''
+        every so often, put out a manifest of the files that are done so far.
+        The final manifest replaces it.
+        '''
+        if monotonic() - self._last_checkpoint < self.checkpoint_interval:
+            return
+        if not self._checkpointing.acquire(blocking=False):
+            return
+        try:
+            self._last_checkpoint = monotonic()
+            with self.lock:
+                mfn = dict(sorted(self._completed.items()))
+            self.save_manifest(mfn, mfn_filename, {**self.manifest_metadata(), 'partial': True})
+            self.progress.emit('checkpoint', action='encrypt', files=len(mfn), manifest=mfn_filename)
+        finally:
+            self._checkpointing.release()
+
+    def _file_done(self, filename, entry, archived=None):
+        archived = archived or self.archived_filename(filename)
+        with self.lock:
+            self._completed[archived] = entry
+        if self.journal:
+            self.journal.append({'file': filename, **entry})
+            self._checkpoint(self.mfn_filename)
+
+    def _blob_done(self, filename, blob_name, bytes_in, bytes_out, pending, dests):
+        status = 'dedup' if all(d['status'] == 'exists' for d in dests) else 'uploaded'
+        level = {}
+        compressed = self._blob_levels.pop(blob_name, None)
+        if compressed:
+            level['level'] = compressed[0]
+            uploads = [d['seconds'] for d in dests if d['status'] == 'uploaded']
+            if uploads:
+                self.adaptive_level.record(*compressed, max(uploads))
+        self.progress.emit(
+            'blob', text=True, filename=filename, blob=blob_name, status=status, bytes_in=bytes_in,
+            bytes_out=bytes_out, destinations=dests, **level
+        )
+        if self.journal and blob_name not in self._journal_blobs:
+            self.journal.append({'blob': blob_name})
+        pending.finish()
+
+    def _resumed_file(self, filename, local_path):
+        '''
+        the journal's entry for this file -- if we finished it last time, and it hasn't changed since.
+        '''
+        record = self._journal_files.get(filename)
+        if not record:
+            return None
+        if record['size'] != path.getsize(local_path) or record['mtime'] != path.getmtime(local_path):
+            return None
+        return {k: record[k] for k in ('blobs', 'atime', 'mtime', 'size', 'holes') if k in record}
+
+    def _store_blobs(self, filename, outputs, blobs, pending):
+        '''
+        queues each blob as it comes out of `blobs`, and adds it to `outputs`. Returns (bytes in, bytes out).
+        '''
+        bytes_in = bytes_out = 0
+        try:
+            for blob_name, temp_path, blob_bytes_in, dests in blobs:
+                outputs.append(blob_name)
+                bytes_in += blob_bytes_in
+                pending.add()
+                if temp_path and blob_name in self._journal_blobs:  # uploaded before we were interrupted
+                    remove(temp_path)
+                    temp_path, dests = None, []
+                if not temp_path:  # already everywhere
+                    self._blob_done(filename, blob_name, blob_bytes_in, 0, pending, dests)
+                    continue
+
+                blob_bytes_out = path.getsize(temp_path)
+                bytes_out += blob_bytes_out
+                self.blob_store.queue_blob(
+                    blob_name, temp_path,
+                    partial(self._blob_done, filename, blob_name, blob_bytes_in, blob_bytes_out, pending)
+                )
+        except Exception as e:
+            self.progress.emit('error', filename=filename, error=str(e))
+            raise
+        return bytes_in, bytes_out
 
     def encrypt_and_store_file(self, args):
         filename, current_count, total_count = args
-        _print_progress(current_count+1, total_count+1, filename)
+        progress = {'current': current_count+1, 'total': total_count+1, 'filename': filename}
+        local_path = self._local_path(filename)
+        self.progress.emit('file_start', text=True, action='encrypt', bytes=path.getsize(local_path), **progress)
+
+        start = monotonic()
+        resumed = self._resumed_file(filename, local_path)
+        if resumed:
+            self._file_done(filename, resumed)
+            self.progress.emit(
+                'file_end', action='encrypt', blobs=len(resumed['blobs']), bytes_in=0, bytes_out=0,
+                seconds=monotonic() - start, resumed=True, **progress
+            )
+            return {self.archived_filename(filename): resumed}
+
         outputs = []
-        for temp_path in self.generate_encrypted_blobs(filename):
-            blob_name = path.basename(temp_path)
-            self.blob_store.save_blob(blob_name, temp_path)
-            outputs.append(blob_name)
-            print(blob_name)
+        entry = {
+            'blobs': outputs,
+            'atime': path.getatime(local_path),
+            'mtime': path.getmtime(local_path),
+            'size': path.getsize(local_path),
+        }
+        # the file is done when every one of its blobs has landed
+        pending = _PendingFile(partial(self._file_done, filename, entry))
+        holes = []
+        if self._process_pool:
+            blobs = self._worker_blobs(local_path, holes)
+        elif self.blob_identity == 'plaintext':
+            blobs = self.generate_plaintext_named_blobs(local_path, holes)
+        else:
+            blobs = self.generate_encrypted_blobs(local_path, holes)
+        bytes_in, bytes_out = self._store_blobs(filename, outputs, blobs, pending)
+        if holes:
+            entry['holes'] = holes
+        pending.finish()
+
+        self.progress.emit(
+            'file_end', action='encrypt', blobs=len(outputs), bytes_in=bytes_in, bytes_out=bytes_out,
+            seconds=monotonic() - start, **progress
+        )
+        return {self.archived_filename(filename): dict(entry)}
+
+    def _worker_settings(self):
+        '''
+        what a worker process needs to make the same blobs we would. Keys, not boxes: boxes don't pickle.
+        '''
         return {
-            self.archived_filename(filename):
-                {
-                    'blobs': outputs,
-                    'atime': path.getatime(filename),
-                    'mtime': path.getmtime(filename),
-                }
+            'secret': self._raw_secret, 'asymmetric': self.box != self.index_box, 'session': self._session,
+            'chunk_size': self.chunk_size, 'blob_naming': self.blob_naming, 'blob_identity': self.blob_identity,
+            'detect_zeros': self.detect_zeros, 'adaptive': bool(self.adaptive_level),
+            'save_to': ','.join(self.blob_store.destination_names()), 'working_dir': self.working_dir,
         }
 
-    def encrypt(self, *inputs):
+    def _start_process_pool(self):
+        context = get_context('spawn')
+        # the manager's queues can be passed to a task. Plain multiprocessing queues can't
+        self._process_manager = context.Manager()
+        self._process_pool = ProcessPoolExecutor(
+            max_workers=self.concurrency, mp_context=context, initializer=_init_worker,
+            initargs=(self._worker_settings(),)
+        )
+
+    def _stop_process_pool(self):
+        self._process_pool.shutdown()
+        self._process_manager.shutdown()
+        self._process_pool = self._process_manager = None
+
+    def _worker_blobs(self, local_path, holes):
+        '''
+        like generate_encrypted_blobs(), but the blobs are made by a worker process.
+        It hands them over through a queue -- see _encrypt_in_worker(). The blob files are moved into `task_dir`,
+        which is cleaned up here, even if the worker dies.
+        '''
+        with TemporaryDirectory(dir=_get_temp_dir()) as task_dir:
+            blobs, stop = self._process_manager.Queue(maxsize=WORKER_WINDOW), self._process_manager.Event()
+            future = self._process_pool.submit(_encrypt_in_worker, local_path, task_dir, self._level(), blobs, stop)
+            try:
+                while True:
+                    try:
+                        info = blobs.get(timeout=WORKER_CHECK_SECONDS)
+                    except Empty:
+                        if future.done():  # the worker died without telling us
+                            future.result()
+                            raise RuntimeError('worker process stopped before it finished {}'.format(local_path))
+                        continue
+
+                    if info is None:  # the worker failed: its error is raised here
+                        future.result()
+                        raise RuntimeError('worker process failed on {}'.format(local_path))
+                    if 'holes' in info:
+                        holes.extend(info['holes'])
+                        future.result()
+                        return
+                    if info.get('compressed'):
+                        self._compressed_at(info['blob'], *info['compressed'])
+                    yield info['blob'], info['path'], info['bytes_in'], info['dests']
+            finally:
+                if not future.done():  # we've given up on the file. The worker may be waiting on us to take a blob
+                    stop.set()
+                    future.cancel()
+                    while not future.done():
+                        try:
+                            blobs.get(timeout=WORKER_CHECK_SECONDS)
+                        except Empty:
+                            pass
+
+    def encrypt_and_store_stream(self, name, stream, current_count=0, total_count=1):
+        '''
+        like a file, but read from a file object (i.e. a pipe) as it arrives, and stored under `name`.
+        A stream's atime and mtime are when we got to the end of it.
+        '''
+        progress = {'current': current_count+1, 'total': total_count+1, 'filename': name}
+        self.progress.emit('file_start', text=True, action='encrypt', **progress)
+
+        start = monotonic()
+        outputs = []
+        entry = {'blobs': outputs}
+        pending = _PendingFile(partial(self._file_done, name, entry, name))
+        reader = _TimedReader(_FullReader(stream))
+        if self.blob_identity == 'plaintext':
+            blobs = self._plaintext_named_blobs(reader)
+        else:
+            blobs = self._encrypted_blobs(reader)
+        bytes_in, bytes_out = self._store_blobs(name, outputs, blobs, pending)
+        now = time()
+        entry.update(atime=now, mtime=now, size=bytes_in)
+        pending.finish()
+
+        self.progress.emit(
+            'file_end', action='encrypt', blobs=len(outputs), bytes_in=bytes_in, bytes_out=bytes_out,
+            seconds=monotonic() - start, **progress
+        )
+        return {name: dict(entry)}
+
+    def encrypt(self, *inputs, streams=None):
+        '''
+        `streams` is {name: file object}. They're read as the data arrives, so they can be pipes.
+        '''
         mfn = dict()
-        all_inputs = local_file_list(*inputs)
+        streams = streams or {}
+        if self.ledger and not self.blob_store.filesystems():
+            raise ValueError('--ledger needs a --save-to destination that pog can read back (s3, b2 or local)')
+        self._check_blob_naming()
+        excludes = Excludes(self.exclude)
+        all_inputs = local_file_list(*inputs, working_dir=self.working_dir, exclude=excludes)
+        total = len(all_inputs) + len(streams)
+        parent = self._load_parent() if self.parent else None
+        self.mfn_filename = self._start_journal() if self.journal else None
+        if self.session_key:
+            self._start_session()
+        if self.workers == 'process':
+            self._start_process_pool()
+        total_bytes = sum(path.getsize(self._local_path(f)) for f in all_inputs)
+        self.progress.emit('start', action='encrypt', files=total, bytes=total_bytes)
 
         exe = ThreadPoolExecutor(max_workers=self.concurrency)
-        args = [(filename, count, len(all_inputs)) for count, filename in enumerate(all_inputs)]
-        mfn = exe.map(self.encrypt_and_store_file, args)
-        mfn = dict(ChainMap(*mfn))  # smash the maps together
-        mfn = dict(sorted(mfn.items()))
-
-        mfn_filename = self.save_manifest(mfn)
-        _print_progress(len(all_inputs)+1, len(all_inputs)+1, mfn_filename)
+        args = [(filename, count, total) for count, filename in enumerate(all_inputs)]
+        try:
+            # whoever is writing to a pipe is waiting on us, so streams go first
+            stream_mfns = [
+                exe.submit(self.encrypt_and_store_stream, name, stream, len(all_inputs) + count, total)
+                for count, (name, stream) in enumerate(streams.items())
+            ]
+            mfn = list(exe.map(self.encrypt_and_store_file, args)) + [f.result() for f in stream_mfns]
+            mfn = dict(ChainMap(*mfn))  # smash the maps together
+            mfn = dict(sorted(mfn.items()))
+
+            # the manifest only goes out once every destination has every blob
+            self.blob_store.drain()
+        finally:
+            if self._process_pool:
+                self._stop_process_pool()
+            self.blob_store.close()
+            if self.journal:
+                self.journal.close()
+        if self.blob_store.save_to:
+            for stats in self.blob_store.destination_stats():
+                self.progress.emit('destination', action='encrypt', **stats)
+
+        # a summary of the manifest's directories, so that diffs can skip over the parts that didn't change
+        metadata = {**self.manifest_metadata(), **excludes.metadata(), 'tree': manifest_tree(mfn)}
+        stored = self._delta(mfn, metadata, parent) if parent else mfn
+        mfn_filename = self.save_manifest(stored, self.mfn_filename, metadata=metadata, catalog_mfn=mfn)
+        if self.ledger:
+            self._update_ledgers(mfn_filename, mfn, metadata.get('parent'))
+        if self.journal:
+            self.journal.remove()
+        self.progress.emit(
+            'manifest', text=True, current=total+1, total=total+1, filename=mfn_filename
+        )
+        self.progress.emit(
+            'done', action='encrypt', files=total, manifest=mfn_filename, parent=metadata.get('parent'),
+            stored=len(stored)
+        )
+        return mfn_filename
+
+
+_worker_encryptor = None
+
+
+def _init_worker(settings):
+    global _worker_encryptor
+    secret = settings['secret']
+    crypto_box = nacl_SealedBox(PublicKey(secret)) if settings['asymmetric'] else None
+    working_dir = settings['working_dir']
+    _worker_encryptor = Encryptor(
+        secret, crypto_box, settings['chunk_size'], blob_store=BlobStore(settings['save_to'], working_dir=working_dir),
+        working_dir=working_dir, blob_naming=settings['blob_naming'], blob_identity=settings['blob_identity'],
+        detect_zeros=settings['detect_zeros']
+    )
+    _worker_encryptor._session = settings['session']
+    _worker_encryptor.adaptive_level = AdaptiveLevel(1, 22) if settings['adaptive'] else None
+
+
+def _encrypt_in_worker(filename, task_dir, level, blobs_out, stop):
+    '''
+    makes the file's blobs, and hands each one to the parent as it's done:
+    the blob file is moved to `task_dir`, and its description put on `blobs_out`.
+    That queue is bounded, so once the parent is far enough behind, we wait -- like a generator would.
+    The last message is the file's holes. If we fail, it's None, and the error is in our future.
+    If the parent gives up on the file, it sets `stop`.
+    '''
+    en = _worker_encryptor
+    en.compresslevel = level
+    if en.adaptive_level:  # the parent picks the level. We only measure
+        en.adaptive_level.level = level
+
+    holes = []
+    if en.blob_identity == 'plaintext':
+        blobs = en.generate_plaintext_named_blobs(filename, holes)
+    else:
+        blobs = en.generate_encrypted_blobs(filename, holes)
+
+    try:
+        for count, (blob_name, temp_path, bytes_in, dests) in enumerate(blobs):
+            if stop.is_set():
+                return
+            info = {
+                'blob': blob_name, 'path': None, 'bytes_in': bytes_in, 'dests': dests,
+                'compressed': en._blob_levels.pop(blob_name, None),
+            }
+            if temp_path:
+                info['path'] = path.join(task_dir, '{:08d}.blob'.format(count))
+                move(temp_path, info['path'])
+            blobs_out.put(info)
+    except BaseException:
+        blobs_out.put(None)
+        raise
+    blobs_out.put({'holes': holes})
 
 
 class Decryptor():
-    def __init__(self, secret=None, crypto_box=None, consume=False):
+    def __init__(self, secret=None, crypto_box=None, consume=False, metrics=None, progress=None, working_dir=None,
+                 throttle=None, cache_bytes=1000000000):
         self.index_box = nacl_SecretBox(secret)
         self.box = crypto_box or self.index_box
         self.consume = consume
+        self.metrics = metrics or Metrics()
+        self.progress = progress or TextProgress()
+        self.working_dir = working_dir
+        self.throttle = throttle
+        self.cache_bytes = cache_bytes
+        self._session_keys = {}
+        self._session_lock = Lock()
+        self._session_problems = {}
+
+    def _download_list(self, *args, **kwargs):
+        return download_list(
+            *args, metrics=self.metrics, working_dir=self.working_dir, throttle=self.throttle, **kwargs
+        )
 
     def _read_index_header(self, f):
         header_ciphertext = f.read(_header_size(self.index_box) + MANIFEST_INDEX_BYTES)
@@ -326,7 +1120,57 @@ class Decryptor():
         assert len(file_key) == KEY_SIZE
         return nacl_SecretBox(file_key)
 
-    def load_manifest(self, filename):
+    def _session_key(self, session_id, fs_info=None):
+        '''
+        the sealed session key is stored next to the blobs, as <id>.session.
+        '''
+        with self._session_lock:
+            if session_id not in self._session_keys:
+                for local_path in self._download_list([_session_name(session_id)], fs_info=fs_info or []):
+                    with open(local_path, 'rb') as f:
+                        self._session_keys[session_id] = self.box.decrypt(f.read())
+            return self._session_keys[session_id]
+
+    def _blob_session(self, filename):
+        '''
+        the name of the session key file a blob needs, if any.
+        '''
+        with open(filename, 'rb') as f:
+            header = f.read(len(SESSION_MAGIC) + SESSION_ID_BYTES)
+        if header[:len(SESSION_MAGIC)] != SESSION_MAGIC:
+            return None
+        return _session_name(header[len(SESSION_MAGIC):])
+
+    def _check_session(self, session_name, fs_info=None):
+        '''
+        'missing' or 'corrupt' if the session key can't be had. Checked once per session.
+        '''
+        if session_name not in self._session_problems:
+            try:
+                self._session_key(bytes.fromhex(session_name[:-len(SESSION_SUFFIX)]), fs_info)
+                problem = None
+            except CryptoError:
+                problem = 'corrupt'
+            except Exception:  # the backends don't agree on what "not found" looks like
+                problem = 'missing'
+            self._session_problems[session_name] = problem
+        return self._session_problems[session_name]
+
+    def _read_blob_header(self, f, fs_info=None):
+        '''
+        a blob's key is either sealed in its header, or derived from its run's session key.
+        '''
+        magic = f.read(len(SESSION_MAGIC))
+        if magic != SESSION_MAGIC:
+            file_key = self.box.decrypt(magic + f.read(_header_size(self.box) - len(magic)))
+            assert len(file_key) == KEY_SIZE
+            return nacl_SecretBox(file_key)
+
+        session_id = f.read(SESSION_ID_BYTES)
+        nonce = f.read(SESSION_NONCE_BYTES)
+        return nacl_SecretBox(_session_file_key(self._session_key(session_id, fs_info), nonce))
+
+    def _read_manifest(self, filename):
         with open(filename, 'rb') as f:
             if self.box != self.index_box:
                 # toss the manifest index -- we don't need it
@@ -337,72 +1181,425 @@ class Decryptor():
             file_box = self._read_header(f)
             data = f.read()
             json_bytes = _decompress(file_box.decrypt(data))
-            return loads(json_bytes.decode('utf-8'))
+            mfn = loads(json_bytes.decode('utf-8'))
+        metadata = mfn.pop(MANIFEST_METADATA, {})
+        return mfn, metadata
 
-    def decrypt_single_blob(self, filename, out):
+    def _resolve_delta(self, filename, mfn, metadata, fs_info=None, seen=()):
+        '''
+        a delta manifest's parent lives next to it: in the same local directory, or at the same `fs_info`.
+        '''
+        parent = metadata['parent']
+        if parent in seen:
+            raise ValueError('manifest {} is its own ancestor'.format(parent))
+
+        if fs_info:
+            for local_path in self._download_list([parent], fs_info=fs_info):
+                parent_mfn, parent_metadata = self._read_manifest(local_path)
+        else:
+            local_path = path.join(path.dirname(filename), parent)
+            parent_mfn, parent_metadata = self._read_manifest(local_path)
+
+        if parent_metadata.get('parent'):
+            parent_mfn = self._resolve_delta(local_path, parent_mfn, parent_metadata, fs_info, seen + (parent,))
+        return apply_delta(parent_mfn, mfn, metadata.get('removed', []))
+
+    def load_manifest(self, filename, with_metadata=False, fs_info=None):
+        '''
+        returns the files in the manifest -- and, if asked, the archive metadata separately.
+        Delta manifests are resolved against their parents.
+        '''
+        mfn, metadata = self._read_manifest(filename)
+        if metadata.get('parent'):
+            mfn = self._resolve_delta(filename, mfn, metadata, fs_info)
+        return (mfn, metadata) if with_metadata else mfn
+
+    def manifest_parent(self, filename):
+        '''
+        the manifest this one is a delta against, if it is one.
+        '''
+        return self._read_manifest(filename)[1].get('parent')
+
+    def _decrypt_blob(self, filename, fs_info=None):
+        blob = path.basename(filename)
         with open(filename, 'rb') as f:
-            blob_box = self._read_header(f)
-            data = f.read()
-            out.write(blob_box.decrypt(data))  # `out` handles decompression
-        if self.consume:
+            with self.metrics.stage('read', blob=blob):
+                blob_box = self._read_blob_header(f, fs_info)
+                data = f.read()
+            with self.metrics.stage('decrypt', len(data), blob):
+                return blob_box.decrypt(data)
+
+    def decrypt_single_blob(self, filename, out, fs_info=None, consume=None):
+        data = self._decrypt_blob(filename, fs_info)
+        with self.metrics.stage('decompress', len(data), path.basename(filename)):
+            out.write(data)  # `out` handles decompression
+        if self.consume if consume is None else consume:
             remove(filename)
 
+    def manifest_index(self, filename):
+        '''
+        all the blobs in the manifest. For asymmetric crypto, the manifest index is all we can read.
+        '''
+        if self.box == self.index_box:
+            return [blob for info in self.load_manifest(filename).values() for blob in info['blobs']]
+        return self.load_manifest_index(filename)
+
     def dump_manifest_index(self, *inputs):
         if self.box == self.index_box:
             self.dump_manifest(*inputs, show_filenames=False)
             return
 
-        for filename in download_list(inputs):
+        for filename in self._download_list(inputs):
             print('*** {}:'.format(filename), file=sys.stderr)
             mfn_index = self.load_manifest_index(filename)
             for blob in mfn_index:
                 print(blob)
 
     def dump_manifest(self, *inputs, show_filenames=True):
-        for filename in download_list(inputs):
+        for filename, fs_info, _ in self._download_list(inputs, extract=True):
             print('*** {}:'.format(filename), file=sys.stderr)
-            mfn = self.load_manifest(filename)
+            mfn, metadata = self.load_manifest(filename, with_metadata=True, fs_info=fs_info)
+            for key, value in sorted(metadata.items()):
+                if key not in ('tree', 'removed'):
+                    print('*** {}: {}'.format(key, value), file=sys.stderr)
             for og_filename, info in mfn.items():
                 if show_filenames:
                     print('* {}:'.format(og_filename))
                 for blob in info['blobs']:
                     print(blob)
 
+    def diff(self, old, new):
+        '''
+        what changed between two manifests. Returns the counts, and emits a `diff` event per file.
+        Manifests from before directory summaries are summarized as we go.
+        '''
+        (old, old_meta), (new, new_meta) = [
+            self.load_manifest(filename, with_metadata=True, fs_info=fs_info)
+            for filename, fs_info, _ in self._download_list([old, new], extract=True)
+        ]
+        counts = {'added': 0, 'removed': 0, 'changed': 0, 'bytes': 0}
+        for filename, status, old_info, new_info in diff_manifests(
+            old, new, old_meta.get('tree'), new_meta.get('tree')
+        ):
+            counts[status] += 1
+            info = {'filename': filename, 'status': status}
+            if new_info:
+                old_blobs = set(old_info['blobs']) if old_info else set()
+                info['new_blobs'] = len([b for b in new_info['blobs'] if b not in old_blobs])
+                info['blobs'] = len(new_info['blobs'])
+                if 'size' in new_info:
+                    info['bytes'] = new_info['size']
+                    counts['bytes'] += new_info['size']
+            self.progress.emit('diff', text=True, **info)
+        self.progress.emit('done', action='diff', **counts)
+        return counts
+
+    def catalog_import(self, catalog, *inputs):
+        for count, name in enumerate(inputs):
+            for filename, fs_info, _ in self._download_list([name], extract=True):
+                mfn, metadata = self.load_manifest(filename, with_metadata=True, fs_info=fs_info)
+                destinations = ['{}:{}'.format(*fs_info) if fs_info[1] else fs_info[0]] if fs_info else []
+                manifest_name = path.basename(name)
+                catalog.add_manifest(manifest_name, mfn, destinations, partial=metadata.get('partial', False))
+                self.progress.emit(
+                    'file_end', text=True, action='catalog', current=count+1, total=len(inputs),
+                    filename=manifest_name, files=len(mfn)
+                )
+
+    def catalog_find(self, catalog, filename):
+        '''
+        every version of `filename` the catalog knows about, and whether it had changed since the one before.
+        '''
+        previous = None
+        versions = catalog.path_history(filename)
+        for manifest_name, info in versions:
+            changed = previous is None or previous['blobs'] != info['blobs']
+            self.progress.emit(
+                'found', text=True, manifest=manifest_name, filename=filename, mtime=info['mtime'],
+                size=info.get('size'), blobs=len(info['blobs']), changed=changed
+            )
+            previous = info
+        return versions
+
+    def catalog_find_blob(self, catalog, blob):
+        users = catalog.blob_users(blob)
+        for manifest_name, filename in users:
+            self.progress.emit('found', text=True, manifest=manifest_name, filename=filename, blob=blob)
+        return users
+
+    def _mfn_blobs_by_file(self, filename, use_index=False, fs_info=None):
+        '''
+        the blob list for each file in the manifest, and the session key files they need.
+        If the index is good enough (and we have one), it is returned as one big list -- sessions included.
+        '''
+        if use_index and self.box != self.index_box:
+            return {None: self.load_manifest_index(filename)}, []
+        mfn, metadata = self.load_manifest(filename, with_metadata=True, fs_info=fs_info)
+        return {og_filename: info['blobs'] for og_filename, info in mfn.items()}, metadata.get('sessions', [])
+
+    def _verify_exists(self, blob, fs):
+        if fs:
+            return bool(fs.exists(_data_path(blob)))
+        return path.exists(path.join(self.working_dir or '', blob))
+
+    def _verify_file(self, blobs, fs_info):
+        '''
+        download, authenticate and decompress one file's worth of blobs, and throw away the results.
+        Blobs are decrypted independently, but decompression is a stream across the whole file.
+        So once a blob is bad, we can still authenticate the rest -- but we stop decompressing.
+        '''
+        problems = []
+        sink = _NullSink()
+        decompressor = zstd.ZstdDecompressor()
+        with decompressor.stream_writer(sink) as decompress_out:
+            for blob in blobs:
+                downloads = iter(self._download_list([blob], fs_info=fs_info))
+                try:
+                    local_path = next(downloads)
+                    session = self._blob_session(local_path)
+                except Exception:  # the backends don't agree on what "not found" looks like
+                    problems.append(('missing', blob))
+                    continue
+
+                try:
+                    session_problem = self._check_session(session, fs_info) if session else None
+                    if session_problem:
+                        problems.append((session_problem, session))
+                        continue
+                    data = self._decrypt_blob(local_path, fs_info)
+                except (CryptoError, AssertionError):
+                    problems.append(('corrupt', blob))
+                    continue
+                finally:
+                    next(downloads, None)  # done with the temp file
+
+                if problems:
+                    continue
+                try:
+                    decompress_out.write(data)
+                except zstd.ZstdError:
+                    problems.append(('corrupt', blob))
+        return problems, sink.bytes_written
+
+    def verify(self, *inputs, deep=False, concurrency=8):
+        '''
+        check that a backup is restorable without writing anything out.
+        The default is to confirm that every referenced blob exists. `deep` actually reads everything.
+        '''
+        missing = set()
+        corrupt = set()
+        blob_count = 0
+        total_bytes = 0
+        start = monotonic()
+
+        for filename, fs_info, partials in self._download_list(inputs, extract=True):
+            mfn, sessions = self._mfn_blobs_by_file(filename, use_index=not deep and not partials, fs_info=fs_info)
+            if partials:
+                mfn = {k: v for k, v in mfn.items() if k in partials}
+
+            with ThreadPoolExecutor(max_workers=concurrency) as exe:
+                if deep:
+                    results = exe.map(self._verify_file, mfn.values(), [fs_info] * len(mfn))
+                    for count, (og_filename, (problems, num_bytes)) in enumerate(zip(mfn, results)):
+                        blob_count += len(mfn[og_filename])
+                        total_bytes += num_bytes
+                        for problem, blob in problems:
+                            self.progress.emit('problem', text=True, filename=og_filename, problem=problem, blob=blob)
+                            (missing if problem == 'missing' else corrupt).add(blob)
+                        self.progress.emit(
+                            'file_end', text=True, action='verify', current=count+1, total=len(mfn),
+                            filename=og_filename, bytes_out=num_bytes
+                        )
+                else:
+                    fs = _open_fs(*fs_info, self.working_dir) if fs_info else None
+                    all_blobs = sorted(set(blob for blobs in mfn.values() for blob in blobs) | set(sessions))
+                    blob_count += len(all_blobs)
+                    for blob, exists in zip(all_blobs, exe.map(self._verify_exists, all_blobs, [fs] * len(all_blobs))):
+                        if not exists:
+                            self.progress.emit('problem', text=True, problem='missing', blob=blob)
+                            missing.add(blob)
+
+        elapsed = max(monotonic() - start, 0.000001)
+        print('*** verified {} blobs in {:.2f}s ({:.1f} blobs/s, {:.2f} MB/s): {} missing, {} corrupt'.format(
+            blob_count, elapsed, blob_count / elapsed, total_bytes / elapsed / 1000000, len(missing), len(corrupt)
+        ), file=sys.stderr)
+        return {'missing': missing, 'corrupt': corrupt}
+
+    def _restored_path(self, og_filename):
+        return path.join(self.working_dir or '', path.normpath('./{}'.format(og_filename)))
+
+    def _restore_blobs(self, blobs, out, fs_info, cache):
+        '''
+        each blob is downloaded once -- unless the cache was too full to keep it. Returns the bytes downloaded.
+        With --consume, local blobs are removed after their last use.
+        '''
+        bytes_in = 0
+        for blob in blobs:
+            local_path = cache.get(blob)
+            if local_path:
+                self.decrypt_single_blob(local_path, out, fs_info, consume=False)
+            else:
+                for local_path in self._download_list([blob], fs_info=fs_info):
+                    bytes_in += path.getsize(local_path)
+                    if fs_info:
+                        cache.add(blob, local_path)
+                    self.decrypt_single_blob(local_path, out, fs_info, consume=False)
+            if cache.used(blob) <= 0 and self.consume and not fs_info:
+                remove(local_path)
+        return bytes_in
+
+    def _restore(self, mfn, partials, fs_info):
+        plan = RestorePlan(mfn, partials)
+        # on disk, not the ramdisk the downloads go to: the cache can get big
+        with TemporaryDirectory() as cache_dir:
+            cache = BlobCache(plan.uses, cache_dir, self.cache_bytes)
+            for count, og_filename, info in plan.entries:
+                progress = {'current': count+1, 'total': len(mfn), 'filename': og_filename}
+                self.progress.emit('file_start', action='decrypt', blobs=len(info['blobs']), **progress)
+
+                start = monotonic()
+                bytes_in = 0
+                copy_filename = self._restored_path(og_filename)
+                dir_path = path.dirname(copy_filename)
+                if dir_path:
+                    makedirs(dir_path, exist_ok=True)
+                copy_of = plan.copy_of(og_filename)
+                try:
+                    if copy_of and info.get('holes'):
+                        copy_sparse(self._restored_path(copy_of), copy_filename, info['holes'], info['size'])
+                    elif copy_of:
+                        copy_file(self._restored_path(copy_of), copy_filename, link=False)
+                    else:
+                        with open(copy_filename, 'wb') as f, zstd.ZstdDecompressor().stream_writer(
+                            SparseWriter(f, info['holes'], info['size']) if info.get('holes') else f
+                        ) as decompress_out:
+                            bytes_in = self._restore_blobs(info['blobs'], decompress_out, fs_info, cache)
+                except Exception as e:
+                    self.progress.emit('error', filename=og_filename, error=str(e))
+                    raise
+                utime(copy_filename, times=(info['atime'], info['mtime']))
+                self.progress.emit(
+                    'file_end', text=True, action='decrypt', bytes_in=bytes_in,
+                    bytes_out=path.getsize(copy_filename), seconds=monotonic() - start,
+                    **({'copy_of': copy_of} if copy_of else {}), **progress
+                )
+
     def decrypt(self, *inputs):
-        for filename, fs_info, partials in download_list(inputs, extract=True):
+        for filename, fs_info, partials in self._download_list(inputs, extract=True):
             decompressor = zstd.ZstdDecompressor()
             if filename.endswith('.mfn'):
-                mfn = self.load_manifest(filename)
-                for count, (og_filename, info) in enumerate(mfn.items()):
-                    if partials and og_filename not in partials:
-                        continue
-                    copy_filename = path.normpath('./{}'.format(og_filename))
-                    dir_path = path.dirname(copy_filename)
-                    if dir_path:
-                        makedirs(dir_path, exist_ok=True)
-                    with open(copy_filename, 'wb') as f, decompressor.stream_writer(f) as decompress_out:
-                        for blob in download_list(info['blobs'], fs_info=fs_info):
-                            self.decrypt_single_blob(blob, out=decompress_out)
-                    utime(copy_filename, times=(info['atime'], info['mtime']))
-                    # print progress to stdout
-                    _print_progress(count+1, len(mfn), og_filename)
+                mfn = self.load_manifest(filename, fs_info=fs_info)
+                self._restore(mfn, partials, fs_info)
                 if self.consume:
                     remove(filename)
             else:
                 with decompressor.stream_writer(_stdout()) as decompress_out:
-                    self.decrypt_single_blob(filename, out=decompress_out)
+                    self.decrypt_single_blob(filename, out=decompress_out, fs_info=fs_info)
+
+
+def get_keys(args, prompt=True):
+    secret, crypto_box = get_asymmetric_encryption(args.get('--decryption-keyfile'), args.get('--encryption-keyfile'))
+    if not crypto_box and not secret:
+        secret = get_secret(args.get('--keyfile'), prompt)
+    return secret, crypto_box
+
+
+def _ledger_cache(args):
+    return path.expanduser(args.get('--ledger-cache') or '~/.cache/pog')
+
+
+def get_throttle(args):
+    if not (args.get('--bwlimit') or args.get('--bwlimit-file')):
+        return None
+    return Throttle(args.get('--bwlimit'), args.get('--bwlimit-file'))
+
+
+def resolve_paths(args, cwd):
+    '''
+    for running on someone else's behalf (pog-daemon, an in-process PogCli): path options are relative to
+    where they are, not to where we are.
+    '''
+    for opt in PATH_OPTS:
+        if args.get(opt):
+            args[opt] = path.join(cwd, path.expanduser(args[opt]))
+    return args
+
+
+def parse_args(argv=None):
+    '''
+    docopt, and the combinations it can't rule out by itself.
+    '''
+    args = docopt(__doc__, argv=argv, version='Pog 0.1.4')
+    if args.get('--verify') and args.get('--deep') and args.get('--encryption-keyfile'):
+        raise SystemExit('pog: --verify --deep decrypts every blob, so it needs --keyfile or --decryption-keyfile. '
+                         'An --encryption-keyfile can only check that blobs exist')
+    return args
 
 
 def main():
-    args = docopt(__doc__, version='Pog 0.1.4')
+    args = parse_args()
+    secret, crypto_box = get_keys(args)
+    throttle = get_throttle(args)
+    if throttle and hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, lambda signum, frame: throttle.reload())
+    sys.exit(run(args, secret, crypto_box, throttle=throttle))
+
+
+def run(args, secret, crypto_box, progress=None, working_dir=None, throttle=None):
+    '''
+    everything `main()` does once it has parsed args and keys. Returns an exit code.
+    `throttle` is used unless args has bandwidth limits of its own.
+    '''
+    metrics = Metrics(spans=bool(args.get('--metrics')))
+    progress = progress or get_progress(args.get('--progress'))
+    throttle = get_throttle(args) or throttle
+    catalog = None
+    if args.get('--catalog'):
+        catalog = Catalog(path.join(working_dir or '', args['--catalog']), secret, crypto_box)
+    try:
+        return _run(args, secret, crypto_box, metrics, progress, working_dir, throttle, catalog)
+    finally:
+        if catalog:
+            catalog.close()
+        if args.get('--metrics'):
+            metrics.save_json(args['--metrics'])
+        if args.get('--metrics-textfile'):
+            metrics.save_textfile(args['--metrics-textfile'])
+
+
+def _run(args, secret, crypto_box, metrics, progress, working_dir=None, throttle=None, catalog=None):
     chunk_size = parse_size(args.get('--chunk-size'))
-    compresslevel = int(args.get('--compresslevel'))
+    compresslevel, adaptive_level = parse_compresslevel(args.get('--compresslevel'))
     concurrency = int(args.get('--concurrency'))
     store_absolute_paths = args.get('--store-absolute-paths')
 
-    secret, crypto_box = get_asymmetric_encryption(args.get('--decryption-keyfile'), args.get('--encryption-keyfile'))
-    if not crypto_box and not secret:
-        secret = get_secret(args.get('--keyfile'))
+    if catalog and (args.get('--catalog-import') or args.get('--find') or args.get('--find-blob')):
+        d = Decryptor(secret, crypto_box, metrics=metrics, progress=progress, working_dir=working_dir)
+        if args.get('--catalog-import'):
+            d.catalog_import(catalog, *args['<INPUTS>'])
+            return 0
+        if args.get('--find'):
+            found = d.catalog_find(catalog, args['--find'])
+        else:
+            found = d.catalog_find_blob(catalog, args['--find-blob'])
+        return 0 if found else 1
+
+    if catalog and args.get('--list-manifests'):
+        for info in catalog.manifests():
+            progress.emit('catalog_manifest', text=True, **info)
+        return 0
+
+    if args.get('--diff'):
+        d = Decryptor(secret, crypto_box, metrics=metrics, progress=progress, working_dir=working_dir)
+        counts = d.diff(args['<OLD>'], args['<NEW>'])
+        return 1 if counts['added'] or counts['removed'] or counts['changed'] else 0
+
+    if args.get('--verify'):
+        d = Decryptor(
+            secret, crypto_box, metrics=metrics, progress=progress, working_dir=working_dir, throttle=throttle
+        )
+        res = d.verify(*args['<INPUTS>'], deep=args.get('--deep'), concurrency=concurrency)
+        return 1 if res['missing'] or res['corrupt'] else 0
 
     decrypt = (
         args.get('--decrypt') or
@@ -412,7 +1609,10 @@ def main():
     )
     if decrypt:
         consume = args.get('--consume')
-        d = Decryptor(secret, crypto_box, consume)
+        d = Decryptor(
+            secret, crypto_box, consume, metrics, progress, working_dir, throttle,
+            parse_size(args.get('--restore-cache') or '1GB')
+        )
         if args.get('--dump-manifest'):
             d.dump_manifest(*args['<INPUTS>'])
         elif args.get('--dump-manifest-index'):
@@ -420,9 +1620,19 @@ def main():
         else:
             d.decrypt(*args['<INPUTS>'])
     else:
-        bs = BlobStore(args.get('--save-to'))
-        en = Encryptor(secret, crypto_box, chunk_size, compresslevel, concurrency, store_absolute_paths, bs)
-        en.encrypt(*args['<INPUTS>'])
+        bs = BlobStore(args.get('--save-to'), metrics, working_dir, concurrency, throttle=throttle)
+        en = Encryptor(
+            secret, crypto_box, chunk_size, compresslevel, concurrency, store_absolute_paths, bs, metrics, progress,
+            working_dir, args.get('--blob-naming') or 'sha256', args.get('--blob-identity') or 'compressed',
+            args.get('--journal'), args.get('--resume'), int(args.get('--checkpoint-interval') or 1800),
+            args.get('--detect-zeros'), catalog, args.get('--parent'), int(args.get('--max-chain') or 10),
+            args.get('--exclude'), args.get('--ledger'), _ledger_cache(args), adaptive_level, args.get('--session-key'),
+            args.get('--workers') or 'thread'
+        )
+        inputs = [i for i in args['<INPUTS>'] if i != '-']
+        streams = {args.get('--stdin-name') or 'stdin': sys.stdin.buffer} if '-' in args['<INPUTS>'] else None
+        en.encrypt(*inputs, streams=streams)
+    return 0
 
 
 if __name__ == '__main__':
@@ -17,9 +17,11 @@ setup(
             'pog = pog.pog:main',
             'pog-create-keypair = pog.create_keypair:main',
             'pog-cleanup = pog.cloud_cleanup:main',
+            'pog-daemon = pog.daemon:main',
+            'pog-agent = pog.agent:main',
         ],
     },
-    packages=find_packages(exclude=('tests', 'pogui')),
+    packages=find_packages(exclude=('tests', 'benchmarks', 'pogui')),
     package_data={
         'pog': ['scripts/*.sh'],
     },
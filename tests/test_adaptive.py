@@ -0,0 +1,67 @@
+from unittest import TestCase
+
+from pog.lib.adaptive import AdaptiveLevel, parse_compresslevel
+
+
+class ParseCompresslevelTest(TestCase):
+    def test_fixed(self):
+        self.assertEqual(parse_compresslevel('9'), (9, None))
+        self.assertEqual(parse_compresslevel(None), (3, None))
+
+    def test_range(self):
+        level, adaptive = parse_compresslevel('1-19')
+        self.assertEqual(level, 3)
+        self.assertEqual((adaptive.lowest, adaptive.highest, adaptive.level), (1, 19, 3))
+
+        # we start as close to the default as the range allows
+        self.assertEqual(parse_compresslevel('6-12')[0], 6)
+
+    def test_bad(self):
+        for spec in ('0', '23', '12-6', '1-30', 'fast'):
+            with self.assertRaises(ValueError):
+                parse_compresslevel(spec)
+
+
+class AdaptiveLevelTest(TestCase):
+    def test_slow_link(self):
+        adaptive = AdaptiveLevel(1, 5)
+        for _ in range(10):
+            adaptive.record(adaptive.level, 1.0, 10.0)
+        self.assertEqual(adaptive.level, 5)
+
+    def test_slow_cpu(self):
+        adaptive = AdaptiveLevel(1, 19)
+        for _ in range(10):
+            adaptive.record(adaptive.level, 10.0, 1.0)
+        self.assertEqual(adaptive.level, 1)
+
+    def test_balanced(self):
+        adaptive = AdaptiveLevel(1, 19)
+        for _ in range(10):
+            adaptive.record(adaptive.level, 1.0, 1.5)
+        self.assertEqual(adaptive.level, 3)
+
+    def test_smoothing(self):
+        adaptive = AdaptiveLevel(1, 19, smoothing=0.3)
+        adaptive.record(3, 1.0, 1.5)
+        # one slow upload isn't enough to move us...
+        self.assertEqual(adaptive.record(3, 1.0, 3.0), 3)
+        # ...but another is
+        self.assertEqual(adaptive.record(3, 1.0, 3.0), 4)
+
+    def test_stale_measurements(self):
+        adaptive = AdaptiveLevel(1, 19)
+        adaptive.record(3, 1.0, 10.0)
+        self.assertEqual(adaptive.level, 4)
+
+        # blobs compressed before the change don't count
+        for _ in range(10):
+            adaptive.record(3, 1.0, 10.0)
+        adaptive.record(4, 0, 10.0)
+        self.assertEqual(adaptive.level, 4)
+
+    def test_levels_used(self):
+        adaptive = AdaptiveLevel(1, 19)
+        for level in (3, 3, 12, 4):
+            adaptive.used(level)
+        self.assertEqual(adaptive.levels_used(), {'3': 2, '4': 1, '12': 1})
@@ -0,0 +1,121 @@
+from contextlib import redirect_stderr
+from hashlib import sha256
+from io import StringIO
+from os import environ, path
+from tempfile import TemporaryDirectory
+from threading import Thread
+from unittest import TestCase
+from unittest.mock import patch
+
+from .helpers import POG_ROOT
+from pog.agent import KeyAgent, fetch_secret
+from pog.lib.secret import hash_keyfile
+from pog.lib.unix_socket import JsonLineServer
+from pog.pog import get_secret
+
+
+KEYFILE = f'{POG_ROOT}/tests/samples/only_for_testing.encrypt'
+
+
+def _cheap_hash(pw):
+    return sha256(pw.encode('utf-8')).digest()
+
+
+class KeyAgentTest(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.socket_dir = TemporaryDirectory()
+        self.socket_path = path.join(self.socket_dir.name, 'pog-agent.sock')
+
+        self.agent = KeyAgent(ttl=60)
+        self.server = JsonLineServer(self.socket_path, self.agent.handle)
+        self.server_thread = Thread(target=self.server.serve_forever, daemon=True)
+        self.server_thread.start()
+
+        self.env = patch.dict(environ, {'POG_AGENT_SOCK': self.socket_path})
+        self.env.start()
+
+    def tearDown(self):
+        self.env.stop()
+        self.server.shutdown()
+        self.server.server_close()
+        self.server_thread.join()
+        self.agent.stop()
+        with self.socket_dir:
+            pass
+        super().tearDown()
+
+    def test_keyfile(self):
+        self.assertEqual(get_secret(KEYFILE), hash_keyfile(KEYFILE))
+        self.assertEqual(len(self.agent.keys), 1)
+
+        # cached
+        with patch('pog.lib.secret.hash_keyfile') as mock_hash:
+            self.assertEqual(get_secret(KEYFILE), hash_keyfile(KEYFILE))
+            mock_hash.assert_not_called()
+
+    @patch('pog.lib.secret.pass_to_hash', side_effect=_cheap_hash)
+    @patch('pog.pog.prompt_password', return_value='hunter2')
+    def test_password(self, mock_prompt, mock_hash):
+        self.assertEqual(get_secret(), _cheap_hash('hunter2'))
+        self.assertEqual(mock_prompt.call_count, 1)
+        self.assertEqual(mock_hash.call_count, 1)
+
+        # we still prompt -- the agent only saves us deriving the key again
+        self.assertEqual(get_secret(), _cheap_hash('hunter2'))
+        self.assertEqual(mock_prompt.call_count, 2)
+        self.assertEqual(mock_hash.call_count, 1)
+
+        # an unnamed key is never used without the password
+        with self.assertRaises(ValueError):
+            get_secret(prompt=False)
+
+    @patch('pog.lib.secret.pass_to_hash', side_effect=_cheap_hash)
+    @patch('pog.pog.prompt_password', return_value='other password')
+    def test_named_password(self, mock_prompt, mock_hash):
+        self.assertEqual(fetch_secret(password='hunter2', name='backups'), _cheap_hash('hunter2'))
+        fetch_secret(password='hunter3', name='other')
+
+        # the key we asked for, not the one added last
+        with patch.dict(environ, {'POG_AGENT_KEY': 'backups'}):
+            self.assertEqual(get_secret(), _cheap_hash('hunter2'))
+            self.assertEqual(get_secret(prompt=False), _cheap_hash('hunter2'))
+        mock_prompt.assert_not_called()
+
+        # a name the agent doesn't know means prompting, as usual
+        with patch.dict(environ, {'POG_AGENT_KEY': 'nope'}):
+            self.assertEqual(get_secret(), _cheap_hash('other password'))
+            with self.assertRaises(ValueError):
+                get_secret(prompt=False)
+
+        # ...and so does forgetting
+        self.agent.clear()
+        with patch.dict(environ, {'POG_AGENT_KEY': 'backups'}), self.assertRaises(ValueError):
+            get_secret(prompt=False)
+
+    @patch('pog.lib.secret.pass_to_hash', side_effect=_cheap_hash)
+    def test_expiry(self, mock_hash):
+        self.assertEqual(fetch_secret(password='hunter2', ttl=0, name='backups'), _cheap_hash('hunter2'))
+        self.assertEqual(fetch_secret(name='backups'), None)
+
+        self.agent.expire()
+        self.assertEqual(self.agent.keys, {})
+
+    @patch('pog.agent._peer_uid', return_value=12345678)
+    def test_other_users_are_turned_away(self, mock_uid):
+        self.assertEqual(fetch_secret(KEYFILE), None)
+        self.assertEqual(self.agent.keys, {})
+
+        # pog carries on without the agent
+        self.assertEqual(get_secret(KEYFILE), hash_keyfile(KEYFILE))
+
+    def test_someone_elses_agent(self):
+        # the client checks too: nothing is sent to an agent run by another user
+        err = StringIO()
+        with patch('pog.lib.unix_socket._peer_uid', return_value=12345678), redirect_stderr(err):
+            self.assertEqual(fetch_secret(password='hunter2', name='backups'), None)
+        self.assertIn('another user is listening on it', err.getvalue())
+        self.assertEqual(self.agent.keys, {})
+
+    def test_no_agent(self):
+        self.assertEqual(fetch_secret(KEYFILE, socket_path=path.join(self.socket_dir.name, 'nope.sock')), None)
@@ -102,3 +102,17 @@ class b2fsTest(TestCase):
         mock_run.return_value = EX_LS
         self.assertEqual(self.fs.list_files(pattern='*.txt'), ['data/', 'file.txt'])
         mock_run.assert_called_once_with(['b2', 'ls', 'bucket'])
+
+    def test_list_data(self, mock_run):
+        def ls(args):
+            if '--recursive' in args:
+                return '\n'.join(f'{args[-1]}{args[-1][5:7]}{i}=' for i in range(2)).encode('utf-8')
+            return b'data/AA/\ndata/BB/\n'
+        mock_run.side_effect = ls
+
+        self.assertEqual(
+            sorted(self.fs.list_data()), ['data/AA/AA0=', 'data/AA/AA1=', 'data/BB/BB0=', 'data/BB/BB1=']
+        )
+        self.assertEqual(mock_run.call_count, 3)
+        mock_run.assert_any_call(['b2', 'ls', 'bucket', 'data/'])
+        mock_run.assert_any_call(['b2', 'ls', '--recursive', 'bucket', 'data/BB/'])
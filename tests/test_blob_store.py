@@ -1,9 +1,13 @@
-from os import remove as os_remove, path
+from os import listdir, remove as os_remove, path
+from shutil import copyfile
+from threading import Event
+from time import sleep
 from unittest import TestCase
-from unittest.mock import patch
+from unittest.mock import ANY, patch
 
 from .helpers import TestDirMixin
 from pog.lib.blob_store import BlobStore, download_list, _data_path
+from pog.lib.throttle import Throttle
 
 
 class DownloadListTest(TestDirMixin, TestCase):
@@ -240,6 +244,20 @@ class BlobStoreTest(TestDirMixin, TestCase):
         mock_s3.exists.assert_called_once_with('full/path/coolfile.txt')
         self.assertEqual(mock_s3.upload_file.call_count, 0)
 
+    @patch('pog.fs.pogfs.s3fs', autoSpec=True)
+    def test_s3_throttled(self, mock_s3):
+        mock_s3.return_value = mock_s3
+        mock_s3.exists.return_value = False
+
+        throttle = Throttle('s3=1MB')
+        bs = BlobStore('s3://bucket', throttle=throttle)
+        bs.save('coolfile.txt', self.tiny_sample)
+
+        mock_s3.upload_file.assert_called_once_with(self.tiny_sample, 'coolfile.txt', callback=ANY)
+        callback = mock_s3.upload_file.call_args[1]['callback']
+        callback(8)
+        self.assertEqual(throttle.buckets['s3:bucket'].rate, 1000000)
+
     @patch('pog.fs.pogfs.s3fs', autoSpec=True)
     def test_save_blob(self, mock_s3):
         mock_s3.return_value = mock_s3
@@ -252,3 +270,91 @@ class BlobStoreTest(TestDirMixin, TestCase):
 
         mock_s3.exists.assert_called_once_with('data/ar/argh12456789')
         mock_s3.upload_file.assert_called_once_with(self.tiny_sample, 'data/ar/argh12456789')
+
+    @patch('pog.fs.pogfs.b2fs', autoSpec=True)
+    @patch('pog.fs.pogfs.s3fs', autoSpec=True)
+    def test_find_blob(self, mock_s3, mock_b2):
+        mock_b2.return_value = mock_b2
+        mock_b2.exists.return_value = True
+        mock_s3.return_value = mock_s3
+        mock_s3.exists.return_value = True
+
+        bs = BlobStore('s3, b2')
+        found = bs.find_blob('argh12456789')
+        self.assertEqual([f['destination'] for f in found], ['s3', 'b2'])
+        self.assertEqual([f['status'] for f in found], ['exists', 'exists'])
+        mock_s3.exists.assert_called_once_with('data/ar/argh12456789')
+        mock_b2.exists.assert_called_once_with('data/ar/argh12456789')
+
+        # missing anywhere -> not found
+        mock_b2.exists.return_value = False
+        self.assertEqual(bs.find_blob('argh12456789'), None)
+
+        # scripts can't tell us
+        self.assertEqual(BlobStore('/bin/true').find_blob('argh12456789'), None)
+
+    def _temp_blob(self, name):
+        temp_path = path.join(self.input_dir.name, name)
+        copyfile(self.tiny_sample, temp_path)
+        return temp_path
+
+    @patch('pog.fs.pogfs.b2fs', autoSpec=True)
+    @patch('pog.fs.pogfs.s3fs', autoSpec=True)
+    def test_queue_blob_fan_out(self, mock_s3, mock_b2):
+        mock_s3.return_value = mock_s3
+        mock_s3.exists.return_value = False
+        mock_b2.return_value = mock_b2
+        mock_b2.exists.return_value = False
+
+        # b2 is slow. s3 shouldn't have to wait for it
+        b2_go = Event()
+        mock_b2.upload_file.side_effect = lambda *args: b2_go.wait(5)
+
+        results = []
+        bs = BlobStore('s3, b2', upload_concurrency=1, queue_depth=4)
+        temp_paths = [self._temp_blob(name) for name in ('argh12456789', 'bargh1245678')]
+        for temp_path in temp_paths:
+            bs.queue_blob(path.basename(temp_path), temp_path, results.append)
+
+        for _ in range(50):
+            if mock_s3.upload_file.call_count == 2:
+                break
+            sleep(0.1)
+        self.assertEqual(mock_s3.upload_file.call_count, 2)
+        self.assertEqual(results, [])
+
+        b2_go.set()
+        bs.drain()
+        self.assertEqual(len(results), 2)
+        for res in results:
+            self.assertEqual([r['destination'] for r in res], ['s3', 'b2'])
+            self.assertEqual([r['status'] for r in res], ['uploaded', 'uploaded'])
+        mock_b2.upload_file.assert_any_call(ANY, 'data/ar/argh12456789')
+        mock_b2.upload_file.assert_any_call(ANY, 'data/ba/bargh1245678')
+
+        # the temp files belong to the BlobStore now, and are cleaned up
+        for temp_path in temp_paths:
+            self.assertFalse(path.exists(temp_path))
+        self.assertEqual(listdir(bs._staging_dir), [])
+
+        stats = {s['destination']: s for s in bs.destination_stats()}
+        self.assertEqual(stats['s3']['uploaded'], 2)
+        self.assertEqual(stats['b2']['bytes'], 16)
+        bs.close()
+
+    @patch('pog.fs.pogfs.b2fs', autoSpec=True)
+    @patch('pog.fs.pogfs.s3fs', autoSpec=True)
+    def test_queue_blob_error(self, mock_s3, mock_b2):
+        mock_s3.return_value = mock_s3
+        mock_s3.exists.return_value = False
+        mock_b2.return_value = mock_b2
+        mock_b2.exists.side_effect = Exception('b2 is down')
+
+        results = []
+        bs = BlobStore('s3, b2')
+        bs.queue_blob('argh12456789', self._temp_blob('argh12456789'), results.append)
+        with self.assertRaises(Exception) as e:
+            bs.drain()
+        self.assertEqual(str(e.exception), 'b2 is down')
+        self.assertEqual(results, [])
+        bs.close()
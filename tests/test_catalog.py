@@ -0,0 +1,78 @@
+from os import path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from .helpers import POG_ROOT
+from pog.lib.catalog import Catalog
+from pog.pog import get_keys
+
+
+ENCRYPT_KEYFILE = f'{POG_ROOT}/tests/samples/only_for_testing.encrypt'
+DECRYPT_KEYFILE = f'{POG_ROOT}/tests/samples/only_for_testing.decrypt'
+
+
+def _entry(*blobs, mtime=1):
+    return {'blobs': list(blobs), 'atime': mtime, 'mtime': mtime, 'size': 10}
+
+
+class CatalogTest(TestCase):
+    def setUp(self):
+        self.test_dir = TemporaryDirectory()
+        self.filename = path.join(self.test_dir.name, 'pog.catalog')
+
+    def tearDown(self):
+        with self.test_dir:
+            pass
+
+    def fill(self, catalog):
+        catalog.add_manifest('2020-01-01.mfn', {'/etc/fstab': _entry('a'), '/etc/hosts': _entry('b')}, ['s3:bucket'])
+        catalog.add_manifest('2020-01-02.mfn', {'/etc/fstab': _entry('a', mtime=2)})
+        catalog.add_manifest('2020-01-03.mfn', {'/etc/fstab': _entry('c', mtime=3), '/etc/motd': _entry('b')})
+
+    def test_queries(self):
+        catalog = Catalog(self.filename, b'0' * 32)
+        self.fill(catalog)
+
+        self.assertEqual(
+            [(name, info['mtime']) for name, info in catalog.path_history('/etc/fstab')],
+            [('2020-01-01.mfn', 1), ('2020-01-02.mfn', 2), ('2020-01-03.mfn', 3)]
+        )
+        self.assertEqual(catalog.path_history('/etc/nope'), [])
+        self.assertEqual(catalog.blob_users('b'), [('2020-01-01.mfn', '/etc/hosts'), ('2020-01-03.mfn', '/etc/motd')])
+        self.assertEqual(
+            [(m['manifest'], m['files'], m['destinations']) for m in catalog.manifests()],
+            [('2020-01-01.mfn', 2, ['s3:bucket']), ('2020-01-02.mfn', 1, []), ('2020-01-03.mfn', 2, [])]
+        )
+
+        # re-adding a manifest replaces it
+        catalog.add_manifest('2020-01-03.mfn', {'/etc/motd': _entry('b')}, partial=True)
+        self.assertEqual(len(catalog.path_history('/etc/fstab')), 2)
+        self.assertTrue(catalog.manifests()[-1]['partial'])
+        self.assertTrue(catalog.remove_manifest('2020-01-03.mfn'))
+        self.assertEqual(catalog.blob_users('b'), [('2020-01-01.mfn', '/etc/hosts')])
+        catalog.close()
+
+    def test_nothing_in_the_clear(self):
+        catalog = Catalog(self.filename, b'0' * 32)
+        self.fill(catalog)
+        catalog.close()
+
+        with open(self.filename, 'rb') as f:
+            contents = f.read()
+        self.assertIn(b'2020-01-01.mfn', contents)
+        self.assertNotIn(b'/etc/fstab', contents)
+
+        # with the wrong key, there's nothing to find
+        self.assertEqual(Catalog(self.filename, b'1' * 32).path_history('/etc/fstab'), [])
+
+    def test_asymmetric(self):
+        catalog = Catalog(self.filename, *get_keys({'--encryption-keyfile': ENCRYPT_KEYFILE}))
+        self.fill(catalog)
+        # the public key can write, but not read
+        with self.assertRaises(ValueError):
+            catalog.blob_users('a')
+        catalog.close()
+
+        catalog = Catalog(self.filename, *get_keys({'--decryption-keyfile': DECRYPT_KEYFILE}))
+        self.assertEqual(len(catalog.path_history('/etc/fstab')), 3)
+        catalog.close()
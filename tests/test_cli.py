@@ -1,10 +1,24 @@
-from os import environ
+from glob import glob
+from os import environ, path
+from shutil import copy
 from subprocess import PIPE
+from tempfile import TemporaryDirectory
 from unittest import TestCase
 from unittest.mock import patch
 
 from .helpers import TestDirMixin
 from pog.cli import PogCli, POG_ROOT
+from pog.lib.progress import QueueProgress
+
+
+class _LockstepProgress(QueueProgress):
+    '''
+    the worker waits at each file until it's cancelled -- so it can't finish before we abort.
+    '''
+    def _write(self, event, text, info):
+        super()._write(event, text, info)
+        if event == 'file_start':
+            self.cancelled.wait(5)
 
 
 class PogCliTest(TestDirMixin, TestCase):
@@ -83,22 +97,26 @@ class PogCliTest(TestDirMixin, TestCase):
         mock_run.return_value = mock_run
         mock_run.__enter__.return_value = mock_run
         mock_run.stdout = [
-            b'*** 1/2: foo.txt\n',
-            b'*** 2/2: bar.txt\n',
+            b'{"event": "file_start", "action": "decrypt", "time": 1.0, "current": 1, "total": 2, "filename": "foo.txt"}\n',
+            b'{"event": "file_end", "action": "decrypt", "time": 2.0, "current": 1, "total": 2, "filename": "foo.txt", '
+            b'"bytes_out": 100}\n',
+            b'{"event": "file_end", "action": "decrypt", "time": 3.0, "current": 2, "total": 2, "filename": "bar:baz", '
+            b'"bytes_out": 200}\n',
         ]
 
         cli = PogCli()
         cli.set_keyfiles('foo.decrypt')
         res = list(cli.decrypt('my.mfn'))
         self.assertEqual(res, [
-            {'current': 1, 'filename': 'foo.txt', 'total': 2},
-            {'current': 2, 'filename': 'bar.txt', 'total': 2}
+            {'current': 1, 'filename': 'foo.txt', 'total': 2, 'bytes_out': 100},
+            {'current': 2, 'filename': 'bar:baz', 'total': 2, 'bytes_out': 200},
         ])
 
         env = dict(environ)
         env['PYTHONPATH'] = POG_ROOT
         mock_run.assert_called_once_with(
-            ['python', '-u', '-m', 'pog.pog', '--decrypt', 'my.mfn', '--decryption-keyfile=foo.decrypt'],
+            ['python', '-u', '-m', 'pog.pog', '--progress=json', '--decrypt', 'my.mfn',
+             '--decryption-keyfile=foo.decrypt'],
             env=env, stdout=PIPE,
         )
 
@@ -107,23 +125,90 @@ class PogCliTest(TestDirMixin, TestCase):
         mock_run.return_value = mock_run
         mock_run.__enter__.return_value = mock_run
         mock_run.stdout = [
-            b'*** 1/2: foo.txt\n',
-            b'12345abcdefh\n',
-            b'*** 2/2: bar.txt\n',
-            b'abcdefg12345\n',
+            b'{"event": "start", "action": "encrypt", "time": 1.0, "files": 2, "bytes": 30}\n',
+            b'{"event": "file_start", "action": "encrypt", "time": 1.0, "current": 1, "total": 3, "filename": "foo.txt", '
+            b'"bytes": 10}\n',
+            b'{"event": "blob", "time": 1.5, "filename": "foo.txt", "blob": "12345abcdefh", "status": "uploaded"}\n',
+            b'{"event": "file_start", "action": "encrypt", "time": 2.0, "current": 2, "total": 3, "filename": "bar.txt", '
+            b'"bytes": 20}\n',
+            b'{"event": "blob", "time": 2.5, "filename": "bar.txt", "blob": "abcdefg12345", "status": "dedup"}\n',
+            b'{"event": "manifest", "time": 3.0, "current": 3, "total": 3, "filename": "my.mfn"}\n',
         ]
 
         cli = PogCli()
         cli.set_keyfiles('foo.decrypt', 'foo.encrypt')
         res = list(cli.encrypt(['foo.txt', 'bar.txt'], ['b2://bucket', 's3:bucket']))
         self.assertEqual(res, [
-            {'current': 1, 'filename': 'foo.txt', 'total': 2},
-            {'current': 2, 'filename': 'bar.txt', 'total': 2}
+            {'current': 1, 'filename': 'foo.txt', 'total': 3, 'bytes': 10},
+            {'current': 2, 'filename': 'bar.txt', 'total': 3, 'bytes': 20},
+            {'current': 3, 'filename': 'my.mfn', 'total': 3},
         ])
 
         env = dict(environ)
         env['PYTHONPATH'] = POG_ROOT
         mock_run.assert_called_once_with(
-            ['python', '-u', '-m', 'pog.pog', '--save-to=b2://bucket,s3:bucket', 'foo.txt', 'bar.txt',
+            ['python', '-u', '-m', 'pog.pog', '--progress=json', '--save-to=b2://bucket,s3:bucket', 'foo.txt', 'bar.txt',
              '--encryption-keyfile=foo.encrypt'], env=env, stdout=PIPE,
         )
+
+    def test_progress_from_line(self):
+        cli = PogCli()
+        self.assertEqual(cli._progress_from_line('*** 1/2: foo.txt'), {'current': 1, 'total': 2, 'filename': 'foo.txt'})
+        self.assertEqual(cli._progress_from_line('abcdef12345'), None)
+
+
+class PogCliInProcessTest(TestDirMixin, TestCase):
+    keyfile = f'{POG_ROOT}/tests/samples/only_for_testing.encrypt'
+
+    def test_round_trip(self):
+        cli = PogCli({'keyfile': self.keyfile}, in_process=True)
+
+        res = list(cli.encrypt([self.tiny_sample, self.another_sample], [], cwd=self.working_dir.name))
+        self.assertEqual(sorted(r['filename'] for r in res[:2]), [self.another_sample, self.tiny_sample])
+        mfn = res[-1]['filename']
+        self.assertTrue(mfn.endswith('.mfn'))
+        self.assertTrue(path.exists(path.join(self.working_dir.name, mfn)))
+
+        manifest = cli.dumpManifest(path.join(self.working_dir.name, mfn))
+        self.assertEqual(sorted(manifest), ['another_sample.txt', 'tiny_sample.txt'])
+        index = list(cli.dumpManifestIndex(path.join(self.working_dir.name, mfn)))
+        self.assertEqual(sorted(index), sorted(b for blobs in manifest.values() for b in blobs))
+
+        restore_dir = TemporaryDirectory()
+        with restore_dir:
+            copy(path.join(self.working_dir.name, mfn), restore_dir.name)
+            for blob in index:
+                copy(path.join(self.working_dir.name, blob), restore_dir.name)
+
+            res = list(cli.decrypt(mfn, cwd=restore_dir.name))
+            self.assertEqual([r['filename'] for r in res], sorted(manifest))
+            with open(path.join(restore_dir.name, 'tiny_sample.txt'), 'rb') as f:
+                self.assertEqual(f.read(), b'aaaabbbb')
+
+        # keys are only derived once
+        self.assertEqual(len(cli._keys), 1)
+
+    def test_abort(self):
+        cli = PogCli({'keyfile': self.keyfile}, in_process=True)
+
+        res = []
+        with patch('pog.cli.QueueProgress', _LockstepProgress):
+            for event in cli.encrypt([self.tiny_sample, self.another_sample], [], cwd=self.working_dir.name):
+                res.append(event)
+                cli.abort()
+        self.assertEqual(len(res), 1)
+        # the worker stopped at its next event, before it got as far as a manifest
+        self.assertEqual(glob(path.join(self.working_dir.name, '*.mfn')), [])
+
+    def test_relative_paths(self):
+        cli = PogCli({'keyfile': self.keyfile}, in_process=True)
+
+        # relative to the run's cwd, like they would be for a subprocess
+        list(cli.run_events('--metrics=metrics.json', self.tiny_sample, cwd=self.working_dir.name))
+        self.assertTrue(path.exists(path.join(self.working_dir.name, 'metrics.json')))
+        self.assertFalse(path.exists('metrics.json'))
+
+    def test_needs_keyfile(self):
+        cli = PogCli(in_process=True)
+        with self.assertRaises(ValueError):
+            list(cli.encrypt([self.tiny_sample], [], cwd=self.working_dir.name))
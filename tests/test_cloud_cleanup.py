@@ -1,7 +1,9 @@
 from os import environ
+from subprocess import STDOUT
 from unittest import TestCase, skipUnless
 
-from .helpers import TestDirMixin, POG_ROOT
+from .helpers import TestDirMixin, POG_ROOT, _program_args
+from pog.cli import PogCli
 from pog.fs.localfs import localfs
 
 
@@ -38,6 +40,118 @@ class CloudCleanupTest(TestDirMixin, TestCase):
             f'{self.working_dir.name}/data/uselessblob',
         ])
 
+    def test_cleanup_keeps_delta_parents(self):
+        pog = PogCli(pog_cmd=_program_args('pog.pog'))
+        enc = pog.run_command(self.keyfile_flag, self.tiny_sample, self.another_sample, cwd=self.working_dir.name)
+        base = enc[-1][len('*** 3/3: '):]
+        enc = pog.run_command(
+            self.keyfile_flag, f'--parent={base}', self.tiny_sample, self.another_sample, cwd=self.working_dir.name
+        )
+        delta = enc[-1][len('*** 3/3: '):]
+
+        res = self.run_command(self.keyfile_flag, '--backup=local')
+        # the delta makes its parent look obsolete -- but it still needs it
+        self.assertIn(f'{base} vs {delta} similarity: 1.0', res)
+        self.assertNotIn(f'would remove {base}', res)
+        self.assertNotIn(f'would remove {delta}', res)
+
+    def _ledger_backups(self, *backups, key_flag=None):
+        '''
+        one file at a time, so the output is in order. Returns [(manifest, [blobs])].
+        '''
+        pog = PogCli(pog_cmd=_program_args('pog.pog'))
+        res = []
+        for flags, inputs in backups:
+            enc = pog.run_command(
+                key_flag or self.keyfile_flag, '--save-to=local', f'--ledger-cache={self.working_dir.name}/cache',
+                '--concurrency=1',
+                *flags, *inputs, cwd=self.working_dir.name
+            )
+            res.append((enc[-1].split(': ', 1)[1], enc[:-1]))
+        return res
+
+    def test_retire_with_ledger(self):
+        for i in range(4):
+            self.fs.remove_file(f'{i}.mfn')
+        (first, enc), (second, enc2) = self._ledger_backups(
+            (['--ledger'], [self.tiny_sample, self.another_sample]), (['--ledger'], [self.another_sample])
+        )
+        tiny_blob, another_blob = enc[3], enc2[1]
+
+        ledger = [self.keyfile_flag, '--backup=local', f'--ledger-cache={self.working_dir.name}/cache']
+        res = self.run_command(*ledger, f'--retire={first}')
+        self.assertEqual(res, [
+            f'would remove {first}',
+            f'would remove data/{tiny_blob[:2]}/{tiny_blob}',
+        ])
+        self.assertTrue(self.fs.exists(first))
+
+        self.run_command(*ledger, f'--retire={first}', '--reckless-abandon')
+        self.assertFalse(self.fs.exists(first))
+        self.assertFalse(self.fs.exists(f'data/{tiny_blob[:2]}/{tiny_blob}'))
+        self.assertTrue(self.fs.exists(second))
+        self.assertTrue(self.fs.exists(f'data/{another_blob[:2]}/{another_blob}'))
+
+        # a manifest the ledger doesn't know about can't be retired until it's rebuilt
+        self.fs.upload_file(f'{POG_ROOT}/tests/samples/{self.consistency_mfn}', '0.mfn')
+        res = self.run_command(*ledger, '--retire=0.mfn', stderr=STDOUT)
+        self.assertIn('--rebuild-ledger', res[-1])
+        res = self.run_command(*ledger, '--rebuild-ledger')
+        self.assertEqual(res[-1], 'ledger generation 4: 2 manifests, 2 blobs')
+        res = self.run_command(*ledger, '--retire=0.mfn')
+        self.assertEqual(res, ['would remove 0.mfn', f'would remove data/US/{self.consistency_blobname}'])
+
+    def test_retire_refuses_unknown_manifests(self):
+        for i in range(4):
+            self.fs.remove_file(f'{i}.mfn')
+        (first, enc), (second, _) = self._ledger_backups(
+            (['--ledger'], [self.tiny_sample]), ([], [self.tiny_sample])
+        )
+        tiny_blob = enc[1]
+        blob_path = f'data/{tiny_blob[:2]}/{tiny_blob}'
+
+        # the second backup (without --ledger) still needs the blob the ledger thinks is unused
+        ledger = [self.keyfile_flag, '--backup=local', f'--ledger-cache={self.working_dir.name}/cache']
+        res = self.run_command(*ledger, f'--retire={first}', '--reckless-abandon', stderr=STDOUT)
+        self.assertEqual(res, [
+            f'pog-cleanup: 1 manifest(s) are not in the ledger, so their blobs could be removed: {second}. '
+            'Run pog-cleanup --rebuild-ledger first'
+        ])
+        self.assertTrue(self.fs.exists(first))
+        self.assertTrue(self.fs.exists(blob_path))
+
+        self.run_command(*ledger, '--rebuild-ledger')
+        res = self.run_command(*ledger, f'--retire={first}', '--reckless-abandon')
+        self.assertEqual(res, [f'would remove {first}'])
+        self.assertFalse(self.fs.exists(first))
+        self.assertTrue(self.fs.exists(blob_path))
+
+    def test_retire_keeps_session_keys(self):
+        for i in range(4):
+            self.fs.remove_file(f'{i}.mfn')
+        encryption_flag = f'--encryption-keyfile={POG_ROOT}/tests/samples/only_for_testing.encrypt'
+        decryption_flag = f'--decryption-keyfile={POG_ROOT}/tests/samples/only_for_testing.decrypt'
+        (first, _), (second, _) = self._ledger_backups(
+            (['--ledger', '--session-key'], [self.tiny_sample]), (['--ledger', '--session-key'], [self.tiny_sample]),
+            key_flag=encryption_flag
+        )
+        sessions = sorted(f for f in self.fs.list_data() if f.endswith('.session'))
+        self.assertEqual(len(sessions), 2)
+
+        # the second backup's blob was deduplicated, so it is still sealed under the first backup's session
+        ledger = [encryption_flag, '--backup=local', f'--ledger-cache={self.working_dir.name}/cache']
+        res = self.run_command(*ledger, f'--retire={first}', '--reckless-abandon')
+        self.assertEqual(res, [f'would remove {first}'])
+        self.assertEqual(sorted(f for f in self.fs.list_data() if f.endswith('.session')), sessions)
+
+        pog = PogCli(pog_cmd=_program_args('pog.pog'))
+        res = pog.run_command(decryption_flag, '--verify', '--deep', f'local:{second}', cwd=self.working_dir.name,
+                              stderr=STDOUT)
+        self.assertIn('0 missing, 0 corrupt', res[-1])
+        pog.run_command(decryption_flag, '--decrypt', f'local:{second}', cwd=self.working_dir.name)
+        with open(f'{self.working_dir.name}/tiny_sample.txt') as f:
+            self.assertEqual(f.read(), 'aaaabbbb')
+
     @skipUnless(environ.get('DANGER'), 'dangerous test skipped unless DANGER=1')
     def test_cleanup_for_real(self):
         # make a file:/// repo for us to blow up
@@ -0,0 +1,159 @@
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stderr, redirect_stdout
+from io import StringIO
+from os import path, stat
+from tempfile import TemporaryDirectory
+from threading import Thread
+from unittest import TestCase
+from unittest.mock import patch
+
+from .helpers import TestDirMixin, POG_ROOT
+from pog.daemon import PogDaemon, _routed, clear_keys, route_output, status, submit
+from pog.fs.pogfs import keep_fs_warm
+from pog.lib.unix_socket import JsonLineServer
+
+
+class PogDaemonTest(TestDirMixin, TestCase):
+    keyfile_flag = f'--keyfile={POG_ROOT}/tests/samples/only_for_testing.encrypt'
+
+    def setUp(self):
+        super().setUp()
+        self.socket_dir = TemporaryDirectory()
+        self.socket_path = path.join(self.socket_dir.name, 'pog.sock')
+
+        self.daemon = PogDaemon(max_jobs=1)
+        self.server = JsonLineServer(self.socket_path, self.daemon.handle)
+        self.server_thread = Thread(target=self.server.serve_forever, daemon=True)
+        self.server_thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.server_thread.join()
+        keep_fs_warm(False)
+        with self.socket_dir:
+            pass
+        super().tearDown()
+
+    def submit(self, *argv):
+        out, err = StringIO(), StringIO()
+        with redirect_stdout(out), redirect_stderr(err):
+            code = submit(self.socket_path, list(argv), cwd=self.working_dir.name)
+        return code, out.getvalue().splitlines(), err.getvalue()
+
+    def test_socket_permissions(self):
+        self.assertEqual(stat(self.socket_path).st_mode & 0o777, 0o600)
+
+    def test_round_trip(self):
+        code, lines, _ = self.submit(self.keyfile_flag, self.tiny_sample)
+        self.assertEqual(code, 0)
+        self.assertTrue(lines[-1].startswith('*** 2/2: '))
+        mfn = lines[-1][len('*** 2/2: '):]
+        self.assertTrue(path.exists(path.join(self.working_dir.name, mfn)))
+
+        code, lines, _ = self.submit(self.keyfile_flag, '--decrypt', mfn)
+        self.assertEqual(code, 0)
+        self.assertEqual(lines, ['*** 1/1: tiny_sample.txt'])
+        with open(path.join(self.working_dir.name, 'tiny_sample.txt'), 'rb') as f:
+            self.assertEqual(f.read(), b'aaaabbbb')
+
+        code, lines, err = self.submit(self.keyfile_flag, '--verify', mfn)
+        self.assertEqual(code, 0)
+        self.assertIn('0 missing, 0 corrupt', err)
+
+        # both jobs used the same (cached) key
+        self.assertEqual(len(self.daemon.keys), 1)
+
+    def test_usage_error(self):
+        code, lines, err = self.submit(self.keyfile_flag, '--not-a-real-flag', self.tiny_sample)
+        self.assertEqual(code, 1)
+        self.assertIn('Usage:', err)
+
+    def test_restore_needs_manifest(self):
+        code, lines, err = self.submit(self.keyfile_flag, '--decrypt', 'someblob')
+        self.assertEqual(code, 1)
+        self.assertIn('only manifests can be restored', err)
+
+    def test_no_stdin(self):
+        code, lines, err = self.submit(self.keyfile_flag, '-')
+        self.assertEqual(code, 1)
+        self.assertIn('can not read stdin', err)
+
+    def test_status(self):
+        out = StringIO()
+        with redirect_stdout(out):
+            self.assertEqual(status(self.socket_path), 0)
+        self.assertEqual(out.getvalue(), '')
+
+    @patch('pog.lib.secret.prompt_password', return_value='hunter2')
+    def test_someone_elses_socket(self, mock_prompt):
+        # nothing -- least of all the password -- is sent to a server run by another user
+        with patch('pog.lib.unix_socket._peer_uid', return_value=12345678):
+            code, lines, err = self.submit(self.tiny_sample)
+        self.assertEqual(code, 1)
+        self.assertIn('another user is listening on it', err)
+        self.assertEqual(mock_prompt.call_count, 1)
+        self.assertEqual(self.daemon.keys, {})
+
+        # without SO_PEERCRED, we go by who owns the socket
+        with patch('pog.lib.unix_socket._peer_uid', return_value=None):
+            code, lines, err = self.submit(self.keyfile_flag, '--verify', 'nothing.mfn')
+        self.assertNotIn('another user', err)
+        self.assertEqual(len(self.daemon.keys), 1)
+
+    def test_key_ttl(self):
+        self.submit(self.keyfile_flag, '--verify', 'nothing.mfn')
+        self.assertEqual(len(self.daemon.keys), 1)
+        self.daemon.expire_keys()
+        self.assertEqual(len(self.daemon.keys), 1)
+
+        self.daemon.key_ttl = 0
+        self.submit(f'--keyfile={POG_ROOT}/tests/samples/only_for_testing.decrypt', '--verify', 'nothing.mfn')
+        self.assertEqual(len(self.daemon.keys), 2)
+        self.daemon.expire_keys()
+        self.assertEqual(len(self.daemon.keys), 1)
+
+    def test_clear_keys(self):
+        self.submit(self.keyfile_flag, '--verify', 'nothing.mfn')
+        self.assertEqual(len(self.daemon.keys), 1)
+
+        err = StringIO()
+        with redirect_stderr(err):
+            self.assertEqual(clear_keys(self.socket_path), 0)
+        self.assertEqual(err.getvalue(), '*** cleared 1 key(s)\n')
+        self.assertEqual(self.daemon.keys, {})
+
+    def test_worker_threads_print_to_the_job(self):
+        daemon_out, daemon_err = StringIO(), StringIO()
+        job_out, job_err = StringIO(), StringIO()
+        init, run = Thread.__init__, Thread.run
+        try:
+            with redirect_stdout(daemon_out), redirect_stderr(daemon_err):
+                route_output()
+                with _routed(job_out, job_err):
+                    # e.g. a backend printing from an upload thread
+                    with ThreadPoolExecutor(max_workers=2) as exe:
+                        list(exe.map(lambda i: print('upload {}'.format(i), file=sys.stderr), range(2)))
+                    worker = Thread(target=print, args=('worker',))
+                    worker.start()
+                    worker.join()
+
+                # nobody's job
+                other = Thread(target=print, args=('daemon',))
+                other.start()
+                other.join()
+        finally:
+            Thread.__init__, Thread.run = init, run
+
+        self.assertEqual(job_out.getvalue(), 'worker\n')
+        self.assertEqual(sorted(job_err.getvalue().splitlines()), ['upload 0', 'upload 1'])
+        self.assertEqual(daemon_out.getvalue(), 'daemon\n')
+        self.assertEqual(daemon_err.getvalue(), '')
+
+    def test_not_running(self):
+        err = StringIO()
+        with redirect_stderr(err):
+            code = submit(path.join(self.socket_dir.name, 'nope.sock'), [self.keyfile_flag, self.tiny_sample])
+        self.assertEqual(code, 1)
+        self.assertIn('not running', err.getvalue())
@@ -0,0 +1,27 @@
+from unittest import TestCase
+
+from pog.lib.delta import apply_delta, manifest_delta
+
+
+def _entry(*blobs, mtime=1, atime=1):
+    return {'blobs': list(blobs), 'atime': atime, 'mtime': mtime}
+
+
+class DeltaTest(TestCase):
+    def test_round_trip(self):
+        parent = {'a.txt': _entry('a'), 'b.txt': _entry('b'), 'c.txt': _entry('c'), 'd.txt': _entry('d')}
+        mfn = {'a.txt': _entry('a'), 'b.txt': _entry('b2'), 'd.txt': _entry('d', mtime=2), 'e.txt': _entry('e')}
+
+        changed, removed = manifest_delta(parent, mfn)
+        # unlike a diff, a touched file counts
+        self.assertEqual(sorted(changed), ['b.txt', 'd.txt', 'e.txt'])
+        self.assertEqual(removed, ['c.txt'])
+        self.assertEqual(apply_delta(parent, changed, removed), mfn)
+        self.assertEqual(list(apply_delta(parent, changed, removed)), ['a.txt', 'b.txt', 'd.txt', 'e.txt'])
+
+    def test_nothing_changed(self):
+        parent = {'a.txt': _entry('a')}
+        self.assertEqual(manifest_delta(parent, dict(parent)), ({}, []))
+        # the backup itself reads the file
+        self.assertEqual(manifest_delta(parent, {'a.txt': _entry('a', atime=2)}), ({}, []))
+        self.assertEqual(apply_delta(parent, {}, []), parent)
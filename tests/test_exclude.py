@@ -0,0 +1,61 @@
+from unittest import TestCase
+
+from pog.lib.exclude import ExcludeRules, Excludes
+
+
+class ExcludeRulesTest(TestCase):
+    def test_names(self):
+        rules = ExcludeRules(['node_modules', '*.tmp', '# a comment', '', 'cache?/'])
+        self.assertEqual(rules.patterns, ['node_modules', '*.tmp', 'cache?/'])
+
+        self.assertTrue(rules.match('node_modules', is_dir=True))
+        self.assertTrue(rules.match('a/b/node_modules', is_dir=True))
+        self.assertTrue(rules.match('a/b/c.tmp'))
+        self.assertFalse(rules.match('a/b/c.tmp2'))
+        self.assertFalse(rules.match('node_modules_backup', is_dir=True))
+
+        # directories only
+        self.assertTrue(rules.match('a/cache1', is_dir=True))
+        self.assertFalse(rules.match('a/cache1'))
+
+    def test_paths(self):
+        rules = ExcludeRules(['.git/objects', '/build', 'data/**/*.bin', 'logs/[!a]*'])
+        self.assertTrue(rules.match('.git/objects', is_dir=True))
+        self.assertFalse(rules.match('sub/.git/objects', is_dir=True))
+        self.assertTrue(rules.match('build', is_dir=True))
+        self.assertFalse(rules.match('src/build', is_dir=True))
+
+        self.assertTrue(rules.match('data/x.bin'))
+        self.assertTrue(rules.match('data/a/b/x.bin'))
+        self.assertFalse(rules.match('data/a/b/x.txt'))
+        self.assertTrue(rules.match('logs/b.log'))
+        self.assertFalse(rules.match('logs/a.log'))
+        # `*` doesn't cross directories
+        self.assertFalse(rules.match('logs/b/c.log'))
+
+    def test_negation(self):
+        rules = ExcludeRules(['*.log', '!keep.log', '!', 'debug/keep.log', '\\!bang', '\\#hash'])
+        self.assertEqual(rules.patterns, ['*.log', '!keep.log', 'debug/keep.log', '\\!bang', '\\#hash'])
+
+        # the last pattern that matches wins
+        self.assertTrue(rules.match('a/b.log'))
+        self.assertFalse(rules.match('a/keep.log'))
+        self.assertTrue(rules.match('debug/keep.log'))
+        self.assertEqual(rules.decide('a/keep.log'), False)
+        self.assertEqual(rules.decide('a/b.txt'), None)
+
+        # escaped, they're just names
+        self.assertTrue(rules.match('!bang'))
+        self.assertFalse(rules.match('bang'))
+        self.assertTrue(rules.match('#hash'))
+
+    def test_excluded(self):
+        rules = ExcludeRules(['/build'], base='/home/user/project/')
+        self.assertTrue(rules.excluded('/home/user/project/build', is_dir=True))
+        self.assertFalse(rules.excluded('/home/user/project/src/build', is_dir=True))
+
+    def test_excluded_path(self):
+        excludes = Excludes(['node_modules'])
+        self.assertTrue(excludes.excluded_path('a/node_modules/b/c.js'))
+        self.assertFalse(excludes.excluded_path('a/b/c.js'))
+        self.assertFalse(Excludes().excluded_path('a/node_modules/c.js'))
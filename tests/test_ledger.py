@@ -0,0 +1,108 @@
+from os import listdir, path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import patch
+
+from nacl.secret import SecretBox
+
+from pog.fs.localfs import localfs
+from pog.lib.ledger import Ledger
+
+
+class LedgerTest(TestCase):
+    def setUp(self):
+        self.dest_dir = TemporaryDirectory()
+        self.cache_dir = TemporaryDirectory()
+        self.fs = localfs(root=self.dest_dir.name)
+        self.box = SecretBox(b'0' * SecretBox.KEY_SIZE)
+
+    def tearDown(self):
+        with self.dest_dir, self.cache_dir:
+            pass
+
+    def ledger(self, cache=True):
+        return Ledger(self.fs, self.box, 'local', self.cache_dir.name if cache else None).load()
+
+    def test_empty(self):
+        ledger = self.ledger()
+        self.assertEqual(ledger.generation, 0)
+        self.assertEqual(ledger.manifests, {})
+        self.assertEqual(ledger.refs, {})
+
+    def test_save_and_load(self):
+        ledger = self.ledger()
+        self.assertTrue(ledger.add_manifest('1.mfn', ['a', 'b', 'b']))
+        self.assertTrue(ledger.add_manifest('2.mfn', ['b', 'c'], parent='1.mfn'))
+        self.assertFalse(ledger.add_manifest('2.mfn', ['b', 'c']))
+        ledger.save()
+        ledger.save()
+
+        # only the latest generation is kept
+        self.assertEqual(listdir(path.join(self.dest_dir.name, 'ledger')), ['000000000002'])
+
+        ledger = self.ledger(cache=False)
+        self.assertEqual(ledger.generation, 2)
+        self.assertEqual(ledger.refs, {'a': 1, 'b': 2, 'c': 1})
+        self.assertEqual(ledger.manifests, {
+            '1.mfn': {'blobs': 2, 'parent': None},
+            '2.mfn': {'blobs': 2, 'parent': '1.mfn'},
+        })
+        self.assertEqual(ledger.children('1.mfn'), ['2.mfn'])
+
+    def test_encrypted(self):
+        ledger = self.ledger()
+        ledger.add_manifest('1.mfn', ['secretblob'])
+        ledger.save()
+
+        with open(path.join(self.dest_dir.name, 'ledger', '000000000001'), 'rb') as f:
+            self.assertNotIn(b'secretblob', f.read())
+
+        other = Ledger(self.fs, SecretBox(b'1' * SecretBox.KEY_SIZE))
+        with self.assertRaises(Exception):
+            other.load()
+
+    def test_cache(self):
+        ledger = self.ledger()
+        ledger.add_manifest('1.mfn', ['a'])
+        ledger.save()
+
+        # the latest generation is in the cache, so it isn't downloaded
+        with patch.object(localfs, 'download_file') as download:
+            self.assertEqual(self.ledger().refs, {'a': 1})
+        download.assert_not_called()
+
+        # ... unless someone else has saved a newer one
+        other = self.ledger(cache=False)
+        other.add_manifest('2.mfn', ['a', 'b'])
+        other.save()
+
+        ledger = self.ledger()
+        self.assertEqual(ledger.generation, 2)
+        self.assertEqual(ledger.refs, {'a': 2, 'b': 1})
+
+    def test_retire(self):
+        ledger = self.ledger()
+        ledger.add_manifest('1.mfn', ['a', 'b'])
+        ledger.add_manifest('2.mfn', ['b', 'c'])
+
+        self.assertEqual(ledger.retire_manifest('1.mfn', ['a', 'b']), ['a'])
+        self.assertEqual(ledger.refs, {'b': 1, 'c': 1})
+        self.assertEqual(ledger.retire_manifest('2.mfn', ['b', 'c']), ['b', 'c'])
+        self.assertEqual(ledger.refs, {})
+        self.assertEqual(ledger.manifests, {})
+
+        with self.assertRaises(ValueError):
+            ledger.retire_manifest('2.mfn', ['b', 'c'])
+
+    def test_retire_parent(self):
+        ledger = self.ledger()
+        ledger.add_manifest('1.mfn', ['a'])
+        ledger.add_manifest('2.mfn', ['a', 'b'], parent='1.mfn')
+
+        with self.assertRaises(ValueError) as ctx:
+            ledger.retire_manifest('1.mfn', ['a'])
+        self.assertIn('2.mfn', str(ctx.exception))
+        self.assertEqual(ledger.refs, {'a': 2, 'b': 1})
+
+        self.assertEqual(ledger.retire_manifest('2.mfn', ['a', 'b']), ['b'])
+        self.assertEqual(ledger.retire_manifest('1.mfn', ['a']), ['a'])
@@ -1,7 +1,10 @@
-from os import mkdir
+import os
+from os import makedirs, mkdir
 from tempfile import TemporaryDirectory
 from unittest import TestCase
+from unittest.mock import patch
 
+from pog.lib.exclude import Excludes
 from pog.lib.local_file_list import local_file_list
 
 
@@ -48,3 +51,69 @@ class LocalFileListTest(TestCase):
             local_file_list(f'{self.test_dir.name}/**/*'),
             expected,
         )
+
+    def make_project(self):
+        for filename in ('project/main.py', 'project/x.tmp', 'project/node_modules/lib/index.js',
+                         'project/build/out.o', 'project/src/build/notes.txt', 'project/.hidden'):
+            makedirs(os.path.dirname(f'{self.test_dir.name}/{filename}'), exist_ok=True)
+            with open(f'{self.test_dir.name}/{filename}', 'wb'):
+                pass
+        return f'{self.test_dir.name}/project'
+
+    def test_exclude(self):
+        project = self.make_project()
+        excludes = Excludes(['node_modules', '*.tmp', '/build/'])
+        with patch('pog.lib.local_file_list.os.scandir', wraps=os.scandir) as mock_scandir:
+            self.assertEqual(
+                local_file_list(project, exclude=excludes),
+                [f'{project}/main.py', f'{project}/src/build/notes.txt']
+            )
+        # excluded directories are never read
+        scanned = sorted(c.args[0] for c in mock_scandir.call_args_list)
+        self.assertEqual(scanned, [project, f'{project}/src', f'{project}/src/build'])
+
+    def test_exclude_relative(self):
+        self.make_project()
+        self.assertEqual(
+            local_file_list('project', working_dir=self.test_dir.name, exclude=Excludes(['node_modules', 'build'])),
+            ['project/main.py', 'project/x.tmp']
+        )
+        # globs are filtered, and named files are always included
+        self.assertEqual(
+            local_file_list('project/**/*.js', 'project/x.tmp', working_dir=self.test_dir.name,
+                            exclude=Excludes(['node_modules', '*.tmp'])),
+            ['project/x.tmp']
+        )
+
+    def test_pogignore(self):
+        project = self.make_project()
+        with open(f'{project}/.pogignore', 'w') as f:
+            f.write('# generated stuff\nnode_modules\n/build\n')
+        with open(f'{project}/src/.pogignore', 'w') as f:
+            f.write('*.txt\n')
+
+        excludes = Excludes(['*.tmp'])
+        self.assertEqual(local_file_list(project, exclude=excludes), [f'{project}/main.py'])
+        self.assertEqual(excludes.metadata(), {
+            'exclude': ['*.tmp'],
+            'pogignore': {project: ['node_modules', '/build'], f'{project}/src': ['*.txt']},
+        })
+        # .pogignore is honored even without --exclude
+        self.assertEqual(
+            local_file_list('project', working_dir=self.test_dir.name), ['project/main.py', 'project/x.tmp']
+        )
+
+    def test_pogignore_negation(self):
+        project = self.make_project()
+        with open(f'{project}/.pogignore', 'w') as f:
+            f.write('!x.tmp\n!node_modules/lib/index.js\n')
+        with open(f'{project}/src/.pogignore', 'w') as f:
+            f.write('*.txt\n!notes.txt\n')
+
+        # a .pogignore can re-include what --exclude (or a .pogignore further up) excluded -- but not inside a
+        # directory that was excluded, since we never look in there
+        excludes = Excludes(['*.tmp', 'node_modules', 'notes.txt'])
+        self.assertEqual(
+            local_file_list(project, exclude=excludes),
+            [f'{project}/build/out.o', f'{project}/main.py', f'{project}/src/build/notes.txt', f'{project}/x.tmp']
+        )
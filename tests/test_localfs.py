@@ -0,0 +1,78 @@
+from os import listdir, path, stat
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import patch
+
+from pog.fs.localfs import copy_file, localfs
+
+
+class CopyFileTest(TestCase):
+    def setUp(self):
+        self.test_dir = TemporaryDirectory()
+        self.src = path.join(self.test_dir.name, 'src')
+        with open(self.src, 'wb') as f:
+            f.write(b'0123456789' * 1000)
+
+    def tearDown(self):
+        with self.test_dir:
+            pass
+
+    def assertCopied(self, dst):
+        with open(dst, 'rb') as f:
+            self.assertEqual(f.read(), b'0123456789' * 1000)
+        # no temp files left behind
+        self.assertEqual(sorted(listdir(self.test_dir.name)), sorted(['src', path.basename(dst)]))
+
+    def test_link(self):
+        dst = path.join(self.test_dir.name, 'dst')
+        self.assertEqual(copy_file(self.src, dst), 'link')
+        self.assertCopied(dst)
+        self.assertEqual(stat(dst).st_ino, stat(self.src).st_ino)
+
+    def test_replaces_existing_file(self):
+        dst = path.join(self.test_dir.name, 'dst')
+        copy_file(self.src, dst)
+        other = path.join(self.test_dir.name, 'other')
+        with open(other, 'wb') as f:
+            f.write(b'abc')
+
+        # dst shares an inode with src, so it must be replaced rather than written over
+        copy_file(other, dst)
+        with open(self.src, 'rb') as f:
+            self.assertEqual(f.read(), b'0123456789' * 1000)
+        with open(dst, 'rb') as f:
+            self.assertEqual(f.read(), b'abc')
+
+    @patch('pog.fs.localfs._reflink', return_value=False)
+    @patch('pog.fs.localfs._link', return_value=False)
+    def test_copy_file_range(self, mock_link, mock_reflink):
+        dst = path.join(self.test_dir.name, 'dst')
+        self.assertIn(copy_file(self.src, dst), ('copy_file_range', 'copy'))
+        self.assertCopied(dst)
+        self.assertNotEqual(stat(dst).st_ino, stat(self.src).st_ino)
+
+    @patch('pog.fs.localfs._copy_file_range', return_value=False)
+    @patch('pog.fs.localfs._reflink', return_value=False)
+    @patch('pog.fs.localfs._link', return_value=False)
+    def test_copy(self, mock_link, mock_reflink, mock_range):
+        dst = path.join(self.test_dir.name, 'dst')
+        self.assertEqual(copy_file(self.src, dst), 'copy')
+        self.assertCopied(dst)
+
+    def test_upload_and_download(self):
+        fs = localfs(root=self.test_dir.name)
+        fs.upload_file(self.src, 'data/ab/abcdef')
+        self.assertTrue(fs.exists('data/ab/abcdef'))
+
+        dst = path.join(self.test_dir.name, 'downloaded')
+        fs.download_file(dst, 'data/ab/abcdef')
+        with open(dst, 'rb') as f:
+            self.assertEqual(f.read(), b'0123456789' * 1000)
+
+    def test_list_data(self):
+        fs = localfs(root=self.test_dir.name)
+        blobs = ['data/ab/abc', 'data/ab/abd', 'data/cd/cde', 'data/unsharded']
+        for blob in blobs:
+            fs.upload_file(self.src, blob)
+
+        self.assertEqual(sorted(fs.list_data(concurrency=2)), [path.join(self.test_dir.name, blob) for blob in blobs])
@@ -0,0 +1,97 @@
+from unittest import TestCase
+from unittest.mock import patch
+
+from pog.lib import merkle
+from pog.lib.merkle import diff_manifests, manifest_tree
+
+
+class _Watched(dict):
+    '''
+    remembers which filenames were looked at.
+    '''
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.seen = set()
+
+    def __getitem__(self, key):
+        self.seen.add(key)
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        self.seen.add(key)
+        return super().get(key, default)
+
+    def __contains__(self, key):
+        self.seen.add(key)
+        return super().__contains__(key)
+
+
+def _entry(*blobs, mtime=1):
+    return {'blobs': list(blobs), 'atime': mtime, 'mtime': mtime}
+
+
+class MerkleTest(TestCase):
+    def setUp(self):
+        self.old = {
+            '/home/user/a.txt': _entry('a'),
+            '/home/user/docs/b.txt': _entry('b1', 'b2'),
+            '/home/user/docs/old/c.txt': _entry('c'),
+            '/opt/d.txt': _entry('d'),
+            'e.txt': _entry('e'),
+        }
+
+    def test_tree(self):
+        tree = manifest_tree(self.old)
+        self.assertEqual(
+            sorted(tree), ['', '/home', '/home/user', '/home/user/docs', '/home/user/docs/old', '/opt']
+        )
+
+        # times don't matter
+        touched = dict(self.old, **{'/opt/d.txt': _entry('d', mtime=2)})
+        self.assertEqual(manifest_tree(touched), tree)
+
+        # contents bubble up to the top
+        changed = dict(self.old, **{'/home/user/docs/old/c.txt': _entry('c2')})
+        changed_tree = manifest_tree(changed)
+        self.assertEqual(
+            sorted(d for d in tree if tree[d] != changed_tree[d]),
+            ['', '/home', '/home/user', '/home/user/docs', '/home/user/docs/old']
+        )
+        self.assertEqual(changed_tree['/opt'], tree['/opt'])
+
+    def test_diff(self):
+        new = dict(self.old)
+        new['/home/user/docs/b.txt'] = _entry('b1', 'b3')
+        new['/home/user/docs/new.txt'] = _entry('n')
+        del new['/opt/d.txt']
+
+        self.assertEqual(
+            [(filename, status) for filename, status, _, _ in diff_manifests(self.old, new)],
+            [('/home/user/docs/b.txt', 'changed'), ('/home/user/docs/new.txt', 'added'), ('/opt/d.txt', 'removed')]
+        )
+        self.assertEqual(list(diff_manifests(self.old, dict(self.old))), [])
+
+    def test_unchanged_directories_are_skipped(self):
+        new = dict(self.old, **{'e.txt': _entry('e2')})
+        old_tree, new_tree = manifest_tree(self.old), manifest_tree(new)
+
+        with patch.object(merkle, 'entry_digest', wraps=merkle.entry_digest) as mock_digest:
+            changes = list(diff_manifests(self.old, new, old_tree, new_tree))
+        self.assertEqual([c[0] for c in changes], ['e.txt'])
+        # only the top level was compared
+        self.assertEqual(mock_digest.call_count, 2)
+
+    def test_unchanged_subtrees_are_not_walked(self):
+        old = dict(self.old, **{f'/srv/data/{i}.bin': _entry(str(i)) for i in range(100)})
+        new = dict(old, **{'/home/user/docs/old/c.txt': _entry('c2'), '-first.txt': _entry('f')})
+        old, new = _Watched(old), _Watched(new)
+
+        changes = list(diff_manifests(old, new, manifest_tree(old), manifest_tree(new)))
+        self.assertEqual(
+            [(c[0], c[1]) for c in changes], [('-first.txt', 'added'), ('/home/user/docs/old/c.txt', 'changed')]
+        )
+        # only the files directly in changed directories were looked at
+        self.assertEqual(new.seen, {'-first.txt', 'e.txt', '/home/user/a.txt', '/home/user/docs/b.txt',
+                                    '/home/user/docs/old/c.txt'})
+        self.assertEqual(old.seen, {'-first.txt', 'e.txt', '/home/user/a.txt', '/home/user/docs/b.txt',
+                                    '/home/user/docs/old/c.txt'})
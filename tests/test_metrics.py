@@ -0,0 +1,77 @@
+from io import BytesIO
+from json import load
+from os import path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from pog.lib.metrics import Metrics, _TimedReader
+
+
+class MetricsTest(TestCase):
+    def setUp(self):
+        self.test_dir = TemporaryDirectory()
+
+    def tearDown(self):
+        with self.test_dir:
+            pass
+
+    def test_stages(self):
+        m = Metrics()
+        with m.stage('compress', 100, blob='abc'):
+            pass
+        m.record('compress', 0.5, 50)
+        m.record('upload', 1.5, 150, blob='abc', destination='s3:bucket')
+
+        summary = m.summary()
+        self.assertEqual(len(summary['stages']), 2)
+
+        compress, upload = summary['stages']
+        self.assertEqual(compress['stage'], 'compress')
+        self.assertEqual(compress['destination'], None)
+        self.assertEqual(compress['bytes'], 150)
+        self.assertEqual(compress['count'], 2)
+        self.assertGreaterEqual(compress['seconds'], 0.5)
+
+        self.assertEqual(upload, {'stage': 'upload', 'destination': 's3:bucket', 'seconds': 1.5, 'bytes': 150, 'count': 1})
+
+        # no spans unless we ask for them
+        self.assertNotIn('spans', summary)
+
+    def test_spans(self):
+        m = Metrics(spans=True)
+        with m.stage('hash', 10, blob='abc'):
+            pass
+        m.record('upload', 1.5, 150, blob='abc', destination='s3:bucket')
+        m.record('write', 1.0, 150)  # no blob, no span
+
+        spans = m.summary()['spans']
+        self.assertEqual([(s['blob'], s['stage']) for s in spans], [('abc', 'hash'), ('abc', 'upload')])
+        self.assertEqual(spans[1]['destination'], 's3:bucket')
+
+    def test_save(self):
+        m = Metrics(spans=True)
+        m.record('upload', 1.5, 150, blob='abc', destination='s3:bucket')
+        m.record('compress', 0.5, 50)
+
+        json_path = path.join(self.test_dir.name, 'metrics.json')
+        m.save_json(json_path)
+        with open(json_path) as f:
+            self.assertEqual(load(f)['stages'][1]['bytes'], 150)
+
+        prom_path = path.join(self.test_dir.name, 'pog.prom')
+        m.save_textfile(prom_path)
+        with open(prom_path) as f:
+            lines = f.read().splitlines()
+        self.assertIn('# TYPE pog_stage_seconds_total counter', lines)
+        self.assertIn('pog_stage_seconds_total{stage="compress"} 0.5', lines)
+        self.assertIn('pog_stage_bytes_total{stage="upload",destination="s3:bucket"} 150', lines)
+        self.assertIn('pog_stage_calls_total{stage="upload",destination="s3:bucket"} 1', lines)
+
+    def test_timed_reader(self):
+        r = _TimedReader(BytesIO(b'0123456789'))
+        self.assertEqual(r.read(4), b'0123')
+        self.assertEqual(r.read(4), b'4567')
+
+        seconds, num_bytes = r.lap()
+        self.assertEqual(num_bytes, 8)
+        self.assertEqual(r.lap(), (0.0, 0))
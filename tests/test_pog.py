@@ -1,14 +1,20 @@
 import hashlib
+import json
 import random
 from glob import glob
-from os import environ, path, listdir
+from os import environ, path, listdir, remove as os_remove, stat, urandom
 from shutil import copyfile
+from subprocess import PIPE, STDOUT, Popen
 from tempfile import TemporaryDirectory
 from unittest import TestCase, skipUnless
 
+from nacl.secret import SecretBox
+
 from .helpers import TestDirMixin, POG_ROOT, SAMPLE_TIME1, SAMPLE_TIME2
 from pog.fs.localfs import localfs
 from pog.lib.blob_store import _data_path
+from pog.lib.journal import Journal
+from pog.pog import Decryptor, get_keys
 
 
 SAMPLE_TEXT = b'''069:15:22 Lovell (onboard): Hey, I don't see a thing. Where are we?
@@ -103,6 +109,449 @@ class KeyfileTest(TestDirMixin, TestCase):
         self.assertEqual(path.getmtime(tiny_sample), SAMPLE_TIME1)
         self.assertEqual(path.getmtime(another_sample), SAMPLE_TIME2)
 
+    def test_blob_naming_per_destination(self):
+        save_to = '--save-to=local'
+        self.run_command(self.encryption_flag, '--blob-naming=blake2b', save_to, self.tiny_sample, CONCURRENCY_FLAG)
+        with open(path.join(self.working_dir.name, 'blob_naming')) as f:
+            self.assertEqual(f.read(), 'blake2b\n')
+        self.assertEqual(len(glob(path.join(self.working_dir.name, '*.mfn'))), 1)
+
+        # sha256 names would never dedup against what's there
+        res = self.run_command(self.encryption_flag, save_to, self.tiny_sample, CONCURRENCY_FLAG, stderr=STDOUT)
+        self.assertIn(
+            'ValueError: local has blobs named with --blob-naming=blake2b, which blobs named with sha256 would never '
+            'dedup against. Use --blob-naming=blake2b, or another destination', res
+        )
+        self.assertEqual(len(glob(path.join(self.working_dir.name, '*.mfn'))), 1)
+
+        self.run_command(self.encryption_flag, '--blob-naming=blake2b', save_to, self.tiny_sample, CONCURRENCY_FLAG)
+        self.assertEqual(len(glob(path.join(self.working_dir.name, '*.mfn'))), 2)
+
+    def test_blake2b_naming(self):
+        enc = self.run_command(
+            self.encryption_flag, '--blob-naming=blake2b', self.tiny_sample, self.another_sample, CONCURRENCY_FLAG
+        )
+        manifest_name = glob(path.join(self.working_dir.name, '*.mfn'))[0]
+        blobs = [line for line in enc if not line.startswith('***')]
+        self.assertEqual(len(blobs), 2)
+        self.assertEqual([len(b) for b in blobs], [44, 44])
+        self.assertNotIn(self.tiny_sample_blobname, blobs)
+        self.assertNotIn(self.another_sample_blobname, blobs)
+
+        # the naming scheme is recorded, but stays out of the way of the file list
+        flag, keyfile = self.decryption_flag.split('=', 1)
+        d = Decryptor(*get_keys({flag: keyfile}))
+        mfn, metadata = d.load_manifest(manifest_name, with_metadata=True)
+        self.assertEqual(metadata['blob_naming'], 'blake2b')
+        self.assertEqual(list(mfn), ['another_sample.txt', 'tiny_sample.txt'])
+
+        show_mfn_index = self.run_command(self.encryption_flag, '--dump-manifest-index', manifest_name)
+        self.assertEqual(sorted(show_mfn_index), sorted(blobs))
+
+        dec = self.run_command(self.decryption_flag, '--decrypt', '--consume', manifest_name)
+        self.assertEqual(dec, ['*** 1/2: another_sample.txt', '*** 2/2: tiny_sample.txt'])
+        with open(path.join(self.working_dir.name, 'tiny_sample.txt')) as f:
+            self.assertEqual(f.read(), 'aaaabbbb')
+
+    def test_plaintext_identity(self):
+        enc = self.run_command(
+            self.encryption_flag, '--blob-identity=plaintext', self.tiny_sample, self.another_sample, CONCURRENCY_FLAG
+        )
+        blobs = [line for line in enc if not line.startswith('***')]
+        self.assertEqual(len(blobs), 2)
+        self.assertNotIn(self.tiny_sample_blobname, blobs)
+        self.assertNotIn(self.another_sample_blobname, blobs)
+
+        # a different compression level doesn't change the names. Everything is already there, so nothing is made
+        enc = self.run_command(
+            self.encryption_flag, '--blob-identity=plaintext', '--compresslevel=19', '--progress=json',
+            self.tiny_sample, self.another_sample, CONCURRENCY_FLAG
+        )
+        events = [json.loads(line) for line in enc]
+        blob_events = [e for e in events if e['event'] == 'blob']
+        self.assertEqual([e['blob'] for e in blob_events], blobs)
+        self.assertEqual([e['status'] for e in blob_events], ['dedup', 'dedup'])
+        self.assertEqual([e['bytes_out'] for e in blob_events], [0, 0])
+
+        manifest_name = path.join(self.working_dir.name, [e for e in events if e['event'] == 'manifest'][0]['filename'])
+        flag, keyfile = self.decryption_flag.split('=', 1)
+        _, metadata = Decryptor(*get_keys({flag: keyfile})).load_manifest(manifest_name, with_metadata=True)
+        self.assertEqual(metadata['blob_identity'], 'plaintext')
+        self.assertNotIn('blob_naming', metadata)
+
+        for mfn in glob(path.join(self.working_dir.name, '*.mfn')):
+            if mfn != manifest_name:
+                os_remove(mfn)
+        dec = self.run_command(self.decryption_flag, '--decrypt', '--consume', manifest_name)
+        self.assertEqual(dec, ['*** 1/2: another_sample.txt', '*** 2/2: tiny_sample.txt'])
+        with open(path.join(self.working_dir.name, 'tiny_sample.txt')) as f:
+            self.assertEqual(f.read(), 'aaaabbbb')
+        with open(path.join(self.working_dir.name, 'another_sample.txt')) as f:
+            self.assertEqual(f.read(), '0123456789')
+
+    def test_plaintext_identity_multiple_blobs(self):
+        # every blob is its own zstd frame
+        enc = self.run_command(
+            self.encryption_flag, '--blob-identity=plaintext', '--chunk-size=4', self.another_sample, CONCURRENCY_FLAG
+        )
+        self.assertEqual(len([line for line in enc if not line.startswith('***')]), 3)
+        manifest_name = glob(path.join(self.working_dir.name, '*.mfn'))[0]
+
+        dec = self.run_command(self.decryption_flag, '--decrypt', manifest_name)
+        self.assertEqual(dec, ['*** 1/1: another_sample.txt'])
+        with open(path.join(self.working_dir.name, 'another_sample.txt')) as f:
+            self.assertEqual(f.read(), '0123456789')
+
+    def test_adaptive_compresslevel(self):
+        enc = self.run_command(
+            self.encryption_flag, '--blob-identity=plaintext', '--chunk-size=4', '--compresslevel=1-19',
+            '--progress=json', self.another_sample, CONCURRENCY_FLAG
+        )
+        events = [json.loads(line) for line in enc]
+        levels = [e['level'] for e in events if e['event'] == 'blob']
+        self.assertEqual(len(levels), 3)
+        self.assertTrue(all(1 <= level <= 19 for level in levels))
+
+        manifest_name = glob(path.join(self.working_dir.name, '*.mfn'))[0]
+        flag, keyfile = self.decryption_flag.split('=', 1)
+        _, metadata = Decryptor(*get_keys({flag: keyfile})).load_manifest(manifest_name, with_metadata=True)
+        self.assertEqual(sum(metadata['compresslevels'].values()), 3)
+
+        dec = self.run_command(self.decryption_flag, '--decrypt', manifest_name)
+        self.assertEqual(dec, ['*** 1/1: another_sample.txt'])
+        with open(path.join(self.working_dir.name, 'another_sample.txt')) as f:
+            self.assertEqual(f.read(), '0123456789')
+
+    def test_process_workers(self):
+        enc = self.run_command(
+            self.encryption_flag, '--workers=process', self.tiny_sample, self.another_sample, CONCURRENCY_FLAG
+        )
+        # the same blobs the threads would have made
+        self.assertEqual([line for line in enc if not line.startswith('***')], [
+            self.another_sample_blobname, self.tiny_sample_blobname
+        ])
+        manifest_name = glob(path.join(self.working_dir.name, '*.mfn'))[0]
+
+        dec = self.run_command(self.decryption_flag, '--decrypt', manifest_name)
+        self.assertEqual(dec, ['*** 1/2: another_sample.txt', '*** 2/2: tiny_sample.txt'])
+        with open(path.join(self.working_dir.name, 'tiny_sample.txt')) as f:
+            self.assertEqual(f.read(), 'aaaabbbb')
+
+    def test_restore_shared_blobs(self):
+        tiny_copy = path.join(self.input_dir.name, 'tiny_copy.txt')
+        copyfile(self.tiny_sample, tiny_copy)
+        shuffled = path.join(self.input_dir.name, 'shuffled.txt')
+        with open(shuffled, 'wb') as f:
+            f.write(b'bbbbaaaa')
+
+        self.run_command(
+            self.encryption_flag, '--blob-identity=plaintext', '--chunk-size=4', '--save-to=local',
+            self.tiny_sample, tiny_copy, shuffled, CONCURRENCY_FLAG
+        )
+        manifest_name = path.basename(glob(path.join(self.working_dir.name, '*.mfn'))[0])
+
+        metrics = path.join(self.input_dir.name, 'metrics.json')
+        dec = self.run_command(
+            self.decryption_flag, '--decrypt', '--progress=json', f'--metrics={metrics}', f'local:{manifest_name}'
+        )
+        events = [json.loads(line) for line in dec]
+        copies = {e['filename']: e.get('copy_of') for e in events if e['event'] == 'file_end'}
+        self.assertEqual(copies, {'shuffled.txt': None, 'tiny_copy.txt': None, 'tiny_sample.txt': 'tiny_copy.txt'})
+
+        # each blob is only downloaded once
+        with open(metrics) as f:
+            downloads = [s['blob'] for s in json.load(f)['spans'] if s['stage'] == 'download']
+        self.assertEqual(len(downloads), 3)
+        self.assertEqual(downloads[0], manifest_name)
+
+        for filename, contents in (('tiny_sample.txt', 'aaaabbbb'), ('tiny_copy.txt', 'aaaabbbb'),
+                                   ('shuffled.txt', 'bbbbaaaa')):
+            with open(path.join(self.working_dir.name, filename)) as f:
+                self.assertEqual(f.read(), contents)
+
+    def test_consume_shared_blobs(self):
+        tiny_copy = path.join(self.input_dir.name, 'tiny_copy.txt')
+        copyfile(self.tiny_sample, tiny_copy)
+        self.run_command(self.encryption_flag, self.tiny_sample, tiny_copy, CONCURRENCY_FLAG)
+        manifest_name = glob(path.join(self.working_dir.name, '*.mfn'))[0]
+
+        # the blob is used twice, so it's only consumed after the second time
+        dec = self.run_command(self.decryption_flag, '--decrypt', '--consume', manifest_name)
+        self.assertEqual(dec, ['*** 1/2: tiny_copy.txt', '*** 2/2: tiny_sample.txt'])
+        self.assertEqual(sorted(listdir(self.working_dir.name)), ['tiny_copy.txt', 'tiny_sample.txt'])
+        for filename in ('tiny_copy.txt', 'tiny_sample.txt'):
+            with open(path.join(self.working_dir.name, filename)) as f:
+                self.assertEqual(f.read(), 'aaaabbbb')
+
+    def test_resume_from_journal(self):
+        # the first run was interrupted after tiny_sample made it out
+        self.run_command(self.encryption_flag, self.tiny_sample, CONCURRENCY_FLAG)
+        for mfn in glob(path.join(self.working_dir.name, '*.mfn')):
+            os_remove(mfn)
+
+        flag, keyfile = self.encryption_flag.split('=', 1)
+        secret, _ = get_keys({flag: keyfile})
+        journal = Journal(path.join(self.working_dir.name, 'backup.journal'), SecretBox(secret))
+        journal.open([
+            {'run': {
+                'manifest': 'resumed.mfn', 'blob_naming': 'sha256', 'blob_identity': 'compressed',
+                'chunk_size': 100000000, 'store_absolute_paths': False,
+            }},
+            {'blob': self.tiny_sample_blobname},
+            {'file': self.tiny_sample, 'blobs': [self.tiny_sample_blobname], 'atime': SAMPLE_TIME1,
+             'mtime': SAMPLE_TIME1, 'size': 8},
+        ])
+        journal.close()
+
+        # without --resume, we don't touch someone else's journal
+        self.run_command(self.encryption_flag, '--journal=backup.journal', self.tiny_sample, CONCURRENCY_FLAG)
+        self.assertEqual(glob(path.join(self.working_dir.name, '*.mfn')), [])
+
+        enc = self.run_command(
+            self.encryption_flag, '--journal=backup.journal', '--resume', '--checkpoint-interval=0', '--progress=json',
+            self.tiny_sample, self.another_sample, CONCURRENCY_FLAG
+        )
+        events = [json.loads(line) for line in enc]
+        self.assertEqual([e['filename'] for e in events if e['event'] == 'blob'], [self.another_sample])
+        self.assertEqual([e.get('resumed', False) for e in events if e['event'] == 'file_end'], [False, True])
+        self.assertEqual([e['files'] for e in events if e['event'] == 'checkpoint'], [1, 2])
+        self.assertEqual(events[-1]['manifest'], 'resumed.mfn')
+        self.assertFalse(path.exists(path.join(self.working_dir.name, 'backup.journal')))
+
+        dec = self.run_command(self.decryption_flag, '--decrypt', 'resumed.mfn')
+        self.assertEqual(dec, ['*** 1/2: another_sample.txt', '*** 2/2: tiny_sample.txt'])
+        with open(path.join(self.working_dir.name, 'tiny_sample.txt')) as f:
+            self.assertEqual(f.read(), 'aaaabbbb')
+
+    def test_sparse_file(self):
+        sparse_sample = path.join(self.input_dir.name, 'disk.img')
+        with open(sparse_sample, 'wb') as f:
+            f.write(bytes(2 * 1024 * 1024))  # a hole, or at least zeros
+            f.write(b'data')
+            f.truncate(8 * 1024 * 1024)
+
+        enc = self.run_command(self.encryption_flag, '--detect-zeros', sparse_sample, CONCURRENCY_FLAG)
+        manifest_name = path.join(self.working_dir.name, enc[-1][len('*** 2/2: '):])
+
+        flag, keyfile = self.decryption_flag.split('=', 1)
+        info = Decryptor(*get_keys({flag: keyfile})).load_manifest(manifest_name)['disk.img']
+        self.assertEqual(info['size'], 8 * 1024 * 1024)
+        self.assertEqual(info['holes'][0], [0, 2 * 1024 * 1024])
+
+        dec = self.run_command(self.decryption_flag, '--decrypt', manifest_name)
+        self.assertEqual(dec, ['*** 1/1: disk.img'])
+        self.assertEqual(
+            compute_checksum(path.join(self.working_dir.name, 'disk.img')), compute_checksum(sparse_sample)
+        )
+
+    def test_sparse_duplicates(self):
+        images = [path.join(self.input_dir.name, name) for name in ('a.img', 'b.img')]
+        for image in images:
+            with open(image, 'wb') as f:
+                f.seek(50 * 1024 * 1024)
+                f.write(b'x' * 4096)
+                f.truncate(100 * 1024 * 1024)
+
+        enc = self.run_command(self.encryption_flag, '--detect-zeros', *images, CONCURRENCY_FLAG)
+        manifest_name = path.join(self.working_dir.name, enc[-1][len('*** 3/3: '):])
+
+        dec = self.run_command(self.decryption_flag, '--decrypt', '--progress=json', manifest_name)
+        copies = {e['filename']: e.get('copy_of') for e in map(json.loads, dec) if e['event'] == 'file_end'}
+        self.assertEqual(copies, {'a.img': None, 'b.img': 'a.img'})
+
+        restored = [path.join(self.working_dir.name, name) for name in ('a.img', 'b.img')]
+        if stat(restored[0]).st_blocks * 512 >= 1024 * 1024:
+            self.skipTest('filesystem does not do sparse files')
+        # the copy is as sparse as the file it was copied from
+        self.assertLess(stat(restored[1]).st_blocks * 512, 1024 * 1024)
+        self.assertEqual(compute_checksum(restored[1]), compute_checksum(images[0]))
+
+    def test_diff(self):
+        enc = self.run_command(self.encryption_flag, self.tiny_sample, self.another_sample, CONCURRENCY_FLAG)
+        old_manifest = enc[-1][len('*** 3/3: '):]
+
+        with open(self.tiny_sample, 'wb') as f:
+            f.write(b'changed')
+        third_sample = path.join(self.input_dir.name, 'third_sample.txt')
+        with open(third_sample, 'wb') as f:
+            f.write(b'new file')
+        enc = self.run_command(self.encryption_flag, self.tiny_sample, third_sample, CONCURRENCY_FLAG)
+        new_manifest = enc[-1][len('*** 3/3: '):]
+
+        flag, keyfile = self.decryption_flag.split('=', 1)
+        _, metadata = Decryptor(*get_keys({flag: keyfile})).load_manifest(
+            path.join(self.working_dir.name, new_manifest), with_metadata=True
+        )
+        self.assertIn('', metadata['tree'])
+
+        diff = self.run_command(self.decryption_flag, '--diff', old_manifest, new_manifest)
+        self.assertEqual(diff, ['- another_sample.txt', '+ third_sample.txt', 'M tiny_sample.txt'])
+
+        diff = self.run_command(self.decryption_flag, '--diff', '--progress=json', new_manifest, new_manifest)
+        self.assertEqual([json.loads(line)['event'] for line in diff], ['done'])
+
+    def _raw_manifest(self, manifest_name):
+        flag, keyfile = self.decryption_flag.split('=', 1)
+        return Decryptor(*get_keys({flag: keyfile}))._read_manifest(path.join(self.working_dir.name, manifest_name))
+
+    def test_delta_manifest(self):
+        third_sample = path.join(self.input_dir.name, 'third_sample.txt')
+        with open(third_sample, 'wb') as f:
+            f.write(b'third')
+        samples = [self.tiny_sample, self.another_sample, third_sample]
+        enc = self.run_command(self.encryption_flag, *samples, CONCURRENCY_FLAG)
+        base = enc[-1][len('*** 4/4: '):]
+
+        with open(self.tiny_sample, 'wb') as f:
+            f.write(b'changed')
+        enc = self.run_command(self.encryption_flag, f'--parent={base}', *samples, CONCURRENCY_FLAG)
+        first_delta = enc[-1][len('*** 4/4: '):]
+        mfn, metadata = self._raw_manifest(first_delta)
+        self.assertEqual(list(mfn), ['tiny_sample.txt'])
+        self.assertEqual((metadata['parent'], metadata['chain'], metadata['removed']), (base, 1, []))
+
+        enc = self.run_command(self.encryption_flag, f'--parent={first_delta}', *samples[:2], CONCURRENCY_FLAG)
+        second_delta = enc[-1][len('*** 3/3: '):]
+        mfn, metadata = self._raw_manifest(second_delta)
+        self.assertEqual(mfn, {})
+        self.assertEqual(
+            (metadata['parent'], metadata['chain'], metadata['removed']), (first_delta, 2, ['third_sample.txt'])
+        )
+
+        # the chain is resolved for everything that reads the manifest
+        show_mfn = self.run_command(self.decryption_flag, '--dump-manifest', second_delta)
+        self.assertEqual(
+            [line for line in show_mfn if line.startswith('* ')], ['* another_sample.txt:', '* tiny_sample.txt:']
+        )
+        diff = self.run_command(self.decryption_flag, '--diff', base, second_delta)
+        self.assertEqual(diff, ['- third_sample.txt', 'M tiny_sample.txt'])
+
+        dec = self.run_command(self.decryption_flag, '--decrypt', second_delta)
+        self.assertEqual(dec, ['*** 1/2: another_sample.txt', '*** 2/2: tiny_sample.txt'])
+        with open(path.join(self.working_dir.name, 'tiny_sample.txt')) as f:
+            self.assertEqual(f.read(), 'changed')
+
+        # too long a chain is folded back into a full manifest
+        enc = self.run_command(
+            self.encryption_flag, f'--parent={second_delta}', '--max-chain=2', *samples[:2], CONCURRENCY_FLAG
+        )
+        mfn, metadata = self._raw_manifest(enc[-1][len('*** 3/3: '):])
+        self.assertEqual(list(mfn), ['another_sample.txt', 'tiny_sample.txt'])
+        self.assertNotIn('parent', metadata)
+
+    def test_catalog(self):
+        self.run_command(
+            self.encryption_flag, '--catalog=pog.catalog', self.tiny_sample, self.another_sample, CONCURRENCY_FLAG
+        )
+        with open(self.tiny_sample, 'wb') as f:
+            f.write(b'changed')
+        enc = self.run_command(self.encryption_flag, '--catalog=pog.catalog', self.tiny_sample, CONCURRENCY_FLAG)
+        second_manifest = enc[-1][len('*** 2/2: '):]
+        manifests = sorted(path.basename(m) for m in glob(path.join(self.working_dir.name, '*.mfn')))
+
+        found = self.run_command(self.decryption_flag, '--catalog=pog.catalog', '--find=tiny_sample.txt')
+        self.assertEqual([line.split(': ')[0] for line in found], manifests)
+        self.assertTrue(found[0].endswith(' (changed)'))
+        self.assertTrue(found[1].endswith(' (changed)'))
+
+        found = self.run_command(self.decryption_flag, '--catalog=pog.catalog', '--find=another_sample.txt')
+        self.assertEqual(len(found), 1)
+        self.assertEqual(
+            self.run_command(self.decryption_flag, '--catalog=pog.catalog', f'--find-blob={enc[1]}'),
+            [f'{second_manifest}: tiny_sample.txt']
+        )
+
+        # a fresh catalog, from the manifests themselves
+        self.run_command(self.decryption_flag, '--catalog=imported.catalog', '--catalog-import', *manifests)
+        self.assertEqual(
+            self.run_command(self.decryption_flag, '--catalog=imported.catalog', '--list-manifests'),
+            [f'{manifests[0]}: 2 files', f'{manifests[1]}: 1 files'],
+        )
+
+    def test_verify(self):
+        enc = self.run_command(self.encryption_flag, self.tiny_sample, self.another_sample, CONCURRENCY_FLAG)
+        manifest_name = glob(path.join(self.working_dir.name, '*.mfn'))[0]
+        blobs = [line for line in enc if not line.startswith('***')]
+
+        # everything is there
+        self.assertEqual(self.run_command(self.encryption_flag, '--verify', manifest_name), [])
+        dec = self.run_command(self.decryption_flag, '--verify', '--deep', manifest_name)
+        self.assertEqual(dec, ['*** 1/2: another_sample.txt', '*** 2/2: tiny_sample.txt'])
+
+        # flip a bit in one blob, delete the other
+        with open(path.join(self.working_dir.name, blobs[0]), 'r+b') as f:
+            f.seek(-1, 2)
+            last = f.read(1)
+            f.seek(-1, 2)
+            f.write(bytes([last[0] ^ 1]))
+        os_remove(path.join(self.working_dir.name, blobs[1]))
+
+        ver = self.run_command(self.encryption_flag, '--verify', manifest_name)
+        self.assertEqual(ver, [f'missing: {blobs[1]}'])
+
+        ver = self.run_command(self.decryption_flag, '--verify', '--deep', manifest_name)
+        self.assertEqual(ver, [
+            f'corrupt: {blobs[0]}',
+            '*** 1/2: another_sample.txt',
+            f'missing: {blobs[1]}',
+            '*** 2/2: tiny_sample.txt',
+        ])
+
+        # verify doesn't touch anything
+        paths = listdir(self.working_dir.name)
+        self.assertCountEqual(paths, [path.basename(manifest_name), blobs[0]])
+
+    def test_metrics(self):
+        metrics_json = path.join(self.working_dir.name, 'metrics.json')
+        metrics_prom = path.join(self.working_dir.name, 'pog.prom')
+        enc = self.run_command(self.encryption_flag, self.tiny_sample, self.another_sample, CONCURRENCY_FLAG,
+                               f'--metrics={metrics_json}', f'--metrics-textfile={metrics_prom}')
+        blobs = [line for line in enc if not line.startswith('***')]
+
+        with open(metrics_json) as f:
+            metrics = json.load(f)
+        stages = {s['stage']: s for s in metrics['stages']}
+        self.assertEqual(sorted(stages), ['compress', 'encrypt', 'hash', 'read', 'upload', 'write'])
+        self.assertEqual(stages['hash']['count'], 2)
+        self.assertEqual(stages['read']['bytes'], 18)
+        self.assertEqual(stages['upload']['count'], 3)  # 2 blobs + the manifest
+
+        blob_spans = {s['stage'] for s in metrics['spans'] if s['blob'] == blobs[0]}
+        self.assertEqual(blob_spans, {'compress', 'encrypt', 'hash', 'read', 'upload', 'write'})
+
+        with open(metrics_prom) as f:
+            self.assertIn('pog_stage_calls_total{stage="hash"} 2\n', f.read())
+
+    def test_json_progress(self):
+        enc = self.run_command(self.encryption_flag, self.tiny_sample, self.another_sample, CONCURRENCY_FLAG,
+                               '--progress=json')
+        events = [json.loads(line) for line in enc]
+        self.assertEqual([e['event'] for e in events], [
+            'start', 'file_start', 'blob', 'file_end', 'file_start', 'blob', 'file_end', 'manifest', 'done'
+        ])
+        self.assertEqual(events[0]['bytes'], 18)
+
+        blob = events[2]
+        self.assertEqual(blob['filename'], self.another_sample)
+        self.assertEqual(blob['blob'], self.another_sample_blobname)
+        self.assertEqual(blob['status'], 'uploaded')
+        self.assertEqual(blob['bytes_in'], 10)
+        self.assertEqual(blob['destinations'][0]['status'], 'uploaded')
+
+        file_end = events[6]
+        self.assertEqual(file_end['filename'], self.tiny_sample)
+        self.assertEqual((file_end['current'], file_end['total'], file_end['done_bytes']), (2, 3, 18))
+        self.assertEqual(file_end['eta'], 0)
+
+        manifest_name = events[-1]['manifest']
+        dec = self.cli.run_events(self.decryption_flag, '--decrypt', manifest_name, cwd=self.working_dir.name)
+        self.assertEqual([(e['event'], e['filename']) for e in dec], [
+            ('file_start', 'another_sample.txt'),
+            ('file_end', 'another_sample.txt'),
+            ('file_start', 'tiny_sample.txt'),
+            ('file_end', 'tiny_sample.txt'),
+        ])
+
     def test_consistency(self):
         # regression test for our header/encryption format -- try to decrypt a known file
         with open(path.join(self.working_dir.name, 'out.txt'), 'wb') as f:
@@ -157,6 +606,10 @@ class KeyfileTest(TestDirMixin, TestCase):
         show_mfn_idx = self.run_command(self.decryption_flag, '--dump-manifest-index', f'local:///{self.consistency_mfn}')
         self.assertEqual(show_mfn_idx, [self.consistency_blobname])
 
+        # --verify
+        ver = self.run_command(self.decryption_flag, '--verify', '--deep', f'local:///{self.consistency_mfn}')
+        self.assertEqual(ver, ['*** 1/1: 8.txt'])
+
         # --decrypt
         dec = self.run_command(self.decryption_flag, '--decrypt', f'local:///{self.consistency_mfn}')
         self.assertEqual(dec, ['*** 1/1: 8.txt'])
@@ -236,6 +689,49 @@ class KeyfileTest(TestDirMixin, TestCase):
             ]
         )
 
+    def test_stdin(self):
+        dump = path.join(self.input_dir.name, 'dump.sql')
+        with open(dump, 'wb') as f:
+            f.write(urandom(150000))
+
+        with Popen(['cat', dump], stdout=PIPE) as producer:
+            enc = self.run_command(
+                self.encryption_flag, '--chunk-size=50000', '--stdin-name=backups/dump.sql', '-', self.tiny_sample,
+                CONCURRENCY_FLAG, stdin=producer.stdout
+            )
+        manifest_name = enc[-1][len('*** 3/3: '):]
+        self.assertIn('*** 2/3: backups/dump.sql', enc)
+
+        flag, keyfile = self.decryption_flag.split('=', 1)
+        mfn = Decryptor(*get_keys({flag: keyfile})).load_manifest(path.join(self.working_dir.name, manifest_name))
+        self.assertEqual(list(mfn), ['backups/dump.sql', 'tiny_sample.txt'])
+        self.assertEqual(mfn['backups/dump.sql']['size'], 150000)
+        self.assertGreater(len(mfn['backups/dump.sql']['blobs']), 1)
+
+        self.run_command(self.decryption_flag, '--decrypt', manifest_name)
+        self.assertEqual(
+            compute_checksum(path.join(self.working_dir.name, 'backups', 'dump.sql')), compute_checksum(dump)
+        )
+
+    def test_exclude(self):
+        with open(path.join(self.input_dir.name, 'scratch.tmp'), 'wb') as f:
+            f.write(b'temporary')
+        with open(path.join(self.input_dir.name, '.pogignore'), 'w') as f:
+            f.write('another_*\n')
+
+        enc = self.run_command(
+            self.encryption_flag, self.input_dir.name, '--exclude=*.tmp', '--store-absolute-paths', CONCURRENCY_FLAG
+        )
+        self.assertEqual(enc[0], f'*** 1/2: {self.tiny_sample}')
+
+        flag, keyfile = self.decryption_flag.split('=', 1)
+        mfn, metadata = Decryptor(*get_keys({flag: keyfile})).load_manifest(
+            path.join(self.working_dir.name, enc[-1][len('*** 2/2: '):]), with_metadata=True
+        )
+        self.assertEqual(list(mfn), [self.tiny_sample])
+        self.assertEqual(metadata['exclude'], ['*.tmp'])
+        self.assertEqual(metadata['pogignore'], {self.input_dir.name: ['another_*']})
+
 
 class AsymmetricCryptoTest(KeyfileTest):
     encryption_flag = f'--encryption-keyfile={POG_ROOT}/tests/samples/only_for_testing.encrypt'
@@ -247,6 +743,114 @@ class AsymmetricCryptoTest(KeyfileTest):
     consistency_mfn = 'asymmetric-sample.mfn'
     consistency_blobname = 'hq3mhX2mG_i_aVy2wv6jMGC5DjlerpvJ8O1Y_iayfPY='
 
+    def test_delta_manifest(self):
+        # the encryption keyfile can't read the parent manifest
+        enc = self.run_command(self.encryption_flag, self.tiny_sample, CONCURRENCY_FLAG)
+        base = enc[-1][len('*** 2/2: '):]
+        self.run_command(self.encryption_flag, f'--parent={base}', self.tiny_sample, CONCURRENCY_FLAG)
+        self.assertEqual(glob(path.join(self.working_dir.name, '*.mfn')), [path.join(self.working_dir.name, base)])
+
+    def test_verify_deep_needs_decryption_key(self):
+        self.run_command(self.encryption_flag, self.tiny_sample, CONCURRENCY_FLAG)
+        manifest_name = glob(path.join(self.working_dir.name, '*.mfn'))[0]
+
+        res = self.run_command(self.encryption_flag, '--verify', '--deep', manifest_name, stderr=STDOUT)
+        self.assertEqual(len(res), 1)
+        self.assertIn('--verify --deep decrypts every blob, so it needs --keyfile or --decryption-keyfile', res[0])
+
+    def test_session_key(self):
+        enc = self.run_command(
+            self.encryption_flag, '--session-key', self.tiny_sample, self.another_sample, CONCURRENCY_FLAG
+        )
+        blobs = [line for line in enc if not line.startswith('***')]
+        # blob names don't depend on how their keys are wrapped
+        self.assertEqual(blobs, [self.another_sample_blobname, self.tiny_sample_blobname])
+
+        sessions = glob(path.join(self.working_dir.name, '*.session'))
+        self.assertEqual(len(sessions), 1)
+        for blob in blobs:
+            with open(path.join(self.working_dir.name, blob), 'rb') as f:
+                header = f.read(16)
+            self.assertEqual(header, b'POGSESS\x01' + bytes.fromhex(path.basename(sessions[0])[:16]))
+
+        manifest_name = glob(path.join(self.working_dir.name, '*.mfn'))[0]
+        res = self.run_command(self.decryption_flag, '--verify', '--deep', manifest_name, stderr=STDOUT)
+        self.assertIn('0 missing, 0 corrupt', res[-1])
+
+        dec = self.run_command(self.decryption_flag, '--decrypt', manifest_name)
+        self.assertEqual(dec, ['*** 1/2: another_sample.txt', '*** 2/2: tiny_sample.txt'])
+        with open(path.join(self.working_dir.name, 'tiny_sample.txt')) as f:
+            self.assertEqual(f.read(), 'aaaabbbb')
+
+    def test_verify_session_key(self):
+        enc = self.run_command(
+            self.encryption_flag, '--session-key', self.tiny_sample, self.another_sample, CONCURRENCY_FLAG
+        )
+        blobs = [line for line in enc if not line.startswith('***')]
+        manifest_name = glob(path.join(self.working_dir.name, '*.mfn'))[0]
+        session = path.basename(glob(path.join(self.working_dir.name, '*.session'))[0])
+
+        # the manifest lists the session key file with the blobs that need it
+        index = self.run_command(self.encryption_flag, '--dump-manifest-index', manifest_name)
+        self.assertEqual(index, sorted(blobs + [session]))
+
+        # without it, nothing in the run can be decrypted
+        os_remove(path.join(self.working_dir.name, session))
+        res = self.run_command(self.encryption_flag, '--verify', manifest_name, stderr=STDOUT)
+        self.assertEqual(res[0], f'missing: {session}')
+        self.assertIn('1 missing, 0 corrupt', res[-1])
+
+        res = self.run_command(self.decryption_flag, '--verify', '--deep', manifest_name, stderr=STDOUT)
+        self.assertEqual(res[:-1], [
+            f'missing: {session}',
+            '*** 1/2: another_sample.txt',
+            f'missing: {session}',
+            '*** 2/2: tiny_sample.txt',
+        ])
+        self.assertIn('1 missing, 0 corrupt', res[-1])
+
+    def test_resume_session_key(self):
+        # the first run was interrupted after tiny_sample made it out, sealed under its session
+        self.run_command(self.encryption_flag, '--session-key', self.tiny_sample, CONCURRENCY_FLAG)
+        for mfn in glob(path.join(self.working_dir.name, '*.mfn')):
+            os_remove(mfn)
+        first_session = path.basename(glob(path.join(self.working_dir.name, '*.session'))[0])
+
+        flag, keyfile = self.encryption_flag.split('=', 1)
+        secret, _ = get_keys({flag: keyfile})
+        journal = Journal(path.join(self.working_dir.name, 'backup.journal'), SecretBox(secret))
+        journal.open([
+            {'run': {
+                'manifest': 'resumed.mfn', 'blob_naming': 'sha256', 'blob_identity': 'compressed',
+                'chunk_size': 100000000, 'store_absolute_paths': False,
+            }},
+            {'session': first_session},
+            {'blob': self.tiny_sample_blobname},
+            {'file': self.tiny_sample, 'blobs': [self.tiny_sample_blobname], 'atime': SAMPLE_TIME1,
+             'mtime': SAMPLE_TIME1, 'size': 8},
+        ])
+        journal.close()
+
+        self.run_command(
+            self.encryption_flag, '--session-key', '--journal=backup.journal', '--resume', self.tiny_sample,
+            self.another_sample, CONCURRENCY_FLAG
+        )
+        sessions = sorted(path.basename(f) for f in glob(path.join(self.working_dir.name, '*.session')))
+        self.assertEqual(len(sessions), 2)
+
+        # the resumed file still needs the interrupted run's session, so the manifest lists both
+        index = self.run_command(self.encryption_flag, '--dump-manifest-index', 'resumed.mfn')
+        self.assertEqual(index, sorted([self.another_sample_blobname, self.tiny_sample_blobname] + sessions))
+
+        dec = self.run_command(self.decryption_flag, '--decrypt', 'resumed.mfn')
+        self.assertEqual(dec, ['*** 1/2: another_sample.txt', '*** 2/2: tiny_sample.txt'])
+        with open(path.join(self.working_dir.name, 'tiny_sample.txt')) as f:
+            self.assertEqual(f.read(), 'aaaabbbb')
+
+        os_remove(path.join(self.working_dir.name, first_session))
+        res = self.run_command(self.encryption_flag, '--verify', 'resumed.mfn', stderr=STDOUT)
+        self.assertEqual(res[0], f'missing: {first_session}')
+
     def test_manifest_index_ordering(self):
         '''
         We sort the blobs stored in the manifest index, to limit information about which blobs belong together.
@@ -390,3 +994,23 @@ class BigFileTest(TestDirMixin, TestCase):
         filename = path.join(self.working_dir.name, 'big_sample.bin')
         actual_checksum = compute_checksum(filename)
         self.assertEqual(BigFileTest.big_sample_checksum, actual_checksum)
+
+    def test_process_workers(self):
+        # a worker process hands blobs over one at a time, in order
+        enc = self.run_command(
+            f'--encryption-keyfile={POG_ROOT}/tests/samples/only_for_testing.encrypt', BigFileTest.big_sample,
+            '--chunk-size=50MB', '--workers=process'
+        )
+        manifest_name = glob(path.join(self.working_dir.name, '*.mfn'))[0]
+        self.assertEqual(enc[1:-1], [
+            'PURfe1ei1aqpPRarpAfKkcKPRSHdo5hPH-bvfYND2KM=',
+            'nnL4ta-BChpb36CIFeZUG4lJLiz8l0YVv94IaABcgyU=',
+            'YdK86P4e2191CxVBhZwvvPtwOLU6Ve1NzMhwLjxVXqg=',
+        ])
+
+        dec = self.run_command(f'--decryption-keyfile={POG_ROOT}/tests/samples/only_for_testing.decrypt', '--consume',
+                               manifest_name)
+        self.assertEqual(dec, ['*** 1/1: big_sample.bin'])
+        self.assertEqual(listdir(self.working_dir.name), ['big_sample.bin'])
+        actual_checksum = compute_checksum(path.join(self.working_dir.name, 'big_sample.bin'))
+        self.assertEqual(BigFileTest.big_sample_checksum, actual_checksum)
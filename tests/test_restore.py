@@ -0,0 +1,77 @@
+from os import listdir, path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from pog.lib.restore import BlobCache, RestorePlan
+
+
+class RestorePlanTest(TestCase):
+    mfn = {
+        'a.txt': {'blobs': ['1', '2'], 'size': 8},
+        'b.txt': {'blobs': ['2', '3'], 'size': 8},
+        'copy/a.txt': {'blobs': ['1', '2'], 'size': 8},
+        'sparse.img': {'blobs': ['1', '2'], 'size': 1008, 'holes': [[0, 1000]]},
+        'empty': {'blobs': [], 'size': 0},
+        'empty2': {'blobs': [], 'size': 0},
+    }
+
+    def test_plan(self):
+        plan = RestorePlan(self.mfn)
+        self.assertEqual([filename for _, filename, _ in plan.entries], list(self.mfn))
+        self.assertEqual(plan.copies, {'copy/a.txt': 'a.txt', 'empty2': 'empty'})
+        self.assertEqual(plan.copy_of('copy/a.txt'), 'a.txt')
+        self.assertIsNone(plan.copy_of('sparse.img'))
+        # copies don't need any blobs
+        self.assertEqual(dict(plan.uses), {'1': 2, '2': 3, '3': 1})
+
+    def test_partials(self):
+        plan = RestorePlan(self.mfn, {'b.txt', 'copy/a.txt'})
+        self.assertEqual([(count, filename) for count, filename, _ in plan.entries], [(1, 'b.txt'), (2, 'copy/a.txt')])
+        self.assertEqual(plan.copies, {})
+        self.assertEqual(dict(plan.uses), {'1': 1, '2': 2, '3': 1})
+
+
+class BlobCacheTest(TestCase):
+    def setUp(self):
+        self.temp_dir = TemporaryDirectory()
+        self.download = path.join(self.temp_dir.name, 'download')
+        with open(self.download, 'wb') as f:
+            f.write(b'x' * 100)
+
+    def tearDown(self):
+        with self.temp_dir:
+            pass
+
+    def cache(self, uses, max_bytes=1000):
+        return BlobCache(uses, self.temp_dir.name, max_bytes)
+
+    def test_kept_until_last_use(self):
+        cache = self.cache({'a': 2, 'b': 1})
+        cache.add('a', self.download)
+        cache.add('b', self.download)  # only needed once
+        self.assertEqual(sorted(cache.paths), ['a'])
+        self.assertEqual(cache.bytes, 100)
+
+        self.assertEqual(cache.used('a'), 1)
+        cached = cache.get('a')
+        with open(cached, 'rb') as f:
+            self.assertEqual(f.read(), b'x' * 100)
+
+        self.assertEqual(cache.used('a'), 0)
+        self.assertIsNone(cache.get('a'))
+        self.assertFalse(path.exists(cached))
+        self.assertEqual(cache.bytes, 0)
+        self.assertEqual(sorted(listdir(self.temp_dir.name)), ['download'])
+
+    def test_bounded(self):
+        cache = self.cache({'a': 2, 'b': 2, 'c': 2}, max_bytes=250)
+        for blob in ('a', 'b', 'c'):
+            cache.add(blob, self.download)
+        self.assertEqual(sorted(cache.paths), ['a', 'b'])
+        self.assertIsNone(cache.get('c'))
+
+        # room frees up as blobs are done with
+        cache.used('a')
+        cache.used('a')
+        cache.add('c', self.download)
+        self.assertEqual(sorted(cache.paths), ['b', 'c'])
@@ -109,3 +109,27 @@ class s3fsTest(TestCase):
         mock_boto.client.assert_called_once_with('s3')
         mock_boto.get_paginator.assert_called_once_with('list_objects_v2')
         mock_boto.paginate.assert_called_once_with(Bucket='bucket', Prefix='', Delimiter='/')
+
+    def test_list_data(self, mock_boto):
+        mock_boto.client.return_value = mock_boto
+        mock_boto.get_paginator.return_value = mock_boto
+
+        def paginate(Bucket, Prefix, **kwargs):
+            if Prefix == 'data/':
+                self.assertEqual(kwargs, {'Delimiter': '/'})
+                return [{
+                    'CommonPrefixes': [{'Prefix': 'data/ab/'}, {'Prefix': 'data/cd/'}],
+                    'Contents': [{'Key': 'data/unsharded'}],
+                }]
+            self.assertEqual(kwargs, {})
+            return [
+                {'Contents': [{'Key': f'{Prefix}1'}]},
+                {'Contents': [{'Key': f'{Prefix}2'}]},
+            ]
+        mock_boto.paginate.side_effect = paginate
+
+        self.assertEqual(
+            sorted(self.fs.list_data(concurrency=2)),
+            ['data/ab/1', 'data/ab/2', 'data/cd/1', 'data/cd/2', 'data/unsharded']
+        )
+        self.assertEqual(mock_boto.paginate.call_count, 3)
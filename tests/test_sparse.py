@@ -0,0 +1,110 @@
+from os import path, stat
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from pog.lib.sparse import SparseReader, SparseWriter, ZERO_BLOCK, copy_sparse, data_extents
+
+
+MB = 1024 * 1024
+
+
+class SparseTest(TestCase):
+    def setUp(self):
+        self.test_dir = TemporaryDirectory()
+        self.filename = path.join(self.test_dir.name, 'disk.img')
+
+    def tearDown(self):
+        with self.test_dir:
+            pass
+
+    def make_sparse_file(self):
+        # hole, 1MB of data, hole, 100 bytes of data, hole
+        with open(self.filename, 'wb') as f:
+            f.seek(4 * MB)
+            f.write(b'a' * MB)
+            f.seek(8 * MB)
+            f.write(b'b' * 100)
+            f.truncate(12 * MB)
+
+    def has_holes(self):
+        with open(self.filename, 'rb') as f:
+            return data_extents(f, path.getsize(self.filename)) != [(0, 12 * MB)]
+
+    def round_trip(self, reader):
+        data = b''
+        while True:
+            chunk = reader.read(300000)
+            if not chunk:
+                break
+            data += chunk
+
+        restored = path.join(self.test_dir.name, 'restored.img')
+        with open(restored, 'wb') as f:
+            out = SparseWriter(f, reader.holes, 12 * MB)
+            out.write(data[:1000])
+            out.write(data[1000:])
+            out.close()
+
+        with open(self.filename, 'rb') as f, open(restored, 'rb') as r:
+            self.assertEqual(f.read(), r.read())
+        return data, restored
+
+    def test_holes(self):
+        self.make_sparse_file()
+        if not self.has_holes():
+            self.skipTest('filesystem does not report holes')
+
+        with open(self.filename, 'rb') as f:
+            reader = SparseReader(f, path.getsize(self.filename))
+            data, restored = self.round_trip(reader)
+
+        self.assertEqual(data[:MB], b'a' * MB)
+        self.assertEqual(data[MB:MB+100], b'b' * 100)
+        self.assertEqual(reader.holes[0], [0, 4 * MB])
+        self.assertEqual(sum(h[1] for h in reader.holes) + len(data), 12 * MB)
+        self.assertLess(stat(restored).st_blocks * 512, 4 * MB)
+
+    def test_detect_zeros(self):
+        with open(self.filename, 'wb') as f:
+            f.write(bytes(3 * ZERO_BLOCK))
+            f.write(b'c' * 10 + bytes(ZERO_BLOCK - 10))
+            f.write(bytes(ZERO_BLOCK))
+            f.write(b'd' * ZERO_BLOCK)
+            f.truncate(12 * MB)
+
+        with open(self.filename, 'rb') as f:
+            reader = SparseReader(f, path.getsize(self.filename), detect_zeros=True)
+            data, _ = self.round_trip(reader)
+
+        # zeros inside a block with data are kept
+        self.assertEqual(data, b'c' * 10 + bytes(ZERO_BLOCK - 10) + b'd' * ZERO_BLOCK)
+        self.assertEqual(reader.holes, [[0, 3 * MB], [4 * MB, MB], [6 * MB, 6 * MB]])
+
+    def test_dense(self):
+        with open(self.filename, 'wb') as f:
+            f.write(b'0123456789')
+
+        with open(self.filename, 'rb') as f:
+            reader = SparseReader(f, 10, detect_zeros=True)
+            self.assertEqual(reader.read(4), b'0123')
+            self.assertEqual(reader.read(), b'456789')
+            self.assertEqual(reader.read(), b'')
+        self.assertEqual(reader.holes, [])
+
+    def test_writer_trailing_hole(self):
+        with open(self.filename, 'wb') as f:
+            out = SparseWriter(f, [[0, 2], [4, 3], [9, 5]], 14)
+            out.write(b'abcd')
+            out.close()
+        with open(self.filename, 'rb') as f:
+            self.assertEqual(f.read(), b'\0\0ab\0\0\0cd' + bytes(5))
+
+    def test_copy_sparse(self):
+        self.make_sparse_file()
+        copy = path.join(self.test_dir.name, 'copy.img')
+        copy_sparse(self.filename, copy, [[0, 4 * MB], [5 * MB, 3 * MB], [8 * MB + 100, 4 * MB - 100]], 12 * MB)
+
+        with open(self.filename, 'rb') as f, open(copy, 'rb') as c:
+            self.assertEqual(f.read(), c.read())
+        if self.has_holes():
+            self.assertLess(stat(copy).st_blocks * 512, 4 * MB)
@@ -0,0 +1,129 @@
+from datetime import datetime
+from os import path, utime
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import patch
+
+from pog.fs.localfs import localfs
+from pog.lib.throttle import Throttle, TokenBucket, parse_limits, parse_schedule
+
+
+class FakeClock():
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class ParseTest(TestCase):
+    def test_parse_limits(self):
+        self.assertEqual(parse_limits('10MB'), {None: 10000000})
+        self.assertEqual(parse_limits('s3=2MB, b2:mybucket=1KiB'), {'s3': 2000000, 'b2:mybucket': 1024})
+        self.assertEqual(parse_limits('5MB,local=off'), {None: 5000000, 'local': 0})
+        self.assertEqual(parse_limits(None), {})
+
+    def test_parse_schedule(self):
+        schedule = parse_schedule('''
+            # office hours
+            08:00-18:00 s3=2MB,b2=1MB
+            22:00-06:00 off
+            10MB
+        ''')
+        self.assertEqual(schedule, [
+            ((480, 1080), {'s3': 2000000, 'b2': 1000000}),
+            ((1320, 360), {None: 0}),
+            (None, {None: 10000000}),
+        ])
+
+
+class TokenBucketTest(TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        for name in ('monotonic', 'sleep'):
+            p = patch(f'pog.lib.throttle.{name}', getattr(self.clock, name))
+            p.start()
+            self.addCleanup(p.stop)
+
+    def test_unlimited(self):
+        bucket = TokenBucket()
+        self.assertEqual(bucket.consume(10**9), 0)
+        self.assertEqual(self.clock.now, 1000.0)
+
+    def test_rate(self):
+        bucket = TokenBucket(1000)
+        # we start with a second's worth
+        self.assertEqual(bucket.consume(1000), 0)
+        # ...and then pay for what we take
+        bucket.consume(500)
+        self.assertAlmostEqual(self.clock.now, 1000.5)
+        bucket.consume(3000)
+        self.assertAlmostEqual(self.clock.now, 1003.5)
+
+        # idle time refills it, but only up to a second's worth
+        self.clock.now += 10
+        self.assertEqual(bucket.consume(1000), 0)
+
+    def test_rate_change(self):
+        bucket = TokenBucket(1000)
+        bucket.consume(1000)
+        bucket.set_rate(4000)
+        bucket.consume(2000)
+        self.assertAlmostEqual(self.clock.now, 1000.5)
+
+        bucket.set_rate(None)
+        bucket.consume(10**9)
+        self.assertAlmostEqual(self.clock.now, 1000.5)
+
+
+class ThrottleTest(TestCase):
+    def setUp(self):
+        self.test_dir = TemporaryDirectory()
+
+    def tearDown(self):
+        with self.test_dir:
+            pass
+
+    def test_disabled(self):
+        self.assertIsNone(Throttle().callback('s3:bucket'))
+
+    def test_per_destination(self):
+        throttle = Throttle('10MB,s3=2MB')
+        throttle.callback('s3:bucket')(1)
+        throttle.callback('b2:bucket')(1)
+        throttle.callback('s3:other')(1)
+        self.assertEqual(throttle.total.rate, 10000000)
+        self.assertEqual(throttle.buckets['s3:bucket'].rate, 2000000)
+        self.assertEqual(throttle.buckets['s3:other'].rate, 2000000)
+        self.assertEqual(throttle.buckets['b2:bucket'].rate, None)
+
+    def test_schedule_file(self):
+        schedule_file = path.join(self.test_dir.name, 'bwlimit')
+        with open(schedule_file, 'w') as f:
+            f.write('08:00-18:00 s3=2MB\n')
+
+        throttle = Throttle('5MB', schedule_file)
+        self.assertEqual(throttle.active_limits(datetime(2020, 1, 1, 9, 30)), {'s3': 2000000})
+        self.assertEqual(throttle.active_limits(datetime(2020, 1, 1, 18, 0)), {None: 5000000})
+
+        with open(schedule_file, 'w') as f:
+            f.write('s3=1MB\n')
+        utime(schedule_file, ns=(0, 1))  # in case the filesystem's clock is coarse
+        throttle.reload()
+        throttle.callback('s3:bucket')(1)
+        self.assertEqual(throttle.buckets['s3:bucket'].rate, 1000000)
+        self.assertEqual(throttle.total.rate, None)
+
+    def test_localfs_callback(self):
+        src = path.join(self.test_dir.name, 'src')
+        with open(src, 'wb') as f:
+            f.write(b'a' * (3 * 1024 * 1024 + 5))
+
+        sizes = []
+        localfs(root=self.test_dir.name).upload_file(src, 'dst', callback=sizes.append)
+        self.assertEqual(sizes, [1024 * 1024] * 3 + [5])
+        with open(path.join(self.test_dir.name, 'dst'), 'rb') as f:
+            self.assertEqual(len(f.read()), 3 * 1024 * 1024 + 5)